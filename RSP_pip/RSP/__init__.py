@@ -1,11 +1,9 @@
-from pkg_resources import get_distribution
+from importlib import import_module
 try:
-    __version__ = get_distribution('RSP').version
+    from importlib.metadata import version
+    __version__ = version('RSP')
 except:
-    try:
-        __version__ = pkg_resources.resorce_filename('RSP', VERSION)
-    except:
-        __version__ = 'local'
+    __version__ = 'local'
 
 __all__ = [
     'modules',
@@ -14,4 +12,8 @@ __all__ = [
     'config'
     ]
 
-from RSP import *
+## subpackages are imported when first used
+def __getattr__(name):
+    if name in __all__:
+        return (import_module('RSP.' + name))
+    raise AttributeError("module 'RSP' has no attribute '%s'" %name)
@@ -3,5 +3,10 @@ __all__ = [
 	'set_config'	
 ]
 
-from RSP.config import *
+## modules are imported when first used (e.g. from RSP.config import x)
+from importlib import import_module
+def __getattr__(name):
+	if name in __all__:
+		return (import_module('RSP.config.' + name))
+	raise AttributeError("module 'RSP.config' has no attribute '%s'" %name)
 
@@ -20,10 +20,10 @@ import shutil
 from io import open
 from sys import argv
 import subprocess
+import functools
 import pandas as pd
 from termcolor import colored
 from distutils.version import LooseVersion
-import pkg_resources
 
 ## import my modules
 import HCGB.functions.main_functions as HCGB_main
@@ -54,12 +54,15 @@ def file_list(wanted_data):
 ##################
 ## Software
 ##################
+@functools.lru_cache(maxsize=None)
 def read_dependencies():
 	"""Returns a dictionary containing the executable name for each software.
 
 	It uses :func:`RSP.config.extern_progs.file_list` to retrieve absolute path
 	for file :file:`RSP/config/software/dependencies.csv`. It then reads csv into pandas
 	dataframe using :func:`RSP.scripts.functions.main_functions.get_data` and returns it.	
+
+	The file is only read once for each process: do not modify the dataframe returned.
 	"""
 
 	## read from file: prog2default.csv
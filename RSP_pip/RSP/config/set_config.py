@@ -13,10 +13,15 @@ import re
 import shutil
 from io import open
 from sys import argv
+import json
+import time
+import signal
 import subprocess
+import threading
+import concurrent.futures
+import pandas as pd
 from termcolor import colored
 from distutils.version import LooseVersion
-import pkg_resources
 
 ## import my modules
 from HCGB import functions
@@ -26,16 +31,115 @@ from RSP.config import extern_progs
 ## Software
 ################
 
+################
+## Cache of executables and versions
+################
+## process-wide: (software, executable, $PATH): (path, version)
+exe_cache = {}
+
+## on disk: software and binary (path, modification time, inode and size): version
+version_cache = None
+version_cache_lock = threading.Lock()
+
+##################
+def tool_cache_file():
+	"""File caching versions of executables: $RSP_TOOL_CACHE or ~/.cache/RSP/tool_versions.json"""
+	if os.environ.get('RSP_TOOL_CACHE'):
+		return (os.environ['RSP_TOOL_CACHE'])
+	cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+	return (os.path.join(cache_dir, 'RSP', 'tool_versions.json'))
+
+##################
+def binary_stamp(path):
+	"""Modification time, inode and size of the binary (symbolic links resolved)"""
+	stat = os.stat(path)
+	return ([stat.st_mtime_ns, stat.st_ino, stat.st_size])
+
+##################
+def load_version_cache():
+	"""Reads versions cached on disk, if any"""
+	try:
+		with open(tool_cache_file()) as cache_hd:
+			return (json.load(cache_hd))
+	except (OSError, ValueError):
+		return ({})
+
+##################
+def save_version_cache():
+	"""Writes versions cached on disk (ignored if not writable)"""
+	cache_file = tool_cache_file()
+	try:
+		os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+		tmp_file = "%s.%s.tmp" %(cache_file, os.getpid())
+		with open(tmp_file, 'w') as cache_hd:
+			json.dump(version_cache, cache_hd, indent=1)
+		os.replace(tmp_file, cache_file)
+	except OSError:
+		pass
+
+##################
+def clear_tool_cache():
+	"""Removes executables and versions cached (process and disk), e.g. to check dependencies again"""
+	global version_cache
+	with version_cache_lock:
+		exe_cache.clear()
+		version_cache = {}
+		if os.path.isfile(tool_cache_file()):
+			os.remove(tool_cache_file())
+
+##################
+def cached_version(prog, path, Debug=False, timeout=None):
+	"""Version of the binary given, probed only if not cached or the binary changed (see get_version)"""
+	global version_cache
+	key = prog + ':' + os.path.realpath(path)
+	stamp = binary_stamp(path)
+	with version_cache_lock:
+		if version_cache is None:
+			version_cache = load_version_cache()
+		entry = version_cache.get(key)
+	if entry and entry['stamp'] == stamp:
+		if (Debug):
+			print(colored("** Debug: version cached for %s: %s" %(path, entry['version']),'yellow'))
+		return (entry['version'])
+
+	version = get_version(prog, path, Debug=Debug, timeout=timeout)
+	if version != 'n.a.':
+		with version_cache_lock:
+			version_cache = dict(load_version_cache(), **version_cache)
+			version_cache[key] = { 'stamp': stamp, 'version': version }
+			save_version_cache()
+	return (version)
+
 ##################
 def get_exe(prog, Debug=False, Return_Version=False):
 	"""Return absolute path of the executable program requested.
 
 	Given a program name it returns its executable to be called. It has to fulfilled a minimum version specified.
 
+	Executables are searched once for each process and versions are cached on disk 
+	(see :func:`RSP.config.set_config.cached_version`).
+
 	:param prog: Software name
 	:type prog: string
 	:returns: Absolute path for the executable requested
 	:warning: if no executable available in system ``$PATH`` or not fulfilling the expected version.
+	"""
+	cache_key = (prog, os.environ.get(prog, ''), os.environ.get('PATH', ''))
+	if cache_key not in exe_cache:
+		exe_cache[cache_key] = find_exe(prog, Debug=Debug)
+
+	if (Return_Version):
+		return (exe_cache[cache_key])
+	return (exe_cache[cache_key][0])
+
+##################
+def find_exe(prog, Debug=False):
+	"""Return absolute path and version of the executable program requested.
+
+	:param prog: Software name
+	:type prog: string
+	:returns: Tuple with absolute path and version for the executable requested
+	:warning: if no executable available in system ``$PATH`` or not fulfilling the expected version.
 
 	.. attention:: Be aware of Copyright
 
@@ -46,7 +150,7 @@ def get_exe(prog, Debug=False, Return_Version=False):
 	"""
 	exe = ""
 	if prog in os.environ: 
-		exe = os.environ[env_var] ## python environent variables
+		exe = os.environ[prog] ## python environent variables
 	else:
 		exe = extern_progs.return_defatult_soft(prog) ## install in the system
 
@@ -69,26 +173,17 @@ def get_exe(prog, Debug=False, Return_Version=False):
 	## no min version available
 	if min_version == 'na':
 		if exe_path_tmp:
-			if (Return_Version):
-				return (exe_path_tmp[0], '') ## return first item
-			else:
-				return (exe_path_tmp[0]) ## return first item
+			return (exe_path_tmp[0], '') ## return first item
 	
 	## not installed in path
 	if exe_path_tmp is None or len(exe_path_tmp) == 0:
-		if (Return_Version):
-			print(colored("\n**ERROR: Software %s could not be found." % prog,'red'))
-			exit()
-			return('ERROR', 'n.a.')
-		else:
-			print(colored("\n**ERROR: Software %s could not be found." % prog,'red'))
-			exit()
-			return('ERROR')
-		
+		print(colored("\n**ERROR: Software %s could not be found." % prog,'red'))
+		exit()
+		return('ERROR', 'n.a.')
 
 	## Loop for all possibilities
 	for p in exe_path_tmp:
-		prog_ver = get_version(prog, p, Debug=Debug)
+		prog_ver = cached_version(prog, p, Debug=Debug)
 
 		if (Debug):
 			print (colored("** Debug: Software: %s\nPath: %s\nVersion: %s" %(prog, p, prog_ver), 'yellow'))
@@ -97,10 +192,7 @@ def get_exe(prog, Debug=False, Return_Version=False):
 			continue
 
 		if LooseVersion(prog_ver) >= LooseVersion(min_version):
-			if (Return_Version):
-				return (p, prog_ver)
-			else:
-				return (p)
+			return (p, prog_ver)
 
 
 	print(colored("\n**ERROR: Software %s version smaller than minimum version expected %s." %(prog,min_version),'red'))
@@ -169,7 +261,7 @@ def my_which(cmd):
 	# current directory, e.g. ./script
 	if os.path.dirname(cmd):
 		if access_check(cmd):
-			return cmd
+			return [cmd]
 		return None
 
 	use_bytes = isinstance(cmd, bytes)
@@ -223,7 +315,22 @@ def my_which(cmd):
 		return None
 
 ##################
-def get_version(prog, path, Debug=False):
+def run_probe(cmd, timeout=None):
+	"""Runs a command (e.g. version or package check) killing it and its children if it takes longer than timeout.
+
+	:returns: Tuple with exit code (None if timeout) and list of lines of stdout and stderr
+	"""
+	process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+	try:
+		(stdout, stderr) = process.communicate(timeout=timeout)
+	except subprocess.TimeoutExpired:
+		os.killpg(process.pid, signal.SIGKILL)
+		process.communicate()
+		return (None, [])
+	return (process.returncode, functions.main_functions.decode(stdout).split('\n')[:-1] + functions.main_functions.decode(stderr).split('\n')[:-1])
+
+##################
+def get_version(prog, path, Debug=False, timeout=None):
 	"""Get version of software
 
 	Given a program name and expected path, tries to determine its version.
@@ -231,10 +338,12 @@ def get_version(prog, path, Debug=False):
 	:param prog: Program name
 	:param path: Absolute path
 	:param Debug: True/False
+	:param timeout: Seconds to wait for the version command (no limit if None)
 
 	:type prog: string
 	:type path: string 
 	:type Debug: bool
+	:type timeout: int
 
 	:returns: String containing version. Returns NA message if no found and raises attention error message.
 
@@ -272,13 +381,12 @@ def get_version(prog, path, Debug=False):
 
 	if prog == 'sRNAbench' or prog == "miraligner":
 		java_bin = get_exe('java', Debug=Debug)
-		java_jar = java_bin + ' -jar ' + path + ' ' + args
-		cmd_output = subprocess.Popen(java_jar, shell=True, stdout=subprocess.PIPE,stderr=subprocess.PIPE).communicate()
-	else:
-		cmd_output = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+		cmd = java_bin + ' -jar ' + path + ' ' + args
 
-	## decode command
-	cmd_output = functions.main_functions.decode(cmd_output[0]).split('\n')[:-1] + functions.main_functions.decode(cmd_output[1]).split('\n')[:-1]
+	(code, cmd_output) = run_probe(cmd, timeout)
+	if code is None:
+		print (colored("** Attention: %s did not finish in %s seconds: %s" %(prog, timeout, cmd), 'yellow'))
+		return ("n.a.")
 
 	## debug messages
 	if (Debug):
@@ -297,66 +405,141 @@ def get_version(prog, path, Debug=False):
 
 	return("n.a.")
 
-def check_dependencies(Debug):
+def unique_binaries(paths):
+	"""Paths pointing to different binaries: the same file might be available in several $PATH folders or links"""
+	binaries = []
+	seen = set()
+	for path in paths or []:
+		real_path = os.path.realpath(path)
+		if real_path not in seen:
+			seen.add(real_path)
+			binaries.append(path)
+	return (binaries)
+
+################
+def probe_software(soft, timeout=60, Debug=False):
+	"""Searches a software and its version, without exiting if not available (see get_exe)
+
+	Each binary found in $PATH is probed once, with a timeout.
+
+	:param soft: Software name (see dependencies.csv)
+	:param timeout: Seconds to wait for each version command
+	:param Debug: True/False for debugging messages
+
+	:returns: Dictionary with software, name, min_version, path, version and candidates
+	"""
+	dependencies_pd = extern_progs.read_dependencies()
+	soft_name = dependencies_pd.loc[soft, 'soft_name']
+	min_version = dependencies_pd.loc[soft, 'min_version']
+	candidates = unique_binaries(my_which(os.environ.get(soft, soft_name)))
+
+	result = { 'software': soft, 'name': soft_name, 'min_version': min_version, 
+			'path': '', 'version': 'n.a.', 'candidates': candidates }
+	if candidates and min_version == 'na':
+		result.update(path=candidates[0], version='ok')
+		return (result)
+
+	for path in candidates:
+		version = cached_version(soft, path, Debug=Debug, timeout=timeout)
+		if (version == 'n.a.'):
+			continue
+		if LooseVersion(version) >= LooseVersion(min_version):
+			result.update(path=path, version=version)
+			return (result)
+		elif not result['path']:
+			## version smaller than required
+			result.update(path=path, version=version)
+
+	return (result)
+
+################
+def run_checks(function, items, timeout, threads=None):
+	"""Calls function for each item concurrently. Items not finished within timeout are returned as None.
+
+	:returns: Dictionary item: result
+	"""
+	results = dict.fromkeys(items)
+	if not items:
+		return (results)
+	executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads or min(32, len(items)))
+	commandsSent = { executor.submit(function, item): item for item in items }
+	(done, not_done) = concurrent.futures.wait(commandsSent, timeout=timeout)
+	for cmd2 in done:
+		try:
+			results[commandsSent[cmd2]] = cmd2.result()
+		except Exception as exc:
+			print ('***ERROR:')
+			print('%r generated an exception: %s' % (commandsSent[cmd2], exc))
+	for cmd2 in not_done:
+		print (colored("** Attention: check for %s did not finish in %s seconds" %(commandsSent[cmd2], timeout), 'yellow'))
+	executor.shutdown(wait=False)
+	return (results)
+
+################
+def probe_dependencies(timeout=60, Debug=False):
+	"""Searches all software in dependencies.csv at the same time (see probe_software)
+
+	:returns: Dictionary software: result
+	"""
+	dependencies_pd = extern_progs.read_dependencies()
+	probes = run_checks(lambda soft: probe_software(soft, timeout, Debug), list(dependencies_pd.index), 
+						len(dependencies_pd) * timeout)
+	for soft, result in probes.items():
+		if not result:
+			probes[soft] = { 'software': soft, 'name': dependencies_pd.loc[soft, 'soft_name'], 'min_version': dependencies_pd.loc[soft, 'min_version'],
+							'path': '', 'version': 'n.a.', 'candidates': [] }
+	return (probes)
+
+################
+def check_dependencies(Debug, timeout=60, probes=None):
 	"""
 	Check if available the different software required for ``RSP`` execution.
 	
 	Using the function :func:`RSP.config.extern_progs.read_dependencies` the 
 	information for all the dependencies is retrieved from file :file:`RSP/config/software/dependencies.csv`.
 	
-	For each software, the function :func:`RSP.config.set_config.get_exe` retrieves
-	whether it is installed in the system or not and its version and it is check using 
-	:func:`RSP.config.set_config.check_install`. 
+	All software are searched at the same time using :func:`RSP.config.set_config.probe_software`
+	and versions are checked using :func:`RSP.config.set_config.check_install_module`. 
 	
 	:param Debug: True/False for debugging messages 
+	:param timeout: Seconds to wait for each version command
+	:param probes: Results of :func:`RSP.config.set_config.probe_dependencies`, if already available
 	:type Debug: boolean
 	
-	:returns: Print messages and information	
+	:returns: List of dictionaries (see probe_software) including status
 	"""
 	
-	## read dependencies information
-	dependencies_pd = extern_progs.read_dependencies()
+	if probes is None:
+		probes = probe_dependencies(timeout, Debug)
 
-	for soft, row in dependencies_pd.iterrows():
-		soft_name = row['soft_name']
-		min_version = row['min_version']
-		
+	report = []
+	for soft, result in probes.items():
 		## debug messages
 		if (Debug):
 			print ("Software:", soft)
-			print ("Soft name:", soft_name)
-			print ("Min_Version:", min_version)
-		
-		## get executable
-		(soft_path, installed) = get_exe(soft, Debug=Debug, Return_Version=True)
-		
-		## debug messages
-		if (Debug):
-			print ("Soft Path: ", soft_path)
-			print ("Version installed:", installed)
+			print ("Soft Path: ", result['path'])
+			print ("Candidates: ", result['candidates'])
+			print ("Version installed:", result['version'])
 			
 		## check if installed
-		if (min_version == 'na'):
-			message = check_install_module('ok', soft_name, min_version, 'Software')
-		else:
-			message = check_install_module(installed, soft_name, min_version, 'Software')
+		result['status'] = check_install_module(result['version'], result['name'], result['min_version'], 'Software')
+		if (result['status'] != 'OK'):
+			print ("+ Please install manually software: ", result['name'], " to continue with RSP\n\n")
+		report.append(result)
 
-		if (message == 'OK'):
-			continue
-		else:
-			print ("+ Please install manually software: ", soft_name, " to continue with RSP\n\n")
+	return (report)
 	
 ################
 ## Python
 ################
-def get_python_packages(Debug):
+def get_python_packages(Debug, timeout=60):
 	"""
 	Retrieves the version of the python packages installed in the system.
 
 	It retrieves the dependencies name conversion from file :file:`RSP/config/python/python_requirements.csv`
 	using function :func:`RSP.config.extern_progs.file_list` and :func:`RSP.scripts.functions.main_functions.get_data`.
 	For each module it retrieves the package version installed in the system using 
-	:func:`RSP.config.set_config.check_package_version`.	
+	:func:`RSP.config.set_config.check_package_version`, all at the same time.
 
 	:returns: Dictionary containing for each python module (key) the installed version (value).
 	"""
@@ -369,16 +552,11 @@ def get_python_packages(Debug):
 		print(file_module_dependecies)
 	module_dependencies = functions.main_functions.file2dictionary(file_module_dependecies, ',')
 
-	my_packages_installed = {}
-	for each in module_dependencies:
-		module_name = module_dependencies[each]
-		installed = check_package_version(each, Debug) ## check version installed in system
-		my_packages_installed[each] = installed
-
-	return (my_packages_installed)
+	my_packages_installed = run_checks(lambda each: check_package_version(each, Debug), list(module_dependencies), timeout)
+	return ({ each: version or 'n.a.' for each, version in my_packages_installed.items() })
 
 ##################
-def check_python_packages(Debug):
+def check_python_packages(Debug, timeout=60, my_packages_installed=None):
 	"""
 	This functions checks whether the packages installed in the system fulfilled the 
 	minimum version specified in the configuration folder. 
@@ -389,12 +567,15 @@ def check_python_packages(Debug):
 	version specified. It compares them using function :func:`RSP.config.set_config.check_install_module`.
 
 	:param Debug: True/False for debugging messages
+	:param timeout: Seconds to wait for all packages
+	:param my_packages_installed: Results of :func:`RSP.config.set_config.get_python_packages`, if already available
 	:type Debug: boolean
 
-	:returns: Print messages if packages are installed.
+	:returns: List of dictionaries with package, min_version, version and status
 	"""
 	## get python packages installed
-	my_packages_installed = get_python_packages(Debug)
+	if my_packages_installed is None:
+		my_packages_installed = get_python_packages(Debug, timeout)
 
 	## debug messages
 	if (Debug):
@@ -410,12 +591,13 @@ def check_python_packages(Debug):
 		print (my_packages_requirements)
 
 	## check each package
+	report = []
 	for each in my_packages_requirements:
 		## get min version
 		min_version = my_packages_requirements[each]
 
 		## get version installed in system
-		installed = my_packages_installed[each] 
+		installed = my_packages_installed.get(each, 'n.a.')
 
 		## debug messages
 		if (Debug):
@@ -425,6 +607,7 @@ def check_python_packages(Debug):
 			
 		## check if installed
 		message = check_install_module(installed, each, min_version, 'Module')
+		report.append({ 'package': each, 'min_version': min_version, 'version': installed, 'status': message })
 
 		if (message == 'OK'):
 			continue
@@ -432,6 +615,8 @@ def check_python_packages(Debug):
 			print ("+ Please install manually package: ", each, " to continue with RSP\n\n")
 			#print ("pip install %s" %each)
 
+	return (report)
+
 ################
 def check_package_version(package, Debug):
 	"""
@@ -456,6 +641,19 @@ def check_package_version(package, Debug):
 		Give them credit accordingly.
 	"""
 
+	## importlib.metadata is fast: pkg_resources is only loaded if not found
+	try:
+		from importlib.metadata import version as metadata_version
+		version = metadata_version(package)
+		if (Debug):
+			print ("Method: importlib.metadata.version(package)")
+		return (version)
+	except:
+		try:
+			import pkg_resources
+		except ImportError:
+			pkg_resources = None
+
 	try:
 		version = pkg_resources.get_distribution(package).version
 		if (Debug):
@@ -484,42 +682,72 @@ def check_package_version(package, Debug):
 ################
 def get_R_packages():
 	dep_file = os.path.abspath(os.path.join(os.path.dirname( __file__ ), 'R', 'R_dependencies.csv'))
+	if not os.path.isfile(dep_file):
+		## no R packages required
+		return (pd.DataFrame(columns=['source']))
 	dep_file_data = functions.main_functions.get_data(dep_file, ',', 'index_col=0')
 	return (dep_file_data)
 
 ################
-def check_R_packages(Debug):
-	
+def probe_R_packages(timeout=60, Debug=False):
+	"""Checks R packages required are installed, all at the same time.
+
+	:returns: Tuple with Rscript result (see probe_software) and dictionary package: exit code (None if not checked)
+	"""
 	packages = get_R_packages()
 	check_install_system = os.path.abspath(os.path.join(os.path.dirname( __file__ ), 'R', 'check_install_system.R'))
-	R_script_exe = get_exe('Rscript')
-	
-	for index,row in packages.iterrows():
+	R_script = probe_software('Rscript', timeout, Debug)
+	if not R_script['path']:
+		return (R_script, dict.fromkeys(packages.index))
+
+	def check_package(index):
 		## debugging messages
 		if Debug:
 			print ('\n+ Check package: ', index)
-			print('+ Source: ', row['source'])
-		
-		cmd_check = R_script_exe + ' ' + check_install_system + ' -l ' + index
-		code = functions.system_call_functions.system_call(cmd_check, message=False, returned=False)
-		if (code=='OK'):
-			check_install_module('1', index, '0', 'package')
-		else:
-			check_install_module('0', index, '1', 'System package')
+		cmd_check = R_script['path'] + ' ' + check_install_system + ' -l ' + index
+		(code, output) = run_probe(cmd_check, timeout)
+		return (code)
+
+	return (R_script, run_checks(check_package, list(packages.index), len(packages) * timeout))
+
+################
+def check_R_packages(Debug, timeout=60, probes=None):
+	"""Checks R packages required are installed and prints messages.
 
-			## check if installed in path
-			cmd_check_path = R_script_exe + ' ' + check_install_path + ' -l ' + index + ' -p ' + install_path
-			code2 = functions.system_call_functions.system_call(cmd_check_path, message=False, returned=False)
+	:param Debug: True/False for debugging messages
+	:param timeout: Seconds to wait for each package check
+	:param probes: Results of :func:`RSP.config.set_config.probe_R_packages`, if already available
+
+	:returns: List of dictionaries with package, source and status
+	"""
+	if probes is None:
+		probes = probe_R_packages(timeout, Debug)
+	(R_script, codes) = probes
+	if not R_script['path']:
+		check_install_module('n.a.', 'Rscript', '0', 'Software')
+
+	report = []
+	for index, row in get_R_packages().iterrows():
+		if (codes[index] == 0):
+			message = check_install_module('1', index, '0', 'package')
+		else:
+			message = check_install_module('0', index, '1', 'System package')
+			print ("Please install module %s manually to continue with RSP" %index)
+		report.append({ 'package': index, 'source': row['source'], 'status': message })
 
-			if (code2):
-				check_install_module('1', index, '0', 'Install path package')
-			else:
-				check_install_module('0', index, '1', 'Install path package')
-				print ("Please install module %s manually to continue with RSP" %index)
+	return (report)
 				
 		
 ################
 ## Miscellaneous
+################
+def write_config_report(report, report_file):
+	"""Writes results of the configuration checks in JSON format (machine-readable)"""
+	os.makedirs(os.path.dirname(os.path.abspath(report_file)), exist_ok=True)
+	with open(report_file, 'w') as report_hd:
+		json.dump(report, report_hd, indent=4, default=str)
+	print ("+ Configuration report available in: %s" %report_file)
+
 ################
 def print_module_comparison(module_name, message, color, tag):
 	"""
@@ -2,5 +2,10 @@ __all__ = [
         'data_files',
 ]
 
-from RSP.data import *
+## modules are imported when first used (e.g. from RSP.data import x)
+from importlib import import_module
+def __getattr__(name):
+    if name in __all__:
+        return (import_module('RSP.data.' + name))
+    raise AttributeError("module 'RSP.data' has no attribute '%s'" %name)
 
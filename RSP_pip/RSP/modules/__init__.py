@@ -7,8 +7,16 @@ __all__ = [
 	'biotype',
 	'help_RSP',
 	'map_module',
-	'count_module'
+	'genome',
+	'scheduler',
+	'count_module',
+	'pipeline'
 
 ]
 
-from RSP.modules import *
+## modules are imported when first used (e.g. from RSP.modules import x)
+from importlib import import_module
+def __getattr__(name):
+	if name in __all__:
+		return (import_module('RSP.modules.' + name))
+	raise AttributeError("module 'RSP.modules' has no attribute '%s'" %name)
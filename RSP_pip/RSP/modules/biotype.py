@@ -19,7 +19,7 @@ from termcolor import colored
 
 ## import my modules
 from RSP.config import set_config
-from RSP.modules import help_RSP, map_module
+from RSP.modules import help_RSP, map_module, scheduler
 from RSP.scripts import RNAbiotype, multiQC_report, featurecounts, generate_matrix
 #from RSP.other_tools import tools
 
@@ -143,16 +143,9 @@ def run_biotype(options):
     # time stamp
     start_time_partial = time_functions.timestamp(start_time_total)
 
-    ## optimize threads
+    ## optimize threads and memory according to tool resources
     name_list = set(pd_samples_retrieved["new_name"].tolist())
-    threads_job = main_functions.optimize_threads(options.threads, len(name_list)) ## threads optimization
-    max_workers_int = int(options.threads/threads_job)
-    
-    ## debug message
-    if (Debug):
-        print (colored("**DEBUG: options.threads " +  str(options.threads) + " **", 'yellow'))
-        print (colored("**DEBUG: max_workers " +  str(max_workers_int) + " **", 'yellow'))
-        print (colored("**DEBUG: cpu_here " +  str(threads_job) + " **", 'yellow'))
+    (max_workers_int, threads_job) = scheduler.optimize_resources("featureCounts", options, len(name_list), Debug)
         
     ##############################################
     ## map Reads
@@ -248,7 +241,7 @@ def run_biotype(options):
                 shutil.copy(pdf_plot[0], single_files_biotype)
         
         ## collapse all information
-        all_data = generate_matrix.generate_matrix(dict_files, 'RNAbiotype')
+        all_data = generate_matrix.generate_matrix(dict_files, 'RNAbiotype', Debug, options.threads)
     
         ## print into excel/csv
         print ('+ Table contains: ', len(all_data), ' entries\n')
@@ -305,7 +298,7 @@ def RNAbiotype_module_call(samples_dict, output_dict, gtf_file, Debug, max_worke
 	## send for each sample
 	with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers_int) as executor:
 		commandsSent = { executor.submit(featurecounts.featurecounts_call, output_dict[sample], gtf_file, bam_files, 
-										sample, threads_job, multimapping, stranded, 'RNAbiotype', Debug): sample for sample, bam_files in samples_dict.items() }
+										sample, threads_job, multimapping, stranded, 'RNAbiotype', Debug): sample for sample, bam_files in scheduler.sort_dict_by_size(samples_dict) }
 	
 		for cmd2 in concurrent.futures.as_completed(commandsSent):
 			details = commandsSent[cmd2]
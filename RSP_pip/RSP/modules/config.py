@@ -9,6 +9,7 @@ import time
 import io
 import os
 import sys
+import concurrent.futures
 from termcolor import colored
 from distutils.version import LooseVersion
 
@@ -50,13 +51,23 @@ def run_config(options):
         print (colored("Minimum version (%s) not satisfied: %s" %(python_min_version, this_python_version), 'red'))
         exit()
         
+    ## software, python and R packages checked at the same time:
+    ## versions probed again and cached for the rest of modules
+    set_config.clear_tool_cache()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        software_probes = executor.submit(set_config.probe_dependencies, options.timeout, Debug)
+        python_probes = executor.submit(set_config.get_python_packages, Debug, options.timeout)
+        R_probes = executor.submit(set_config.probe_R_packages, options.timeout, Debug)
+
     ## third-party software
     print ('\n')
     HCGB_aes.print_sepLine("+", 20, False)
     print ('External dependencies:')
     HCGB_aes.print_sepLine("+", 20, False)
     
-    set_config.check_dependencies(Debug)
+    report = { 'python': { 'version': this_python_version, 'min_version': python_min_version } }
+    report['software'] = set_config.check_dependencies(Debug, options.timeout, software_probes.result())
+    print ("\n+ Executables and versions cached in: %s" %set_config.tool_cache_file())
     print ('\n')    
 
     ## python packages
@@ -65,7 +76,7 @@ def run_config(options):
     print ('Python packages:')
     HCGB_aes.print_sepLine("+", 20, False)
 
-    set_config.check_python_packages(Debug)
+    report['python_packages'] = set_config.check_python_packages(Debug, options.timeout, python_probes.result())
     HCGB_aes.print_sepLine("+", 20, False)
     print ('\n')
 
@@ -76,8 +87,12 @@ def run_config(options):
     print ('R packages:')
     HCGB_aes.print_sepLine("+", 20, False)
 
-    set_config.check_R_packages(Debug)
+    report['R_packages'] = set_config.check_R_packages(Debug, options.timeout, R_probes.result())
     HCGB_aes.print_sepLine("+", 20, False)
     print ('\n')
 
-    
\ No newline at end of file
+    ## machine-readable report
+    report['seconds'] = round(time.time() - start_time_total, 2)
+    report_file = options.report or os.path.join(os.path.dirname(set_config.tool_cache_file()), 'config_report.json')
+    set_config.write_config_report(report, report_file)
+    return (report)
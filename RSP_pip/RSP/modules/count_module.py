@@ -13,6 +13,7 @@ import re
 import time
 from io import open
 import shutil
+import tempfile
 import concurrent.futures
 from termcolor import colored
 import pandas as pd
@@ -20,12 +21,14 @@ import csv
 
 ## import my modules
 from RSP.scripts import multiQC_report, featurecounts, generate_matrix
+from RSP.scripts import gtf_index, native_counts, compression, run_stats, dashboard
 
 from RSP.config import set_config
 from RSP.data import data_files
 from RSP import __version__ as pipeline_version
 from RSP.modules import help_RSP
 from RSP.modules import qc
+from RSP.modules import scheduler
 
 from HCGB import sampleParser
 import HCGB.functions.info_functions as HCGB_info
@@ -34,6 +37,14 @@ import HCGB.functions.aesthetics_functions as HCGB_aes
 import HCGB.functions.time_functions as HCGB_time
 import HCGB.functions.main_functions as HCGB_main
 
+## BAM file generated by each mapping software within map/<software> folder
+bam_files_soft = {
+	"star": "Aligned.sortedByCoord.out.bam",
+	"hisat2": "Aligned.sortedByCoord.out.bam",
+	"salmon": "x",
+	"kallisto": "x"
+}
+
 ###############################################3
 def run_count(options):
 	"""Main function of the module, organizes the counting process.
@@ -155,12 +166,6 @@ def run_count(options):
 	
 	## reorder sample bam files available
 	bam_file_dict = {}
-	files_dict = {
-		"star": "Aligned.sortedByCoord.out.bam",
-		"hisat2": "xx",
-		"salmon": "x",
-		"kallisto": "x"
-	}
 
 
 	## 
@@ -172,7 +177,7 @@ def run_count(options):
 	for soft_name2check in options.soft_name:
 		bam_file_dict[soft_name2check] = {}
 		for name, cluster in sample_frame:
-			bam_file_dict[soft_name2check][name] = os.path.join(map_outdir_dict[name], soft_name2check, files_dict[soft_name2check])
+			bam_file_dict[soft_name2check][name] = os.path.join(map_outdir_dict[name], soft_name2check, bam_files_soft[soft_name2check])
 
 	## debug message
 	if (Debug):
@@ -195,16 +200,19 @@ def run_count(options):
 	# time stamp
 	start_time_partial = HCGB_time.timestamp(start_time_total)
 
-	## optimize threads
+	## optimize threads and memory according to tool resources
 	name_list = set(pd_samples_retrieved["new_name"].tolist())
-	threads_job = HCGB_main.optimize_threads(options.threads, len(name_list)) ## threads optimization
-	max_workers_int = int(options.threads/threads_job)
-	
-	## debug message
-	if (Debug):
-		print (colored("**DEBUG: options.threads " +  str(options.threads) + " **", 'yellow'))
-		print (colored("**DEBUG: max_workers " +  str(max_workers_int) + " **", 'yellow'))
-		print (colored("**DEBUG: cpu_here " +  str(threads_job) + " **", 'yellow'))
+	(max_workers_int, threads_job) = scheduler.optimize_resources("featureCounts", options, len(name_list), Debug)
+
+	## built-in counting: index GTF once and share it (memory-mapped) by all samples
+	index_folder = None
+	pool_executor = concurrent.futures.ThreadPoolExecutor
+	if options.count_engine == "native":
+		index_folder = gtf_index.build_index(options.ref_annot, 
+											 gtf_index.default_folder(options.ref_annot, os.path.join(outdir, "gtf_index")),
+											 "exon", "gene_id", Debug)
+		## counting in python: use processes instead of threads
+		pool_executor = concurrent.futures.ProcessPoolExecutor
 
 	##########################
 	## Let's start processing
@@ -216,18 +224,25 @@ def run_count(options):
 	
 	for soft_name2check in options.soft_name:
 
-		with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers_int) as executor:
+		## featureCounts: one call for each group of samples
+		if options.count_batch and not index_folder:
+			count_batch_caller(counts_outdir_dict, options.ref_annot, bam_file_dict[soft_name2check], max_workers_int, 
+							   threads_job, multimapping, options.stranded, soft_name2check, outdir, Debug, 
+							   options.compress_intermediates)
+			continue
+
+		with pool_executor(max_workers=max_workers_int) as executor:
 				## sample_name, path_reference, reference_genome, index_name, reads_list, main_output, threads, parameters, software_list, Debug
 				commandsSent = { executor.submit(gene_count_caller, 
 													counts_outdir_dict[name], ## main_output,
 													options.ref_annot, ## reference_genome annotation,
-													bam_file_dict[soft_name2check][name], ## bam file to use,
+													bam_file, ## bam file to use,
 													name,
 													threads_job, ## threads 
 													multimapping,
 													options.stranded,
 													soft_name2check, ## software list
-													Debug): name for name, cluster in sample_frame }
+													Debug, index_folder, options.compress_intermediates): name for name, bam_file in scheduler.sort_dict_by_size(bam_file_dict[soft_name2check]) }
 				## (path, gtf_file, bam_file, name, threads, allow_multimap, stranded, , Debug)
 
 				for cmd2 in concurrent.futures.as_completed(commandsSent):
@@ -239,6 +254,18 @@ def run_count(options):
 						print (cmd2)
 						print('%r generated an exception: %s' % (details, exc))
 
+	## disk saved and time spent compressing counts
+	if (options.compress_intermediates):
+		compression.benchmark_report(counts_outdir_dict.values(), 
+									 os.path.join(HCGB_files.create_subfolder("info", outdir), "count_compression_benchmark.tsv"))
+
+	## counting statistics stored for the project
+	run_stats.update_report(outdir, [ (name, "count", folder) for name, folder in counts_outdir_dict.items() ], Debug)
+
+	## summary report for the cohort using statistics stored
+	if not (options.skip_report):
+		dashboard.build_dashboard(outdir, Debug)
+
 	## create report/summary for each software
 	results_dict_soft = {}
 	results_count={}
@@ -250,20 +277,20 @@ def run_count(options):
 		results_dict_soft[soft]={} 
 		results_fold_dict_soft[soft]={}
 		for name, cluster in sample_frame:
-			results_dict_soft[soft][name] = os.path.join(counts_outdir_dict[name], soft, "featureCount.out")
+			results_dict_soft[soft][name] = featurecounts.count_outputs(os.path.join(counts_outdir_dict[name], soft), options.compress_intermediates)[0]
 			results_fold_dict_soft[soft][name] = os.path.join(counts_outdir_dict[name], soft)
 
 
 		# Create count report    
-		if (options.skip_report):
-			print ("+ No report generation...")
+		if (options.skip_report or not options.multiqc):
+			print ("+ No MultiQC report generation...")
 		else:
 			multiQC_report.create_module_report(main_outdir=outdir, soft_name=soft, 
 				outdir_dict_given=results_fold_dict_soft[soft], module_given="counts", 
 				options2multiqc="-dd 3")
 
 		## for each software create count matrix
-		all_counts_matrix_soft = generate_matrix.generate_matrix(results_dict_soft[soft], "Geneid")
+		all_counts_matrix_soft = generate_matrix.generate_matrix(results_dict_soft[soft], "Geneid", Debug, options.threads)
 		
 		## dump data in folder provided
 		csv_outfile = os.path.join(module_outdir_report, 'counts_RNAseq_' + soft + '.csv')
@@ -310,19 +337,53 @@ def run_count(options):
 	return(runInfo)
 
 ################################################################################## 
-def gene_count_caller(output_folder, gtf_file, bam_file, name2use, threads, multimapping, stranded, soft_name2use, Debug):
+def gene_count_caller(output_folder, gtf_file, bam_file, name2use, threads, multimapping, stranded, soft_name2use, Debug, index_folder=None, compress=False):
 
 	## create subfolder for this mapping software
 	output_folder = HCGB_files.create_subfolder(soft_name2use, output_folder)
 
-	## check if previously counted and succeeded
-	filename_stamp = output_folder + '/.success_featureCounts'
-	if os.path.isfile(filename_stamp):
-		stamp = HCGB_time.read_time_stamp(filename_stamp)
-		print (colored("\tA previous command generated results on: %s [%s -- %s: %s]" %(stamp, name2use, 'count', 'featureCounts'), 'yellow'))
+	## create call to counting: only done if BAM, annotation or parameters changed 
+	## since previous call (see result_cache)
+	if index_folder:
+		## built-in counting using GTF index
+		code_returned = native_counts.native_counts_call(output_folder, index_folder, gtf_file, bam_file, name2use, threads, 
+														 multimapping, stranded, 'Gene Count', Debug, compress)
 	else:
-		## create call to mapping
-		code_returned = featurecounts.get_counts_gene(output_folder, gtf_file, bam_file, name2use, str(threads), multimapping, str(stranded), Debug)
+		code_returned = featurecounts.get_counts_gene(output_folder, gtf_file, bam_file, name2use, str(threads), multimapping, str(stranded), Debug, compress)
+
+	if not os.path.isfile(code_returned):
+		print ('** Sample %s failed...' %name2use)
 
-		if not os.path.isfile(code_returned):
-			print ('** Sample %s failed...' %name2use)
+################################################################################## 
+def count_batch_caller(counts_outdir_dict, gtf_file, bam_files_dict, max_workers, threads, multimapping, stranded, soft_name2use, outdir, Debug, compress=False):
+	"""Counts samples using a featureCounts call for each group of samples of similar total size.
+
+	Groups are counted in parallel and results are stored for each sample as in gene_count_caller.
+	"""
+	chunks = scheduler.split_by_size(bam_files_dict, max_workers)
+	print ("+ Counting %s samples in %s featureCounts call(s) [%s]..." %(len(bam_files_dict), len(chunks), soft_name2use))
+
+	## temporary folder for featureCounts output of each group; logs kept in the info folder
+	batch_folder = tempfile.mkdtemp(prefix='.featureCounts_batch_', dir=outdir)
+	log_folder = os.path.join(HCGB_files.create_subfolder("info", outdir), "featureCounts_batch")
+	log_prefix = soft_name2use + "_" + time.strftime("%Y%m%d-%H%M%S")
+	with concurrent.futures.ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+		commandsSent = { executor.submit(featurecounts.featurecounts_batch,
+										 os.path.join(batch_folder, 'chunk_' + str(num)),
+										 os.path.join(log_folder, log_prefix + '_chunk_' + str(num) + '.log'),
+										 gtf_file,
+										 [ (HCGB_files.create_subfolder(soft_name2use, counts_outdir_dict[name]), name, bam_file) for name, bam_file in chunk ],
+										 threads, multimapping, stranded, 'Gene Count', Debug, compress): num for num, chunk in enumerate(chunks) }
+
+		for cmd2 in concurrent.futures.as_completed(commandsSent):
+			details = commandsSent[cmd2]
+			try:
+				data = cmd2.result()
+				if data == 'FAIL':
+					print ('** Samples failed: ' + ", ".join([ name for name, bam_file in chunks[details] ]))
+			except Exception as exc:
+				print ('***ERROR:')
+				print (cmd2)
+				print('%r generated an exception: %s' % (details, exc))
+
+	shutil.rmtree(batch_folder, ignore_errors=True)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+##########################################################
+## Jose F. Sanchez                                      ##
+## Copyright (C) 2019-2020 Lauro Sumoy Lab, IGTP, Spain ##
+##########################################################
+"""
+Manages STAR reference genomes kept in shared memory
+"""
+## import useful modules
+import os
+import time
+from termcolor import colored
+
+## import my modules
+from RSP.scripts import STAR_genome
+from RSP.config import set_config
+
+import HCGB.functions.files_functions as HCGB_files
+import HCGB.functions.aesthetics_functions as HCGB_aes
+import HCGB.functions.time_functions as HCGB_time
+
+###############################################
+def run_genome(options):
+	"""Main function of the module, loads, checks or unloads a STAR genome in shared memory.
+
+	- load: loads genome (if necessary) and keeps it pinned in memory. Further RSP map calls
+	  using the same genomeDir attach to it instead of loading it again.
+	- status: prints whether the genome is loaded, pinned and processes using it.
+	- unload: unpins genome. It is removed once the last RSP map process using it finishes.
+
+	:param options: input parameters introduced by the user. See RSP genome -h.
+
+	:returns: None
+	"""
+	## init time
+	start_time_total = time.time()
+
+	global Debug
+	if (options.debug):
+		Debug = True
+	else:
+		Debug = False
+
+	HCGB_aes.pipeline_header('RSP')
+	HCGB_aes.boxymcboxface("STAR genome in shared memory")
+	print ("--------- Starting Process ---------")
+	HCGB_time.print_time()
+
+	genomeDir = os.path.abspath(options.genomeDir)
+	if not HCGB_files.is_non_zero_file(os.path.join(genomeDir, "SA")):
+		print (colored("** ERROR: genomeDir provided does not contain a STAR index: " + genomeDir, 'red'))
+		exit()
+
+	if options.action == "status":
+		STAR_genome.print_status(genomeDir)
+	else:
+		STAR_exe = set_config.get_exe("STAR", Debug=Debug)
+		folder = HCGB_files.create_subfolder('STAR_files', os.path.abspath("./"))
+
+		if options.action == "load":
+			if STAR_genome.pin_genome(STAR_exe, genomeDir, folder, options.threads):
+				print ("+ Genome loaded and kept in shared memory: " + genomeDir)
+		elif options.action == "unload":
+			STAR_genome.unpin_genome(STAR_exe, genomeDir, folder, options.threads)
+
+		if (Debug):
+			STAR_genome.print_status(genomeDir)
+
+	print ("\n*************** Finish *******************")
+	start_time_partial = HCGB_time.timestamp(start_time_total)
+	print ("\n+ Exiting genome module.")
+	return()
@@ -160,6 +160,12 @@ def project_help():
 
 ###############
 def multiqc_help():
+    print (colored("\n\n***** Reports *****\n", 'yellow'))
+    print ("Statistics of each tool (FASTQC, trimming, mapping and counting) are stored for each sample as soon as each job finishes (info/run_stats).")
+    print ("A summary report for all samples is generated from these statistics in seconds: report/RSP_summary.html and report/RSP_summary.json.")
+    print ("MultiQC reports are only generated if option --multiqc is provided. MultiQC scans all sample folders for each module,")
+    print ("which might take a long time for large cohorts.")
+    print ("Use --skip_report to avoid any report generation.\n")
     return ()
 
 ###############
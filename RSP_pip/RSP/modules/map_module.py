@@ -13,6 +13,7 @@ import re
 import time
 from io import open
 import shutil
+import glob
 import concurrent.futures
 from termcolor import colored
 
@@ -21,13 +22,20 @@ from RSP.scripts import multiQC_report
 from RSP.scripts import hisat2
 from RSP.scripts import kallisto
 from RSP.scripts import STAR_caller    
+from RSP.scripts import STAR_genome
 from RSP.scripts import salmon
+from RSP.scripts import quant_matrix
+from RSP.scripts import result_cache
+from RSP.scripts import index_registry
+from RSP.scripts import run_stats
+from RSP.scripts import dashboard
 
 from RSP.config import set_config
 from RSP.data import data_files
 from RSP import __version__ as pipeline_version
 from RSP.modules import help_RSP
 from RSP.modules import qc
+from RSP.modules import scheduler
 
 from HCGB import sampleParser
 import HCGB.functions.info_functions as HCGB_info
@@ -137,6 +145,24 @@ def run_map(options):
 	 
 	reference_genome = options.ref_genome ## reference_genome
 	index_ref_name = options.ref_name ## index_name
+
+	## transcripts for alignment-free quantification
+	if "salmon" in options.soft_name or "kallisto" in options.soft_name:
+		if HCGB_files.is_non_zero_file(options.ref_transcriptome):
+			options.ref_transcriptome = os.path.abspath(options.ref_transcriptome)
+			print ('+ Reference transcriptome provided:... ')
+			print('\t' + options.ref_transcriptome)
+		else:
+			print (colored("** ERROR: Reference transcriptome (--ref_transcriptome) is required for salmon and kallisto", 'red'))
+			exit()
+
+	## annotation to summarize transcripts at gene level
+	if (options.ref_annot):
+		if HCGB_files.is_non_zero_file(options.ref_annot):
+			options.ref_annot = os.path.abspath(options.ref_annot)
+		else:
+			print (colored("** ERROR: Reference genome annotation provided does not exist", 'red'))
+			exit()
 	
 	print ('+ Reference index name provided: ' + index_ref_name)
 	print('') 
@@ -175,7 +201,8 @@ def run_map(options):
 		
 		# use default if not provided
 		map_params_hisat2 = {
-			'index':abs_path_index
+			'index':abs_path_index,
+			'sort_memory':options.sort_memory
 		}
 		map_params["hisat2"] = map_params_hisat2
 		
@@ -190,11 +217,13 @@ def run_map(options):
 		## Prepare or check index
 		abs_path_index =check_index("salmon", path_reference, reference_genome, 
 					index_ref_name + '_salmon', threads=options.threads, 
-					extra_index=options.extra_index, index_folder=options.index_folder, Debug=Debug)
+					extra_index=options.extra_index, index_folder=options.index_folder, limitGenomeGenerateRAM=options.limitGenomeGenerateRAM, Debug=Debug,
+					transcriptome=options.ref_transcriptome)
 		
 		# use default if not provided
 		map_params_salmon = {
-			'index':abs_path_index
+			'index':abs_path_index,
+			'extra':options.extra if options.extra else ""
 		}
 		map_params["salmon"] = map_params_salmon
 		
@@ -209,11 +238,15 @@ def run_map(options):
 		## Prepare or check index
 		abs_path_index =check_index("kallisto", path_reference, reference_genome, 
 					index_ref_name + '_kallisto', threads=options.threads, 
-					extra_index=options.extra_index, index_folder=options.index_folder, Debug=Debug)
+					extra_index=options.extra_index, index_folder=options.index_folder, limitGenomeGenerateRAM=options.limitGenomeGenerateRAM, Debug=Debug,
+					transcriptome=options.ref_transcriptome)
 
 		# use default if not provided
 		map_params_kallisto = {
-			'index':abs_path_index
+			'index':abs_path_index,
+			'transcriptome':options.ref_transcriptome,
+			'fragment_length':options.fragment_length,
+			'fragment_sd':options.fragment_sd
 		}
 		map_params["kallisto"] = map_params_kallisto
 		
@@ -287,16 +320,9 @@ def run_map(options):
 	## for samples
 	outdir_dict = HCGB_files.outdir_project(outdir, options.project, pd_samples_retrieved, "map", options.debug)
 	
-	## optimize threads
+	## optimize threads and memory according to tool resources
 	name_list = set(pd_samples_retrieved["new_name"].tolist())
-	threads_job = HCGB_main.optimize_threads(options.threads, len(name_list)) ## threads optimization
-	max_workers_int = int(options.threads/threads_job)
-
-	## debug message
-	if (Debug):
-		print (colored("**DEBUG: options.threads " +  str(options.threads) + " **", 'yellow'))
-		print (colored("**DEBUG: max_workers " +  str(max_workers_int) + " **", 'yellow'))
-		print (colored("**DEBUG: cpu_here " +  str(threads_job) + " **", 'yellow'))
+	(max_workers_int, threads_job) = scheduler.optimize_resources([soft for soft in options.soft_name if soft != "star"], options, len(name_list), Debug)
 	##########################
 
 	##########################
@@ -314,6 +340,10 @@ def run_map(options):
 		## Create call for STAR only
 		(start_time_partial, star_results, outdir_dict) = mapReads_module_STAR(options, pd_samples_retrieved, outdir_dict, Debug, 
 					max_workers_int, options.threads, start_time_partial, outdir, multimapping, map_params["star"]["index"])
+
+	## if kallisto, all samples are quantified at once (batch mode) loading the index once
+	if "kallisto" in options.soft_name:
+		mapReads_module_kallisto(sample_frame, outdir_dict, map_params, options.threads, outdir, Debug)
 	
 	## other software
 	if len(options.soft_name)>0:
@@ -329,7 +359,7 @@ def run_map(options):
 												 threads_job, ## threads 
 												 map_params, ## dictionary parameters
 												 options.soft_name, ## software list
-												 Debug): name for name, cluster in sample_frame }
+												 Debug): name for name, cluster in scheduler.sort_by_size(sample_frame) }
 	
 				for cmd2 in concurrent.futures.as_completed(commandsSent):
 					details = commandsSent[cmd2]
@@ -352,6 +382,23 @@ def run_map(options):
 		print (colored("**DEBUG: results_mapping **", 'yellow'))
 		print (results_mapping)
 	
+	## transcript and gene matrices for alignment-free quantification
+	if "salmon" in options.soft_name:
+		results_mapping['salmon'] = quant_matrix.write_matrices("salmon", 
+									{ name: os.path.join(outdir_dict[name], "salmon", salmon.quant_file_name) for name, cluster in sample_frame }, 
+									"Name", "NumReads", "TPM", os.path.join(outdir, "report", "counts"), options.ref_annot, Debug, options.threads)
+	if "kallisto" in options.soft_name:
+		results_mapping['kallisto'] = quant_matrix.write_matrices("kallisto", 
+									{ name: os.path.join(outdir_dict[name], "kallisto", kallisto.quant_file_name) for name, cluster in sample_frame }, 
+									"target_id", "est_counts", "tpm", os.path.join(outdir, "report", "counts"), options.ref_annot, Debug, options.threads)
+
+	## mapping statistics stored for the project
+	run_stats.update_report(outdir, [ (name, "map", outdir_dict[name]) for name, cluster in sample_frame ], Debug)
+
+	## summary report for the cohort using statistics stored
+	if not (options.skip_report):
+		dashboard.build_dashboard(outdir, Debug)
+
 	## create report for each software
 	outdir_dict_soft = {}
 	for soft in options.soft_name:
@@ -360,8 +407,8 @@ def run_map(options):
 			outdir_dict_soft[soft][name] = os.path.join(outdir_dict[name], soft)
 
 		## Create mapping report    
-		if (options.skip_report):
-			print ("+ No report generation...")
+		if (options.skip_report or not options.multiqc):
+			print ("+ No MultiQC report generation...")
 		else:
 			multiQC_report.create_module_report(main_outdir=outdir, soft_name=soft, outdir_dict_given=outdir_dict_soft[soft], module_given="map", options2multiqc="-dd 3")
 
@@ -406,7 +453,7 @@ def run_map(options):
 
 
 ###############################################3
-def check_index(soft_name, path_reference, reference_genome, index_ref_name, threads, extra_index, index_folder, limitGenomeGenerateRAM, Debug):
+def check_index(soft_name, path_reference, reference_genome, index_ref_name, threads, extra_index, index_folder, limitGenomeGenerateRAM, Debug, transcriptome=None):
 	
 	"""Checks the index genome folder for each software 
 	
@@ -419,6 +466,7 @@ def check_index(soft_name, path_reference, reference_genome, index_ref_name, thr
 	:param index_folder: Folder provided with indexed files.
 	:param limitGenomeGenerateRAM: limit RAM bytes to be used in the computation
 	:param Debug: Print debugging messages or not
+	:param transcriptome: Transcripts in fasta format (salmon and kallisto). Reference genome is used as decoy for salmon.
 
 	:type soft_name: string
 	:type path_reference: string
@@ -429,54 +477,27 @@ def check_index(soft_name, path_reference, reference_genome, index_ref_name, thr
 	:type index_folder: string
 	:type limitGenomeGenerateRAM: int
 	:type Debug: boolean
+	:type transcriptome: string
 
 	:returns: genomeDir
 	"""
 
-	if (index_folder): # folder is provided containing pre-computed results for a single software: eg. STAR
+	## folder provided containing pre-computed index for a single software: eg. STAR
+	if (index_folder) and index_registry.is_index(soft_name, index_folder, index_ref_name):
 		print("+ Check index folder provided: ")
 		print(index_folder)
-		genomeDir=index_folder
-	else:
-		path_reference = HCGB_files.create_subfolder(soft_name, path_reference)
-		genomeDir=path_reference
-		## /path/to/any/folder/
-		## -------------------- star
-		## -------------------- hisat2
-
+		return (index_registry.index_path(soft_name, os.path.abspath(index_folder), index_ref_name))
 
-	## check if previously mapped and succeeded
-	filename_stamp = path_reference + '/.success_index_' + soft_name
-	
-	if os.path.isfile(filename_stamp):
-		stamp = HCGB_time.read_time_stamp(filename_stamp)
-		print (colored("\tA previous command generated results on: %s [%s]" %(stamp, soft_name)), 'yellow')
-		print("+ Let's check everything is alright...'")
-	
-	if soft_name=="hisat2":
-		code_returned= hisat2.hisat2_index(path_reference, reference_genome, index_ref_name, threads, Debug)
-		genomeDir=code_returned
-		
-	if soft_name=="salmon":
-		print("")
-		# Fix
-		#salmon_index(path_reference, reference_genome, index)
-		
-	if soft_name=="kallisto":
-		print("")
-	# Fix
-		#kallisto_index(path_reference, reference_genome, index, kmers)
-		
-	if soft_name=="star":
-		code_returned= STAR_caller.check_index(path_reference, reference_genome, index_ref_name, threads, extra_index, limitGenomeGenerateRAM, Debug)
-		
-	if code_returned:
-		HCGB_time.print_time_stamp(filename_stamp)
-		
-	else:
-		print ('** Software %s failed to index genome provided...' %soft_name)
+	## index from the registry: built only once for the same fasta, options and software version
+	if soft_name == "salmon":
+		return (index_registry.get_index(soft_name, path_reference, transcriptome, index_ref_name, 
+										threads, extra_index, limitGenomeGenerateRAM, Debug, decoy_file=reference_genome))
+	if soft_name == "kallisto":
+		return (index_registry.get_index(soft_name, path_reference, transcriptome, index_ref_name, 
+										threads, extra_index, limitGenomeGenerateRAM, Debug))
 
-	return genomeDir
+	return (index_registry.get_index(soft_name, path_reference, reference_genome, index_ref_name, 
+									threads, extra_index, limitGenomeGenerateRAM, Debug))
 
 
 ###############################################
@@ -495,18 +516,18 @@ def module_map (sample_name, path_reference, reference_genome, index_ref_name, r
 		## TODO: Add additional parameters saved in dictionary map_params['hisat2']
 		extra_params=""
 		
-		## check if previously mapped and succeeded
-		filename_stamp = output + '/.success_hisat2'
-		if os.path.isfile(filename_stamp):
-			stamp = HCGB_time.read_time_stamp(filename_stamp)
-			print (colored("\tA previous command generated results on: %s [%s -- %s: %s]" %(stamp, sample_name, 'map', 'hisat2'), 'yellow'))
-		else:
-			## create call to mapping
+		## check if previously mapped with same reads, index and parameters
+		index_files = sorted(glob.glob(map_params['hisat2']['index'] + "*.ht2"))
+		record = result_cache.get_record(output, 'hisat2', reads_list + index_files, 
+										{'index': map_params['hisat2']['index'], 'reads': reads_list, 'extra': extra_params}, 'hisat2')
+		bam_file = os.path.join(output, hisat2.bam_file_name)
+		if not result_cache.is_cached(record, [bam_file, bam_file + '.bai'], sample_name):
+			## create call to mapping: alignments sorted and indexed, no SAM file generated
 			code_returned= hisat2.hisat2_mapping(sample_name, map_params['hisat2']['index'], 
 												 reads_list, output, threads, 
-												 extra_params, Debug)
+												 extra_params, Debug, map_params['hisat2']['sort_memory'])
 			if (code_returned=="OK"):
-				HCGB_time.print_time_stamp(filename_stamp)
+				result_cache.save_record(record, [bam_file, bam_file + '.bai'])
 			else:
 				print ('** Sample %s failed...' %sample_name)
 
@@ -515,18 +536,104 @@ def module_map (sample_name, path_reference, reference_genome, index_ref_name, r
 	##-------------------------------------
 	if "kallisto" in software_list:
 		output = HCGB_files.create_subfolder("kallisto", main_output)
-		#kallisto_index(path_reference, reference_genome, index, kmers)
-		#kallisto_quant(path_reference, index, reads_list, output, threads)
+
+		## check if previously quantified (e.g. in batch mode) with same reads, index and parameters
+		record = kallisto_record(output, reads_list, map_params['kallisto'])
+		quant_file = os.path.join(output, kallisto.quant_file_name)
+		if not result_cache.is_cached(record, [quant_file], sample_name):
+			code_returned = kallisto.kallisto_quant(sample_name, map_params['kallisto']['index'], reads_list, output, threads, 
+													map_params['kallisto'].get('fragment_length', 200), map_params['kallisto'].get('fragment_sd', 20), Debug)
+			if (code_returned=="OK"):
+				result_cache.save_record(record, [quant_file])
+			else:
+				print ('** Sample %s failed...' %sample_name)
 	
 	##-------------------------------------
 	## salmon
 	##-------------------------------------
 	if "salmon" in software_list:
 		output = HCGB_files.create_subfolder("salmon", main_output)
-		#salmon_index(path_reference, reference_genome, index)
-		#salmon_quant(path_reference, index, reads_list, output, threads)
+		extra_params = map_params['salmon'].get('extra', "")
+
+		## check if previously quantified with same reads, index and parameters
+		index_files = sorted(glob.glob(os.path.join(map_params['salmon']['index'], "*.json")))
+		record = result_cache.get_record(output, 'salmon', reads_list + index_files, 
+										{'index': map_params['salmon']['index'], 'reads': reads_list, 'extra': extra_params}, 'salmon')
+		quant_file = os.path.join(output, salmon.quant_file_name)
+		if not result_cache.is_cached(record, [quant_file], sample_name):
+			code_returned = salmon.salmon_quant(sample_name, map_params['salmon']['index'], 
+												reads_list, output, threads, extra_params, Debug)
+			if (code_returned=="OK"):
+				result_cache.save_record(record, [quant_file])
+			else:
+				print ('** Sample %s failed...' %sample_name)
 
 
+#########################################
+def kallisto_record(output, reads_list, params):
+	"""Cache record for kallisto quantification: reads, index and parameters. Shared by kallisto quant and batch mode."""
+	## index described by the registry (index_info.json) instead of reading the whole index
+	index_files = sorted(glob.glob(os.path.join(os.path.dirname(params['index']), "*.json"))) or [params['index']]
+	return (result_cache.get_record(output, 'kallisto', reads_list + index_files, 
+								{'index': params['index'], 'reads': reads_list, 
+								 'fragment_length': params.get('fragment_length', 200), 'fragment_sd': params.get('fragment_sd', 20)}, 'kallisto'))
+
+#########################################
+def mapReads_module_kallisto(sample_frame, outdir_dict, map_params, threads, outdir, Debug):
+	"""Quantifies all samples using kallisto batch mode: the index is loaded once for the whole cohort.
+
+	Samples previously quantified are skipped. Batch mode is used for two or more samples
+	with the same layout (paired-end and single-end samples in separate batches) and if
+	available for the kallisto version installed; otherwise (or for samples failed)
+	samples are quantified one by one using kallisto quant (see module_map).
+
+	:param sample_frame: Samples grouped by name
+	:param outdir_dict: Dictionary containing the mapping folder for each sample
+	:param map_params: Dictionary containing parameters for each software
+	:param threads: Number of threads
+	:param outdir: Project folder: batch results are stored in info/kallisto_batch
+	:param Debug: Print debugging messages or not
+
+	:returns: List of samples quantified in batch mode
+	"""
+	pending = {}
+	records = {}
+	for name, cluster in sample_frame:
+		reads_list = sorted(cluster["sample"].tolist())
+		output = HCGB_files.create_subfolder("kallisto", outdir_dict[name])
+		records[name] = kallisto_record(output, reads_list, map_params['kallisto'])
+		if not result_cache.is_cached(records[name], [os.path.join(output, kallisto.quant_file_name)], name):
+			pending[name] = (reads_list, output)
+
+	## a batch for each layout
+	layouts = {}
+	for name, (reads_list, output) in pending.items():
+		layouts.setdefault("paired" if len(reads_list) == 2 else "single", {})[name] = (reads_list, output)
+	layouts = { layout: samples for layout, samples in layouts.items() if len(samples) > 1 }
+
+	if not layouts:
+		return ([])
+	if not kallisto.batch_available():
+		print ("+ kallisto batch mode not available for the version installed: samples quantified one by one...")
+		return ([])
+
+	done = []
+	for layout, samples in layouts.items():
+		done_layout = kallisto.kallisto_batch(samples, map_params['kallisto']['index'], 
+									   os.path.join(HCGB_files.create_subfolder("info", outdir), "kallisto_batch", layout), threads, 
+									   map_params['kallisto']['fragment_length'], map_params['kallisto']['fragment_sd'], 
+									   map_params['kallisto']['transcriptome'], Debug)
+		for name in done_layout:
+			result_cache.save_record(records[name], [os.path.join(pending[name][1], kallisto.quant_file_name)])
+		done.extend(done_layout)
+
+	## debug message
+	if (Debug):
+		print (colored("**DEBUG: samples quantified in batch mode **", 'yellow'))
+		print (done)
+
+	return (done)
+
 #########################################
 def mapReads_module_STAR(options, pd_samples_retrieved, outdir_dict, Debug, max_workers_int, threads_job, start_time_partial, outdir, multimapping, genomeDir):
 	
@@ -575,23 +682,35 @@ def mapReads_module_STAR(options, pd_samples_retrieved, outdir_dict, Debug, max_
 		## Use option LoadAndKeep, set shared memory > 30 Gb
 	## when finished loop Remove memory        
 	
-	## remove previous reference genome from memory
-	print ("+ Remove genome in memory from previous call... (if any)")
-	STAR_caller.remove_Genome(STAR_exe, genomeDir, folder, options.threads)
-	
-	## load reference genome
-	STAR_caller.load_Genome(folder, STAR_exe, genomeDir, options.threads)
+	## load reference genome or attach to a genome already loaded by other 
+	## RSP calls (see RSP genome load/status/unload)
+	print ("+ Load genome in shared memory... (if not loaded)")
+	shared_genome = STAR_genome.attach_genome(STAR_exe, genomeDir, folder, options.threads, Debug)
+	if shared_genome:
+		genome_load = "LoadAndKeep"
+	else:
+		## each STAR job loads its own copy of the genome
+		print (colored("** Warning: STAR genome could not be loaded in shared memory. See logs in " + folder, 'yellow'))
+		print (colored("** Warning: Each sample loads the genome (--genomeLoad NoSharedMemory)", 'yellow'))
+		genome_load = "NoSharedMemory"
 
 	## functions.time_functions.timestamp
 	start_time_partial = HCGB_time.timestamp(start_time_partial)
 	
 	print ("+ Mapping sequencing reads for each sample retrieved...")
 
-	## send for each sample each time
-	with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+	## several STAR jobs share the genome loaded: split threads and BAM sorting RAM
+	(max_jobs, threads_STAR, limitRAM_job) = STAR_caller.plan_mapping_jobs(threads_job, len(sample_frame), 
+																		genomeDir, options.limitGenomeGenerateRAM, 
+																		scheduler.memory_budget(options), 
+																		shared_genome=shared_genome)
+	print ("+ Concurrent STAR jobs: %s [threads: %s; limitBAMsortRAM: %s]" %(max_jobs, threads_STAR, limitRAM_job))
+
+	## send for each sample
+	with concurrent.futures.ThreadPoolExecutor(max_workers=max_jobs) as executor:
 		commandsSent = { executor.submit(mapReads_caller_STAR, sorted(cluster["sample"].tolist()), 
-										 outdir_dict[name], name, threads_job, STAR_exe, 
-										 genomeDir, options.limitGenomeGenerateRAM, Debug, multimapping): name for name, cluster in sample_frame }
+										 outdir_dict[name], name, threads_STAR, STAR_exe, 
+										 genomeDir, limitRAM_job, Debug, multimapping, genome_load): name for name, cluster in scheduler.sort_by_size(sample_frame) }
 
 		for cmd2 in concurrent.futures.as_completed(commandsSent):
 			details = commandsSent[cmd2]
@@ -607,8 +726,9 @@ def mapReads_module_STAR(options, pd_samples_retrieved, outdir_dict, Debug, max_
 	## functions.time_functions.timestamp
 	start_time_partial = HCGB_time.timestamp(start_time_partial)
 
-	## remove reference genome from memory
-	STAR_caller.remove_Genome(STAR_exe, genomeDir, folder, options.threads)
+	## remove reference genome from memory unless pinned or used by other processes
+	if shared_genome:
+		STAR_genome.detach_genome(STAR_exe, genomeDir, folder, options.threads, Debug)
 	
 	## functions.time_functions.timestamp
 	start_time_partial = HCGB_time.timestamp(start_time_partial)
@@ -631,7 +751,7 @@ def mapReads_module_STAR(options, pd_samples_retrieved, outdir_dict, Debug, max_
 	return(start_time_partial, mapping_results, outdir_dict)
 
 #################################
-def mapReads_caller_STAR(files, folder, name, threads, STAR_exe, genomeDir, limitRAM_option, Debug, multimapping):
+def mapReads_caller_STAR(files, folder, name, threads, STAR_exe, genomeDir, limitRAM_option, Debug, multimapping, genome_load="LoadAndKeep"):
 	"""Mapping of a given sample with STAR
 
 	First, checks if the trimmed unjoined files exist for the sample and also
@@ -648,6 +768,7 @@ def mapReads_caller_STAR(files, folder, name, threads, STAR_exe, genomeDir, limi
 	:param limitRAM_option: limit RAM bytes to be used in the computation
 	:param Debug: show extra information of the process
 	:param multimapping: Flag to say whether to use multimapping reads or not
+	:param genome_load: Genome loaded in shared memory (LoadAndKeep) or by this job (NoSharedMemory)
 	
 	:type folder: string
 	:type name: string
@@ -657,6 +778,7 @@ def mapReads_caller_STAR(files, folder, name, threads, STAR_exe, genomeDir, limi
 	:type limitRAM_option: int
 	:type Debug: boolean
 	:type multimapping: boolean
+	:type genome_load: string
 
 	:returns: None
 	"""
@@ -665,12 +787,12 @@ def mapReads_caller_STAR(files, folder, name, threads, STAR_exe, genomeDir, limi
 	HCGB_files.create_folder(folder)
 
 
-	## check if previously joined and succeeded
-	filename_stamp = folder + '/.success'
-	if os.path.isfile(filename_stamp):
-		stamp = HCGB_time.read_time_stamp(filename_stamp)
-		print (colored("\tA previous command generated results on: %s [%s -- %s]" %(stamp, name, 'STAR'), 'yellow'))
-	else:
+	## check if previously mapped with same reads, genome and parameters
+	## (threads, RAM for sorting and genome loading mode do not change results)
+	bam_file = os.path.join(folder, 'Aligned.sortedByCoord.out.bam')
+	record = result_cache.get_record(folder, 'STAR', files + [genomeDir], 
+									{'genomeDir': genomeDir, 'reads': files, 'multimapping': multimapping}, 'STAR')
+	if not result_cache.is_cached(record, [bam_file], name):
 		##
 		if Debug:
 			print ("\n** DEBUG: mapReads_caller options **\n")
@@ -684,10 +806,10 @@ def mapReads_caller_STAR(files, folder, name, threads, STAR_exe, genomeDir, limi
 			print (files)
 			
 		# Call STAR
-		code_returned = STAR_caller.mapReads("LoadAndKeep", files, folder, name, STAR_exe, genomeDir, limitRAM_option, threads, Debug, multimapping)
+		code_returned = STAR_caller.mapReads(genome_load, files, folder, name, STAR_exe, genomeDir, limitRAM_option, threads, Debug, multimapping)
 		
 		if (code_returned=="OK"):
-			HCGB_time.print_time_stamp(filename_stamp)
+			result_cache.save_record(record, [bam_file])
 		else:
 			print ("+ Mapping sample %s failed..." %name)
 	
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+##########################################################
+## Jose F. Sanchez                                      ##
+## Copyright (C) 2019-2020 Lauro Sumoy Lab, IGTP, Spain ##
+##########################################################
+"""
+Runs the whole pipeline (prep, QC, trim, map and count) pipelining each sample.
+"""
+## import useful modules
+import os
+import sys
+import time
+import csv
+from termcolor import colored
+
+## import my modules
+from RSP.scripts import multiQC_report
+from RSP.scripts import fastqc_caller
+from RSP.scripts import generate_matrix
+from RSP.scripts import STAR_caller
+from RSP.scripts import STAR_genome
+from RSP.scripts import result_cache
+from RSP.scripts import featurecounts
+from RSP.scripts import salmon
+from RSP.scripts import kallisto
+from RSP.scripts import quant_matrix
+from RSP.scripts import compression
+from RSP.scripts import run_stats
+from RSP.scripts import dashboard
+
+from RSP.config import set_config
+from RSP import __version__ as pipeline_version
+from RSP.modules import help_RSP
+from RSP.modules import prep
+from RSP.modules import qc
+from RSP.modules import trim
+from RSP.modules import map_module
+from RSP.modules import count_module
+from RSP.modules import scheduler
+
+from HCGB import sampleParser
+import HCGB.functions.info_functions as HCGB_info
+import HCGB.functions.files_functions as HCGB_files
+import HCGB.functions.aesthetics_functions as HCGB_aes
+import HCGB.functions.time_functions as HCGB_time
+
+###############################################
+def run_pipeline(options):
+	"""Main function of the module, runs all steps for each sample as a dependency graph.
+
+	Instead of finishing each step for all samples before the next step starts, each 
+	sample moves to the next step as soon as its previous step finishes: e.g. a sample is 
+	mapped as soon as it is trimmed, while other samples are still being trimmed.
+
+	For each sample: QC (raw reads) -> trim -> QC (trimmed reads)
+	                                        -> map -> count
+
+	Jobs are dispatched according to threads and memory available (see scheduler module).
+	Finally, reports are generated and the critical path of the execution is shown.
+
+	:param options: input parameters introduced by the user. See RSP run -h.
+
+	:returns: None
+	"""
+	## init time
+	start_time_total = time.time()
+
+	##################################
+	### show help messages if desired    
+	##################################
+	if (options.help_format):
+		## help_format option
+		help_RSP.help_fastq_format()
+		exit()
+	elif (options.help_project):
+		## information for project
+		help_RSP.project_help()
+		exit()
+
+	################################################
+	## Set defaults
+	################################################
+	global Debug
+	if (options.debug):
+		Debug = True
+	else:
+		Debug = False
+
+	## multimapping:
+	if options.no_multiMapping:
+		multimapping = False
+	else:
+		multimapping = True
+
+	## check reference files before starting
+	if HCGB_files.is_non_zero_file(options.ref_genome):
+		options.ref_genome = os.path.abspath(options.ref_genome)
+	else:
+		print (colored("** ERROR: Fasta reference genome provided does not exist", 'red'))
+		exit()
+
+	if "salmon" in options.soft_name or "kallisto" in options.soft_name:
+		if HCGB_files.is_non_zero_file(options.ref_transcriptome):
+			options.ref_transcriptome = os.path.abspath(options.ref_transcriptome)
+		else:
+			print (colored("** ERROR: Reference transcriptome (--ref_transcriptome) is required for salmon and kallisto", 'red'))
+			exit()
+
+	if (options.ref_annot):
+		if HCGB_files.is_non_zero_file(options.ref_annot):
+			options.ref_annot = os.path.abspath(options.ref_annot)
+		else:
+			print (colored("** ERROR: Reference genome annotation provided does not exist", 'red'))
+			exit()
+
+	################################################
+	## Prepare samples
+	################################################
+	prep.run_prep(options)
+
+	HCGB_aes.pipeline_header('RSP')
+	HCGB_aes.boxymcboxface("RNAseq pipeline")
+	print ("--------- Starting Process ---------")
+	HCGB_time.print_time()
+
+	## the project folder is the input for the rest of the steps
+	outdir = os.path.abspath(options.output_folder)
+	options.input = outdir
+	options.project = True
+
+	print ('+ Getting files from project folder... ')
+	pd_samples_retrieved = sampleParser.files.get_files(options, outdir, "fastq", ["fastq", "fq", "fastq.gz", "fq.gz"], options.debug)
+
+	## debug message
+	if (Debug):
+		print (colored("**DEBUG: pd_samples_retrieve **", 'yellow'))
+		print (pd_samples_retrieved)
+
+	## output folders for each sample and step
+	outdir_dict = {}
+	for step in ("fastqc", "trim", "fastqc_trimmed", "map", "counts"):
+		outdir_dict[step] = HCGB_files.outdir_project(outdir, options.project, pd_samples_retrieved, step, options.debug, groupby_col="new_name")
+
+	## samples sorted by size: largest first
+	sample_list = scheduler.sort_by_size(pd_samples_retrieved.groupby(["new_name"]))
+	num_samples = len(sample_list)
+
+	## resources
+	memory = scheduler.memory_budget(options)
+	print ("+ Resources: %s threads; %s bytes of memory" %(options.threads, memory))
+
+	################################################
+	## Check parameters for each step
+	################################################
+	print ("\n--------- Check parameters ---------\n")
+
+	## trimming
+	print ('+ Setting trimming parameters: ' + options.software)
+	(trim_params, adapters_dict) = trim.get_trim_params(options)
+
+	## mapping: check or create index for each software
+	if (options.index_folder):
+		path_reference = os.path.abspath(options.index_folder)
+	else:
+		path_reference = os.path.abspath(options.ref_folder)
+	HCGB_files.create_folder(path_reference)
+
+	map_params = {}
+	for soft in options.soft_name:
+		print ('+ Checking index for %s: ' %soft)
+		map_params[soft] = {
+			'index': map_module.check_index(soft, path_reference, options.ref_genome, options.ref_name + '_' + soft, 
+										 threads=options.threads, extra_index=options.extra_index, index_folder=options.index_folder, 
+										 limitGenomeGenerateRAM=options.limitGenomeGenerateRAM, Debug=Debug, 
+										 transcriptome=options.ref_transcriptome),
+			'sort_memory': options.sort_memory,
+			'transcriptome': options.ref_transcriptome,
+			'fragment_length': options.fragment_length,
+			'fragment_sd': options.fragment_sd
+		}
+
+	## counting: only for software generating a BAM file
+	count_soft = []
+	if (options.ref_annot):
+		count_soft = [ soft for soft in options.soft_name if count_module.bam_files_soft[soft].endswith(".bam") ]
+	else:
+		print ("+ No annotation file provided (--ref_annot): no counting will be done...")
+
+	## debug message
+	if (Debug):
+		print (colored("**DEBUG: map_params **", 'yellow'))
+		print (map_params)
+		print (colored("**DEBUG: count_soft **", 'yellow'))
+		print (count_soft)
+
+	################################################
+	## Create dependency graph
+	################################################
+	print ("\n--------- Create dependency graph ---------\n")
+	tasks = {}
+
+	## subsampling is done by the native QC backend
+	qc_backend = "native" if options.qc_subsample else options.qc_backend
+
+	## threads for each tool
+	(workers, threads_fastqc) = scheduler.plan_jobs("fastqc", options.threads, memory, num_samples)
+	(workers, threads_trim) = scheduler.plan_jobs(options.software, options.threads, memory, num_samples)
+	(workers, threads_count) = scheduler.plan_jobs("featureCounts", options.threads, memory, num_samples)
+	threads_map = { soft: scheduler.plan_jobs(soft, options.threads, memory, num_samples)[1] for soft in options.soft_name if soft != "star" }
+
+	## STAR: genome loaded once in shared memory; it is not available for the rest of jobs
+	memory_dag = memory
+	if "star" in options.soft_name:
+		STAR_exe = set_config.get_exe("STAR", Debug=Debug)
+		genomeDir = map_params["star"]["index"]
+		STAR_folder = HCGB_files.create_subfolder('STAR_files', os.path.abspath("./"))
+		(star_jobs, threads_STAR, limitRAM_job) = STAR_caller.plan_mapping_jobs(options.threads, num_samples, genomeDir, 
+																			 options.limitGenomeGenerateRAM, memory)
+		if memory:
+			memory_dag = max(1, memory - STAR_caller.genome_size(genomeDir))
+
+		## mapping tasks switched to NoSharedMemory if the genome can not be loaded
+		star_map_tasks = []
+		scheduler.add_task(tasks, "load_genome:star", load_STAR_genome, 
+						 [STAR_exe, genomeDir, STAR_folder, options.threads, Debug, star_map_tasks], 
+						 tool="star", threads=1, memory=0)
+
+	for name, cluster in sample_list:
+		reads = sorted(cluster["sample"].tolist())
+		trimmed_reads = trim.trimmed_files(outdir_dict["trim"][name], name, options.pair, options.compress_intermediates)
+
+		## QC raw reads
+		if not (options.skip_QC):
+			scheduler.add_task(tasks, "QC:" + name, fastqc_caller.run_module_fastqc, 
+							 [outdir_dict["fastqc"][name], reads, name, threads_fastqc, options.qc_backend, options.qc_subsample],
+							 tool="fastqc", threads=threads_fastqc, sample=name, 
+							 outputs=fastqc_caller.fastqc_outputs(outdir_dict["fastqc"][name], reads, qc_backend))
+
+		## trimming
+		if options.software == "trimmomatic":
+			trim_args = [reads, outdir_dict["trim"][name], name, threads_trim, Debug, trim_params, options.adapters, options.compress_intermediates]
+			trim_func = trim.trimmo_module
+		elif options.software == "native":
+			trim_args = [reads, outdir_dict["trim"][name], name, threads_trim, Debug, trim_params, options.compress_intermediates]
+			trim_func = trim.native_module
+		else:
+			trim_args = [reads, outdir_dict["trim"][name], name, threads_trim, options.min_read_len, Debug, adapters_dict, options.extra, options.compress_intermediates]
+			trim_func = trim.cutadapt_module
+
+		scheduler.add_task(tasks, "trim:" + name, trim_func, trim_args, 
+						 tool=options.software, threads=threads_trim, sample=name, outputs=trimmed_reads)
+
+		## QC trimmed reads
+		if not (options.skip_QC):
+			scheduler.add_task(tasks, "QC_trimmed:" + name, fastqc_caller.run_module_fastqc, 
+							 [outdir_dict["fastqc_trimmed"][name], trimmed_reads, name, threads_fastqc, options.qc_backend, options.qc_subsample], 
+							 deps=["trim:" + name], tool="fastqc", threads=threads_fastqc, sample=name, 
+							 outputs=fastqc_caller.fastqc_outputs(outdir_dict["fastqc_trimmed"][name], trimmed_reads, qc_backend))
+
+		## mapping
+		for soft in options.soft_name:
+			map_folder = os.path.join(outdir_dict["map"][name], soft)
+			if soft == "star":
+				star_map_tasks.append(scheduler.add_task(tasks, "map_star:" + name, map_module.mapReads_caller_STAR, 
+								 [trimmed_reads, outdir_dict["map"][name], name, threads_STAR, STAR_exe, 
+								  genomeDir, limitRAM_job, Debug, multimapping, "LoadAndKeep"], 
+								 deps=["trim:" + name, "load_genome:star"], tool="star", threads=threads_STAR, 
+								 memory=limitRAM_job + 2000000000, sample=name, 
+								 outputs=[os.path.join(map_folder, count_module.bam_files_soft[soft])]))
+			else:
+				## sorting memory only for software generating a BAM file
+				memory_map = scheduler.get_profile(soft)['memory']
+				if count_module.bam_files_soft[soft].endswith(".bam"):
+					memory_map += threads_map[soft] * scheduler.parse_memory(options.sort_memory)
+				scheduler.add_task(tasks, "map_" + soft + ":" + name, map_module.module_map, 
+								 [name, path_reference, options.ref_genome, options.ref_name, trimmed_reads, 
+								  outdir_dict["map"][name], threads_map[soft], map_params, [soft], Debug], 
+								 deps=["trim:" + name], tool=soft, threads=threads_map[soft], sample=name, 
+								 memory=memory_map, outputs=[result_cache.cache_file(map_folder, soft)])
+
+		## counting
+		for soft in count_soft:
+			bam_file = os.path.join(outdir_dict["map"][name], soft, count_module.bam_files_soft[soft])
+			scheduler.add_task(tasks, "count_" + soft + ":" + name, count_module.gene_count_caller, 
+							 [outdir_dict["counts"][name], options.ref_annot, bam_file, name, threads_count, 
+							  multimapping, options.stranded, soft, Debug, None, options.compress_intermediates], 
+							 deps=["map_" + soft + ":" + name], tool="featureCounts", threads=threads_count, sample=name, 
+							 outputs=featurecounts.count_outputs(os.path.join(outdir_dict["counts"][name], soft), options.compress_intermediates)[:1])
+
+	print ("+ Tasks to do: %s [samples: %s]" %(len(tasks), num_samples))
+
+	## HCGB_time.timestamp
+	start_time_partial = HCGB_time.timestamp(start_time_total)
+
+	################################################
+	## Let's go
+	################################################
+	print ("\n--------- Processing samples ---------\n")
+
+	## statistics of each sample stored as soon as each task finishes: summary report updated every minute
+	step_folders = { "QC": "fastqc", "QC_trimmed": "fastqc_trimmed", "trim": "trim", "map": "map", "count": "counts" }
+	last_report = [time.time()]
+	def task_finished(task_id, task):
+		step = task_id.split(":")[0]
+		step = step if step in step_folders else step.split("_")[0]
+		if step not in step_folders:
+			return
+		run_stats.ingest(outdir, [(task['sample'], step, outdir_dict[step_folders[step]][task['sample']])], Debug)
+		if not options.skip_report and time.time() - last_report[0] > 60:
+			dashboard.build_dashboard(outdir, Debug)
+			last_report[0] = time.time()
+
+	scheduler.run_dag(tasks, options.threads, memory_dag, Debug, on_done=task_finished)
+
+	## remove reference genome from memory unless pinned or used by other processes
+	if tasks.get("load_genome:star", {}).get('result') == "LoadAndKeep":
+		STAR_genome.detach_genome(STAR_exe, genomeDir, STAR_folder, options.threads, Debug)
+
+	print ("\n\n+ Processing samples has finished...")
+	start_time_partial = HCGB_time.timestamp(start_time_partial)
+
+	## summary of tasks
+	tasks_status = {}
+	for task_id, task in tasks.items():
+		tasks_status.setdefault(task['status'], []).append(task_id)
+	for status, task_ids in tasks_status.items():
+		print ("+ Tasks %s: %s" %(status, len(task_ids)))
+		if status != 'done':
+			for task_id in task_ids:
+				print (colored("\t- " + task_id, 'yellow'))
+
+	################################################
+	## Reports & count matrix
+	################################################
+	def samples_done(step):
+		return ([ name for name, cluster in sample_list if tasks.get(step + ":" + name, {}).get('status') == 'done' ])
+
+	## statistics of all steps stored for the project
+	run_stats.update_report(outdir, [ (name, step, outdir_dict[folder][name]) for name, cluster in sample_list 
+									  for step, folder in step_folders.items() ], Debug)
+
+	## summary report for the cohort using statistics stored
+	if not (options.skip_report):
+		dashboard.build_dashboard(outdir, Debug)
+
+	if (options.skip_report or not options.multiqc):
+		print ("+ No MultiQC report generation...")
+	else:
+		print ("\n+ Generating a report using MultiQC module.")
+		outdir_report = HCGB_files.create_subfolder("report", outdir)
+
+		if not (options.skip_QC):
+			qc.multiQC_rep(options, outdir, { name: outdir_dict["fastqc"][name] for name in samples_done("QC") }, "", Debug)
+			qc.multiQC_rep(options, outdir, { name: outdir_dict["fastqc_trimmed"][name] for name in samples_done("QC_trimmed") }, "trimmed", Debug)
+
+		trimm_report = HCGB_files.create_subfolder("trim", outdir_report)
+		multiQC_report.multiQC_module_call(set([ outdir_dict["trim"][name] for name in samples_done("trim") ]), "Cutadapt", trimm_report, "")
+
+		for soft in options.soft_name:
+			multiQC_report.create_module_report(main_outdir=outdir, soft_name=soft, 
+				outdir_dict_given={ name: os.path.join(outdir_dict["map"][name], soft) for name in samples_done("map_" + soft) }, 
+				module_given="map", options2multiqc="-dd 3")
+
+		for soft in count_soft:
+			multiQC_report.create_module_report(main_outdir=outdir, soft_name=soft, 
+				outdir_dict_given={ name: os.path.join(outdir_dict["counts"][name], soft) for name in samples_done("count_" + soft) }, 
+				module_given="counts", options2multiqc="-dd 3")
+
+	## count matrix for each software
+	for soft in count_soft:
+		results_dict = { name: featurecounts.count_outputs(os.path.join(outdir_dict["counts"][name], soft), options.compress_intermediates)[0] for name in samples_done("count_" + soft) }
+		if not results_dict:
+			continue
+		module_outdir_report = HCGB_files.create_subfolder("counts", HCGB_files.create_subfolder("report", outdir))
+		all_counts_matrix_soft = generate_matrix.generate_matrix(results_dict, "Geneid", Debug, options.threads)
+		csv_outfile = os.path.join(module_outdir_report, 'counts_RNAseq_' + soft + '.csv')
+		all_counts_matrix_soft.to_csv(csv_outfile, quoting=csv.QUOTE_NONNUMERIC)
+		print("Save counts in file: " + csv_outfile)
+
+	## transcript and gene matrices for alignment-free quantification
+	if "salmon" in options.soft_name:
+		quant_matrix.write_matrices("salmon", { name: os.path.join(outdir_dict["map"][name], "salmon", salmon.quant_file_name) for name in samples_done("map_salmon") }, 
+									"Name", "NumReads", "TPM", os.path.join(outdir, "report", "counts"), options.ref_annot, Debug, options.threads)
+	if "kallisto" in options.soft_name:
+		quant_matrix.write_matrices("kallisto", { name: os.path.join(outdir_dict["map"][name], "kallisto", kallisto.quant_file_name) for name in samples_done("map_kallisto") }, 
+									"target_id", "est_counts", "tpm", os.path.join(outdir, "report", "counts"), options.ref_annot, Debug, options.threads)
+
+	## disk saved and time spent compressing trimmed reads and counts
+	compression_summary = {}
+	if (options.compress_intermediates):
+		compression_summary = compression.benchmark_report(list(outdir_dict["trim"].values()) + list(outdir_dict["counts"].values()), 
+														   os.path.join(HCGB_files.create_subfolder("info", outdir), "compression_benchmark.tsv"))
+		compression_summary['task_seconds'] = round(sum(task['end'] - task['start'] for task_id, task in tasks.items() 
+														if task['status'] == 'done' and task_id.split(":")[0] in ["trim"] + [ "count_" + soft for soft in count_soft ]), 2)
+		print ("+ Compression time: %s seconds of %s seconds trimming and counting (all tasks)" %(compression_summary.get('seconds', 0), compression_summary['task_seconds']))
+
+	## critical path
+	path = scheduler.print_critical_path(tasks)
+
+	################################################
+	## dump information and parameters
+	################################################
+	## samples information dictionary
+	samples_info = {}
+	for name, cluster in sample_list:
+		samples_info[name] = cluster['sample'].to_list()
+
+	tasks_info = { task_id: { 'status': task['status'], 'start': task['start'], 'end': task['end'], 
+							'threads': task['threads'], 'memory': task['memory'] } for task_id, task in tasks.items() }
+
+	info_dir = HCGB_files.create_subfolder("info", outdir)
+	print("+ Dumping information and parameters")
+	runInfo = { "module":"run", "time":time.time(),
+				"RSP version":pipeline_version,
+				'sample_info': samples_info,
+				"outdir_dict": outdir_dict,
+				"trim_params": trim_params,
+				"map_params": map_params,
+				"tasks": tasks_info,
+				"compression": compression_summary,
+				"critical_path": path }
+
+	HCGB_info.dump_info_run(info_dir, 'run', options, runInfo, options.debug)
+	################################################
+
+	print ("\n*************** Finish *******************")
+	start_time_partial = HCGB_time.timestamp(start_time_total)
+
+	print ("\n+ Exiting run module.")
+	return (runInfo)
+
+###############################################
+def load_STAR_genome(STAR_exe, genomeDir, folder, threads, Debug, map_tasks=[]):
+	"""Loads STAR genome in shared memory (or attaches to it) for the mapping tasks.
+
+	If not possible, each mapping task loads its own copy of the genome (NoSharedMemory):
+	the genome load option and the memory of the mapping tasks given are updated.
+
+	:returns: Genome load mode: LoadAndKeep or NoSharedMemory
+	"""
+	if STAR_genome.attach_genome(STAR_exe, genomeDir, folder, threads, Debug):
+		return ("LoadAndKeep")
+
+	print (colored("** Warning: STAR genome could not be loaded in shared memory. See logs in " + folder, 'yellow'))
+	print (colored("** Warning: Each sample loads the genome (--genomeLoad NoSharedMemory)", 'yellow'))
+	for task in map_tasks:
+		task['args'][-1] = "NoSharedMemory"
+		task['memory'] += STAR_caller.genome_size(genomeDir)
+	return ("NoSharedMemory")
@@ -18,6 +18,7 @@ from termcolor import colored
 
 ## import my modules
 from RSP.modules import help_RSP
+from RSP.scripts import file_transfer
 from RSP import __version__ as pipeline_version
 
 from HCGB import sampleParser
@@ -185,9 +186,8 @@ def run_prep(options):
     if (options.merge_Reads):
         print ("+ Sample files will be merged...")
         ## TODO: check when rename option provided
-        pd_samples_merged = sampleParser.merge.one_file_per_sample(
-            pd_samples_retrieved, outdir_dict, options.threads,    
-            final_dir, options.debug)
+        pd_samples_merged = merge_reads(pd_samples_retrieved, outdir_dict, options.threads,
+                                        final_dir, not options.no_checksum, options.debug)
         
         if (options.rename):
             print ("+ Merge files have been renamed...")
@@ -220,12 +220,10 @@ def run_prep(options):
         print ("+ Sample files will be linked...")    
     
     list_reads = []
+    copy_jobs = []
     for index, row in pd_samples_retrieved.iterrows():
         if (options.copy_reads):
-            ## TODO: debug & set threads to copy faster
-            shutil.copy(row['sample'], os.path.join(outdir_dict[row['new_name']], row['new_file'] ))            
-            string = row['sample'] + '\t' + os.path.join(outdir_dict[row['new_name']], row['new_file']) + '\n'
-            copy_details_hd.write(string)            
+            copy_jobs.append(([row['sample']], os.path.join(outdir_dict[row['new_name']], row['new_file'])))
         else:
             list_reads.append(row['new_file'])
             
@@ -234,8 +232,19 @@ def run_prep(options):
                                                  os.path.join(outdir_dict[row['new_name']], row['new_file']))
 
     if (options.copy_reads):
+        ## copy in parallel: files already copied are skipped and partial copies resumed
+        results = file_transfer.transfer_files(copy_jobs, options.threads, 
+                                               os.path.join(final_dir, 'prep_transfer.json'),
+                                               not options.no_checksum, options.debug)
+        copy_details_hd.write("\t".join(['source', 'destination', 'size', 'seconds', 'MB/s', 'md5', 'status']) + '\n')
+        for (sources, destination), result in zip(copy_jobs, results):
+            copy_details_hd.write(details_line(sources[0], destination, result))
+
         print ("+ Sample files have been copied...")
         copy_details_hd.close()
+        if not all(results):
+            print (colored("** ERROR: Some files could not be copied. See details in: " + copy_details, 'red'))
+            exit()
     else:
         if not options.project:
             HCGB_files.get_symbolic_link(list_reads, outdir)
@@ -265,3 +274,68 @@ def run_prep(options):
 
     print ("+ Exiting prep module.")
     return()
+
+################################
+def details_line(source, destination, result):
+    """Line for copy/merge details: source, destination, size, seconds, throughput, md5 and status"""
+    if not result:
+        return ("%s\t%s\tNA\tNA\tNA\tNA\tfailed\n" %(source, destination))
+    return ("%s\t%s\t%s\t%s\t%s\t%s\t%s\n" %(source, destination, result['size'], result['seconds'], 
+                                               result['MBps'], result['md5'], result['status']))
+
+################################
+def merge_reads(pd_samples_retrieved, outdir_dict, threads, final_dir, checksum, Debug):
+    """
+    Merges files corresponding to the same sample and read pair (e.g. different lanes).
+
+    Files are merged in parallel (see file_transfer). Merged files previously generated
+    from the same files are not generated again.
+
+    :param pd_samples_retrieved: Dataframe containing samples retrieved
+    :param outdir_dict: Dictionary containing output folder for each sample
+    :param threads: Number of files merged at the same time
+    :param final_dir: Folder to store merge details
+    :param checksum: Calculate MD5 for merged files
+    :param Debug: Show debugging messages
+
+    :returns: Dataframe containing merged files
+    """
+    list_samples = set(pd_samples_retrieved['new_name'].tolist())
+    print (colored("\t" + str(len(list_samples)) + " samples to be merged from the input provided...", 'yellow'))
+    print ("+ Merging sequencing files for samples")
+
+    merge_jobs = []
+    merged_files = []
+    sample_frame = pd_samples_retrieved.groupby(["new_name", "read_pair"])
+    for name, cluster in sample_frame:
+        row = cluster.iloc[0]
+        if (row['gz']):
+            extension_string = row['ext'] + row['gz']
+        else:
+            extension_string = row['ext']
+
+        outfile = os.path.join(outdir_dict[name[0]], name[0] + '_' + name[1] + '.' + extension_string)
+        merge_jobs.append((sorted(set(cluster["sample"].tolist())), outfile))
+        merged_files.append((name[0], outdir_dict[name[0]], name[1], outfile, row['ext'], row['gz']))
+
+    results = file_transfer.transfer_files(merge_jobs, threads, os.path.join(final_dir, 'prep_transfer.json'), checksum, Debug)
+
+    ## print to a file
+    timestamp = HCGB_time.create_human_timestamp()
+    merge_details = os.path.join(final_dir, timestamp + '_prep_mergeDetails.txt')
+    with open(merge_details, 'w') as merge_details_hd:
+        for (sources, outfile), (new_name, dirname, read_pair, new_file, ext, gz), result in zip(merge_jobs, merged_files, results):
+            merge_details_hd.write("####################\n")
+            merge_details_hd.write("Sample: " + new_name + '\n')
+            merge_details_hd.write("Read: " + read_pair + '\n')
+            merge_details_hd.write("Files:\n")
+            merge_details_hd.write(",".join(sources) + '\n')
+            merge_details_hd.write("Details:\n")
+            merge_details_hd.write(details_line(",".join(sources), outfile, result))
+            merge_details_hd.write("####################\n")
+
+    if not all(results):
+        print (colored("** ERROR: Some files could not be merged. See details in: " + merge_details, 'red'))
+        exit()
+
+    return (pd.DataFrame(merged_files, columns=("new_name", "dirname", "read_pair", "new_file", "ext", "gz")))
@@ -18,9 +18,12 @@ from termcolor import colored
 
 ## import my modules
 from RSP.scripts import multiQC_report
+from RSP.scripts import run_stats
+from RSP.scripts import dashboard
 from RSP.scripts import fastqc_caller
 from RSP.config import set_config
 from RSP.modules import help_RSP
+from RSP.modules import scheduler
 from RSP import __version__ as pipeline_version
 
 from HCGB import sampleParser
@@ -176,23 +179,18 @@ def fastqc(pd_samples_retrieved, outdir, options, name_analysis, time_stamp, Deb
     # Group dataframe by sample name
     sample_frame = pd_samples_retrieved.groupby(["name"])
 
-    ## optimize threads
+    ## optimize threads and memory according to tool resources
     name_list = set(pd_samples_retrieved["name"].tolist())
-    threads_job = HCGB_main.optimize_threads(options.threads, len(name_list)) ## threads optimization
-    max_workers_int = int(options.threads/threads_job)
-
-    ## debug message
-    if (Debug):
-        HCGB_aes.debug_message("options.threads: " + str(options.threads), "yellow")
-        HCGB_aes.debug_message("max_workers: " + str(max_workers_int), "yellow")
-        HCGB_aes.debug_message("threads_job: " + str(threads_job), "yellow")
+    (max_workers_int, threads_job) = scheduler.optimize_resources("fastqc", options, len(name_list), Debug)
 
     ## send for each sample
+    if (options.qc_subsample):
+        print ("+ Checking quality using %s reads sampled from each file..." %options.qc_subsample)
     print ("+ Calling fastqc for samples...")    
     with concurrent.futures.ThreadPoolExecutor(max_workers=int(max_workers_int)) as executor:
         commandsSent = { executor.submit(fastqc_caller.run_module_fastqc, 
                                          outdir_dict[name], sorted( cluster["sample"].tolist() ), 
-                                         name, threads_job): name for name, cluster in sample_frame }
+                                         name, threads_job, options.qc_backend, options.qc_subsample): name for name, cluster in scheduler.sort_by_size(sample_frame) }
         
         for cmd2 in concurrent.futures.as_completed(commandsSent):
             details = commandsSent[cmd2]
@@ -214,8 +212,14 @@ def multiQC_rep(options, outdir, outdir_dict, name_analysis, Debug):
     ################################################
     ## Report
     ################################################
-    if (options.skip_report):
-        print ("+ No report generation...")
+    ## statistics stored for the project and summary report
+    step = "QC_" + name_analysis if name_analysis else "QC"
+    run_stats.update_report(outdir, [ (name, step, folder) for name, folder in outdir_dict.items() ], Debug)
+    if not (options.skip_report):
+        dashboard.build_dashboard(outdir, Debug)
+
+    if (options.skip_report or not options.multiqc):
+        print ("+ No MultiQC report generation...")
     else:
     
         ## folder name
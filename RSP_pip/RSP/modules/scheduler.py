@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+##########################################################
+## Jose F. Sanchez                                      ##
+## Copyright (C) 2019-2020 Lauro Sumoy Lab, IGTP, Spain ##
+##########################################################
+"""
+Resource-aware scheduling of jobs according to CPU and RAM available
+"""
+## import useful modules
+import os
+import re
+import time
+import concurrent.futures
+from termcolor import colored
+
+import HCGB.functions.aesthetics_functions as HCGB_aes
+
+## CPU and RAM profile for each tool:
+## - min_threads/max_threads: range of threads each job can make use of
+## - memory: RAM (bytes) needed for each job
+## - memory_thread: additional RAM (bytes) needed for each thread
+tool_profiles = {
+	'fastqc': 		{'min_threads': 1, 'max_threads': 2,  'memory': 500000000,   'memory_thread': 250000000},
+	'trimmomatic': 	{'min_threads': 2, 'max_threads': 8,  'memory': 1000000000,  'memory_thread': 100000000},
+	'cutadapt': 	{'min_threads': 1, 'max_threads': 8,  'memory': 500000000,   'memory_thread': 100000000},
+	'native': 		{'min_threads': 1, 'max_threads': 16, 'memory': 500000000,   'memory_thread': 400000000},
+	'star': 		{'min_threads': 4, 'max_threads': 32, 'memory': 32000000000, 'memory_thread': 0},
+	'hisat2': 		{'min_threads': 2, 'max_threads': 16, 'memory': 8000000000,  'memory_thread': 0},
+	'salmon': 		{'min_threads': 2, 'max_threads': 16, 'memory': 16000000000, 'memory_thread': 0},
+	'kallisto': 	{'min_threads': 1, 'max_threads': 16, 'memory': 4000000000,  'memory_thread': 0},
+	'featureCounts':{'min_threads': 1, 'max_threads': 8,  'memory': 2000000000,  'memory_thread': 50000000},
+	'default': 		{'min_threads': 1, 'max_threads': 8,  'memory': 1000000000,  'memory_thread': 0},
+}
+
+###############################################
+def system_memory():
+	"""Total physical memory (bytes) in the system. Returns 0 if not available."""
+	try:
+		return (os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+	except (ValueError, OSError, AttributeError):
+		return (0)
+
+###############################################
+def parse_memory(memory_given):
+	"""Converts memory provided (e.g. 32G, 500M, 2000000000) into bytes
+
+	:param memory_given: Memory provided by the user. Units: K, M, G or T (optional).
+	:type memory_given: string
+
+	:returns: Memory in bytes (int)
+	"""
+	units = {'': 1, 'K': 10**3, 'M': 10**6, 'G': 10**9, 'T': 10**12}
+	match = re.match(r"^\s*([0-9\.]+)\s*([KMGT]?)B?\s*$", str(memory_given).upper())
+	if not match:
+		HCGB_aes.raise_and_exit("Memory provided is not valid: %s. Use e.g. 32G, 500M or bytes." %memory_given)
+	return (int(float(match.group(1)) * units[match.group(2)]))
+
+###############################################
+def memory_budget(options):
+	"""Memory (bytes) available for the jobs: --max_memory if provided, otherwise 90% of system memory."""
+	max_memory = getattr(options, 'max_memory', None)
+	if max_memory:
+		return (parse_memory(max_memory))
+	return (int(system_memory() * 0.9))
+
+###############################################
+def get_profile(tool):
+	"""Returns resource profile for a tool or list of tools (maximum requirements)."""
+	if isinstance(tool, (list, tuple, set)):
+		profiles = [get_profile(t) for t in tool] or [tool_profiles['default']]
+		return ({ key: max(p[key] for p in profiles) for key in tool_profiles['default'] })
+	return (tool_profiles.get(tool, tool_profiles.get(str(tool).lower(), tool_profiles['default'])))
+
+###############################################
+def plan_jobs(tool, threads, memory, num_jobs):
+	"""Decides how many jobs to run at the same time and threads for each job.
+
+	Concurrent jobs are limited by threads (minimum threads for the tool), by memory
+	(memory for each job plus memory per thread) and by the number of jobs to do. Threads
+	are split among concurrent jobs up to the maximum the tool can make use of.
+
+	:param tool: Tool name or list of tool names (see tool_profiles)
+	:param threads: Total number of threads available
+	:param memory: Total memory (bytes) available. Not limited if 0.
+	:param num_jobs: Number of jobs to do
+
+	:type tool: string or list
+	:type threads: int
+	:type memory: int
+	:type num_jobs: int
+
+	:returns: (max_workers, threads_job)
+	"""
+	profile = get_profile(tool)
+	threads = max(1, int(threads))
+	num_jobs = max(1, int(num_jobs))
+
+	workers = max(1, threads // profile['min_threads'])
+	if memory:
+		job_memory = profile['memory'] + profile['memory_thread'] * profile['min_threads']
+		workers = min(workers, max(1, memory // job_memory))
+	workers = int(min(workers, num_jobs))
+
+	threads_job = min(profile['max_threads'], max(1, threads // workers))
+
+	## memory needed by threads in each job
+	if memory and profile['memory_thread']:
+		threads_mem = (memory // workers - profile['memory']) // profile['memory_thread']
+		threads_job = max(1, min(threads_job, threads_mem))
+
+	return (workers, int(threads_job))
+
+###############################################
+def files_size(files):
+	"""Total size (bytes) of the existing files provided"""
+	return (sum(os.path.getsize(f) for f in files if os.path.isfile(f)))
+
+###############################################
+def sort_by_size(sample_frame, column="sample"):
+	"""Returns groups of a grouped dataframe sorted by size of the files (largest first)
+
+	Dispatching largest inputs first avoids a big sample starting at the end of the run
+	while the rest of workers are idle.
+
+	:param sample_frame: pandas groupby object, e.g. pd_samples_retrieved.groupby(["new_name"])
+	:param column: Column containing the files
+
+	:returns: List of (name, cluster)
+	"""
+	groups = [ (name[0] if isinstance(name, tuple) and len(name) == 1 else name, cluster) for name, cluster in sample_frame ]
+	return (sorted(groups, key=lambda group: files_size(group[1][column].tolist()), reverse=True))
+
+###############################################
+def sort_dict_by_size(files_dict):
+	"""Returns items of a dictionary of files sorted by size of the files (largest first)
+
+	:param files_dict: Dictionary containing names as keys and file or list of files as values
+
+	:returns: List of (name, file)
+	"""
+	def size_item(item):
+		files = item[1] if isinstance(item[1], (list, tuple)) else [item[1]]
+		return (files_size(files))
+	return (sorted(files_dict.items(), key=size_item, reverse=True))
+
+###############################################
+def split_by_size(files_dict, num_chunks):
+	"""Splits items of a dictionary of files in chunks of similar total size (largest files first)
+
+	:param files_dict: Dictionary containing names as keys and file or list of files as values
+	:param num_chunks: Number of chunks
+
+	:returns: List of lists of (name, file). Empty chunks are not returned.
+	"""
+	chunks = [ [] for i in range(max(int(num_chunks), 1)) ]
+	sizes = [ 0 for chunk in chunks ]
+	for name, files in sort_dict_by_size(files_dict):
+		smallest = sizes.index(min(sizes))
+		chunks[smallest].append((name, files))
+		sizes[smallest] += files_size(files if isinstance(files, (list, tuple)) else [files])
+	return ([ chunk for chunk in chunks if chunk ])
+
+###############################################
+def optimize_resources(tool, options, num_jobs, Debug=False):
+	"""Returns number of workers and threads for each job given options provided (--threads and --max_memory)
+
+	:param tool: Tool name or list of tool names (see tool_profiles)
+	:param options: input parameters introduced by the user.
+	:param num_jobs: Number of jobs to do
+	:param Debug: True/False for debugging messages
+
+	:returns: (max_workers, threads_job)
+	"""
+	memory = memory_budget(options)
+	(max_workers, threads_job) = plan_jobs(tool, options.threads, memory, num_jobs)
+
+	## debug message
+	if (Debug):
+		print (colored("**DEBUG: tool: " + str(tool) + " **", 'yellow'))
+		print (colored("**DEBUG: options.threads " +  str(options.threads) + " **", 'yellow'))
+		print (colored("**DEBUG: memory budget " +  str(memory) + " **", 'yellow'))
+		print (colored("**DEBUG: max_workers " +  str(max_workers) + " **", 'yellow'))
+		print (colored("**DEBUG: cpu_here " +  str(threads_job) + " **", 'yellow'))
+
+	return (max_workers, threads_job)
+
+###############################################
+def add_task(tasks, task_id, func, args, deps=[], tool="default", threads=1, memory=None, sample="", outputs=[]):
+	"""Adds a task to the dependency graph (tasks dictionary)
+
+	:param tasks: Dictionary containing tasks (task_id: task)
+	:param task_id: Unique identifier for the task, e.g. trim:sample1
+	:param func: Function to call
+	:param args: Arguments for the function
+	:param deps: List of task ids that must finish before this task starts
+	:param tool: Tool name (see tool_profiles) used to estimate memory
+	:param threads: Threads used by the task
+	:param memory: Memory (bytes) used by the task. Estimated from the tool profile if not provided.
+	:param sample: Sample name
+	:param outputs: Files that must exist once the task finishes successfully
+
+	:returns: Task dictionary
+	"""
+	if memory is None:
+		profile = get_profile(tool)
+		memory = profile['memory'] + profile['memory_thread'] * threads
+
+	tasks[task_id] = { 'func': func, 'args': args, 'deps': list(deps), 'tool': tool,
+					'threads': int(threads), 'memory': int(memory), 'sample': sample,
+					'outputs': list(outputs), 'status': 'pending', 'start': None, 'end': None, 'result': None }
+	return (tasks[task_id])
+
+###############################################
+def task_priority(tasks):
+	"""Longest chain of dependent tasks after each task. Tasks with longer chains are dispatched first."""
+	children = { task_id: [] for task_id in tasks }
+	for task_id, task in tasks.items():
+		for dep in task['deps']:
+			children[dep].append(task_id)
+
+	height = {}
+	def get_height(task_id):
+		if task_id not in height:
+			height[task_id] = 1 + max([get_height(child) for child in children[task_id]] or [0])
+		return (height[task_id])
+
+	for task_id in tasks:
+		get_height(task_id)
+	return (height, children)
+
+###############################################
+def call_task(task):
+	"""Calls the function for a task, keeps its result and checks the outputs expected exist"""
+	task['result'] = task['func'](*task['args'])
+	missing = [ f for f in task['outputs'] if not os.path.exists(f) ]
+	if missing:
+		raise Exception("Output(s) not generated: " + ", ".join(missing))
+	return (True)
+
+###############################################
+def run_dag(tasks, threads, memory, Debug=False, on_done=None):
+	"""Executes a dependency graph of tasks as soon as dependencies and resources allow.
+
+	Each task starts once all its dependencies have finished successfully and there
+	are enough threads and memory free for it. A task requesting more than available
+	is started alone. If a task fails, tasks depending on it are skipped while the rest
+	of the graph continues.
+
+	:param tasks: Dictionary containing tasks (see add_task)
+	:param threads: Total number of threads available
+	:param memory: Total memory (bytes) available. Not limited if 0.
+	:param Debug: True/False for debugging messages
+	:param on_done: Function called as on_done(task_id, task) once each task finishes successfully
+
+	:returns: Dictionary of tasks updated with status (done, failed, skipped), start and end time.
+	"""
+	(height, children) = task_priority(tasks)
+	order = { task_id: num for num, task_id in enumerate(tasks) }
+
+	free_threads = max(1, int(threads))
+	free_memory = int(memory)
+	running = {}
+
+	def skip_children(task_id):
+		for child in children[task_id]:
+			if tasks[child]['status'] == 'pending':
+				tasks[child]['status'] = 'skipped'
+				print (colored("** Skipping %s: dependency %s did not finish" %(child, task_id), 'yellow'))
+				skip_children(child)
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=free_threads) as executor:
+		while True:
+			## tasks ready to start
+			ready = [ task_id for task_id, task in tasks.items() if task['status'] == 'pending' 
+						and all(tasks[dep]['status'] == 'done' for dep in task['deps']) ]
+			ready.sort(key=lambda task_id: (-height[task_id], order[task_id]))
+
+			for task_id in ready:
+				task = tasks[task_id]
+				fits = task['threads'] <= free_threads and (not memory or task['memory'] <= free_memory)
+				if not fits and running:
+					continue
+
+				if (Debug):
+					print (colored("**DEBUG: start %s [threads: %s; memory: %s] **" %(task_id, task['threads'], task['memory']), 'yellow'))
+
+				task['status'] = 'running'
+				task['start'] = time.time()
+				free_threads -= task['threads']
+				free_memory -= task['memory']
+				running[executor.submit(call_task, task)] = task_id
+
+			if not running:
+				break
+
+			done, not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in done:
+				task_id = running.pop(future)
+				task = tasks[task_id]
+				task['end'] = time.time()
+				free_threads += task['threads']
+				free_memory += task['memory']
+				try:
+					future.result()
+					task['status'] = 'done'
+				except (Exception, SystemExit) as exc:
+					task['status'] = 'failed'
+					print ('***ERROR:')
+					print('%r generated an exception: %s' % (task_id, exc))
+					skip_children(task_id)
+
+				if on_done and task['status'] == 'done':
+					on_done(task_id, task)
+
+	return (tasks)
+
+###############################################
+def critical_path(tasks):
+	"""Chain of tasks that determined the total time of the execution.
+
+	Starting from the last task finished, it follows the dependency finishing last
+	for each task, i.e. the one that prevented it from starting earlier.
+
+	:param tasks: Dictionary of tasks executed (see run_dag)
+
+	:returns: List of task ids, from first to last.
+	"""
+	finished = { task_id: task for task_id, task in tasks.items() if task['end'] }
+	if not finished:
+		return ([])
+
+	path = [ max(finished, key=lambda task_id: finished[task_id]['end']) ]
+	while True:
+		deps = [ dep for dep in finished[path[-1]]['deps'] if dep in finished ]
+		if not deps:
+			break
+		path.append(max(deps, key=lambda task_id: finished[task_id]['end']))
+	return (path[::-1])
+
+###############################################
+def print_critical_path(tasks):
+	"""Prints the critical path: duration of each task and time waiting for resources."""
+	path = critical_path(tasks)
+	if not path:
+		return (path)
+
+	print ("\n+ Critical path:")
+	print ("\t%-40s %12s %12s" %("Task", "Wait (s)", "Time (s)"))
+	previous_end = min(task['start'] for task in tasks.values() if task['start'])
+	for task_id in path:
+		task = tasks[task_id]
+		print ("\t%-40s %12.1f %12.1f" %(task_id, task['start'] - previous_end, task['end'] - task['start']))
+		previous_end = task['end']
+	print ("\t%-40s %25.1f" %("Total", tasks[path[-1]]['end'] - min(task['start'] for task in tasks.values() if task['start'])))
+	return (path)
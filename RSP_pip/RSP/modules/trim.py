@@ -18,14 +18,20 @@ from termcolor import colored
 
 ## import my modules
 from RSP.scripts import multiQC_report
+from RSP.scripts import run_stats
+from RSP.scripts import dashboard
 from RSP.scripts import cutadapt_caller
 from RSP.scripts import trimmomatic_call
+from RSP.scripts import native_trim
+from RSP.scripts import result_cache
+from RSP.scripts import compression
 
 from RSP.config import set_config
 from RSP.data import data_files
 from RSP import __version__ as pipeline_version
 from RSP.modules import help_RSP
 from RSP.modules import qc
+from RSP.modules import scheduler
 
 from HCGB import sampleParser
 import HCGB.functions.info_functions as HCGB_info
@@ -109,75 +115,9 @@ def run_trim(options):
 
     ##########################
     ## Software:
-    ## Trimmomatic or Cutadapt    
-    ##########################
-    if options.software == "trimmomatic":
-        
-        #-----------------------------
-        ## Trimmomatic parameters:
-        #-----------------------------
-        
-        # Trimming adapters
-        if (options.adapters):
-            # Adapter file provided
-            options.adapters = os.path.abspath(options.adapters)
-            print("\t- Adapters file provided...")
-        else:
-            # Get default adpaters file
-            print("\t- Default Trimmomatic adapters (v0.39) will be used...")
-            options.adapters = data_files.data_list("available_Trimmomatic_adapters")
-    
-        # use default if not provided
-        trim_params = {
-            "ILLUMINACLIP": options.ILLUMINACLIP,
-            "LEADING": str(options.LEADING),
-            "TRAILING": str(options.TRAILING),
-            "SLIDINGWINDOW": options.SLIDINGWINDOW,
-            "MINLEN": str(options.MINLEN),
-            "adapters": options.adapters
-        }
-        adapters_dict = {
-            "adapters": options.adapters
-        }
-        
-    ##########################
-    elif options.software == "cutadapt":
-        
-        # Trimming adapters
-    
-        ## check adapters provided
-            ## options.adapters_a
-            ## options.adapters_A
-            ## options.extra
-            
-        ## no adapters provided
-        if (not options.adapters_a and not options.adapters_A and not options.extra):
-            print (colored("** ERROR: No adapter trimming options provided...", 'red'))
-            print ("Please provide any option")
-            exit()
-        
-        ## create dictionary with 
-        adapters_dict = {}
-        if (options.adapters_a):
-            adapters_dict['adapter_a'] = options.adapters_a
-        
-        if (options.adapters_A):
-            adapters_dict['adapter_A'] = options.adapters_A
-        else:
-            options.adapters_A = ""
-        
-        ## set default
-        if not options.min_len_read:
-            options.min_len_read=15
-    
-    
-        # use default if not provided
-        trim_params = {
-            "adapters_a": options.adapters_a,
-            "adapters_A": options.adapters_A,
-            "min_len_read": options.min_len_read
-        }
+    ## Trimmomatic, Cutadapt or native
     ##########################
+    (trim_params, adapters_dict) = get_trim_params(options)
     
     ################################################
     ## get files
@@ -202,16 +142,9 @@ def run_trim(options):
     ## for samples
     outdir_dict = HCGB_files.outdir_project(outdir, options.project, pd_samples_retrieved, "trim", options.debug)
     
-    ## optimize threads
+    ## optimize threads and memory according to tool resources
     name_list = set(pd_samples_retrieved["new_name"].tolist())
-    threads_job = HCGB_main.optimize_threads(options.threads, len(name_list)) ## threads optimization
-    max_workers_int = int(options.threads/threads_job)
-
-    ## debug message
-    if (Debug):
-        print (colored("**DEBUG: options.threads " +  str(options.threads) + " **", 'yellow'))
-        print (colored("**DEBUG: max_workers " +  str(max_workers_int) + " **", 'yellow'))
-        print (colored("**DEBUG: cpu_here " +  str(threads_job) + " **", 'yellow'))
+    (max_workers_int, threads_job) = scheduler.optimize_resources(options.software, options, len(name_list), Debug)
     ##########################
 
     
@@ -231,7 +164,7 @@ def run_trim(options):
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers_int) as executor:
             commandsSent = { executor.submit(trimmo_module, sorted(cluster["sample"].tolist()), 
                                              outdir_dict[name], name, threads_job, Debug, 
-                                             trim_params, options.adapters): name for name, cluster in sample_frame }
+                                             trim_params, options.adapters, options.compress_intermediates): name for name, cluster in scheduler.sort_by_size(sample_frame) }
     
             for cmd2 in concurrent.futures.as_completed(commandsSent):
                 details = commandsSent[cmd2]
@@ -245,9 +178,27 @@ def run_trim(options):
     ###############################
     elif options.software == "cutadapt":
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers_int) as executor:
-            commandsSent = { executor.submit(cutadapt_module. sorted(cluster["sample"].tolist()), 
+            commandsSent = { executor.submit(cutadapt_module, sorted(cluster["sample"].tolist()), 
                                              outdir_dict[name], name, threads_job, 
-                                             options.min_read_len, Debug, adapters_dict, options.extra): name for name, cluster in sample_frame }
+                                             options.min_read_len, Debug, adapters_dict, options.extra, 
+                                             options.compress_intermediates): name for name, cluster in scheduler.sort_by_size(sample_frame) }
+    
+            for cmd2 in concurrent.futures.as_completed(commandsSent):
+                details = commandsSent[cmd2]
+                try:
+                    data = cmd2.result()
+                except Exception as exc:
+                    print ('***ERROR:')
+                    print (cmd2)
+                    print('%r generated an exception: %s' % (details, exc))
+
+    ###############################
+    elif options.software == "native":
+        ## each sample uses a pool of processes
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers_int) as executor:
+            commandsSent = { executor.submit(native_module, sorted(cluster["sample"].tolist()), 
+                                             outdir_dict[name], name, threads_job, Debug, 
+                                             trim_params, options.compress_intermediates): name for name, cluster in scheduler.sort_by_size(sample_frame) }
     
             for cmd2 in concurrent.futures.as_completed(commandsSent):
                 details = commandsSent[cmd2]
@@ -265,6 +216,14 @@ def run_trim(options):
     ## functions.time_functions.timestamp
     start_time_partial = HCGB_time.timestamp(start_time_total)
 
+    ## disk and time for compressed reads
+    if (options.compress_intermediates):
+        compression.benchmark_report(outdir_dict.values(), 
+                                     os.path.join(HCGB_files.create_subfolder("info", outdir), "trim_compression_benchmark.tsv"))
+
+    ## trimming statistics stored for the project
+    run_stats.update_report(outdir, [ (name, "trim", folder) for name, folder in outdir_dict.items() ], Debug)
+
     ## get files generated and generate symbolic link
     if not options.project:
         dir_symlinks = HCGB_files.create_subfolder('link_files', outdir)
@@ -291,8 +250,11 @@ def run_trim(options):
     ###############################
     ## Report & Summary
     ###############################
-    if (options.skip_report):
-        print ("+ No report generation...")
+    if not (options.skip_report):
+        dashboard.build_dashboard(outdir, Debug)
+
+    if (options.skip_report or not options.multiqc):
+        print ("+ No MultiQC report generation...")
     else:
         print ("\n+ Generating a report using MultiQC module.")
         outdir_report = HCGB_files.create_subfolder("report", outdir)
@@ -352,7 +314,115 @@ def run_trim(options):
     exit()
 
 #############################################
-def cutadapt_module(list_reads, sample_folder, name, threads, min_read_len, Debug, adapters, extra):
+def get_trim_params(options):
+    """Sets the trimming parameters for the software selected (options.software).
+
+    For Trimmomatic and native trimming, the default adapters file is used unless --adapters provided.
+    For Cutadapt, at least one adapter option must be provided.
+
+    :param options: input parameters introduced by the user. See RSP trim -h.
+
+    :returns: (trim_params, adapters_dict)
+    """
+    ## set default
+    trim_params = {}
+    adapters_dict = {}
+    
+    if options.software in ("trimmomatic", "native"):
+        
+        #-----------------------------
+        ## Trimmomatic parameters (also used by native trimming):
+        #-----------------------------
+        
+        # Trimming adapters
+        if (options.adapters):
+            # Adapter file provided
+            options.adapters = os.path.abspath(options.adapters)
+            print("\t- Adapters file provided...")
+        else:
+            # Get default adpaters file
+            print("\t- Default Trimmomatic adapters (v0.39) will be used...")
+            options.adapters = data_files.data_list("available_Trimmomatic_adapters")
+    
+        # use default if not provided
+        trim_params = {
+            "ILLUMINACLIP": options.ILLUMINACLIP,
+            "LEADING": str(options.LEADING),
+            "TRAILING": str(options.TRAILING),
+            "SLIDINGWINDOW": options.SLIDINGWINDOW,
+            "MINLEN": str(options.MINLEN),
+            "adapters": options.adapters
+        }
+        adapters_dict = {
+            "adapters": options.adapters
+        }
+
+        ## lean mode: no trimlog; orphan reads discarded or compressed
+        if options.lean_trim:
+            if options.software == "trimmomatic":
+                trim_params["lean"] = options.lean_trim
+            else:
+                print (colored("** Option --lean_trim only applies to trimmomatic: native trimming does not write a trimlog", 'yellow'))
+        
+    ##########################
+    elif options.software == "cutadapt":
+        
+        # Trimming adapters
+    
+        ## check adapters provided
+            ## options.adapters_a
+            ## options.adapters_A
+            ## options.extra
+            
+        ## no adapters provided
+        if (not options.adapters_a and not options.adapters_A and not options.extra):
+            print (colored("** ERROR: No adapter trimming options provided...", 'red'))
+            print ("Please provide any option")
+            exit()
+        
+        ## create dictionary with 
+        adapters_dict = {}
+        if (options.adapters_a):
+            adapters_dict['adapter_a'] = options.adapters_a
+        
+        if (options.adapters_A):
+            adapters_dict['adapter_A'] = options.adapters_A
+        else:
+            options.adapters_A = ""
+        
+        ## set default
+        if not options.min_read_len:
+            options.min_read_len=15
+    
+    
+        # use default if not provided
+        trim_params = {
+            "adapters_a": options.adapters_a,
+            "adapters_A": options.adapters_A,
+            "min_len_read": options.min_read_len
+        }
+    ##########################
+
+    return (trim_params, adapters_dict)
+
+#############################################
+def trimmed_files(folder, name, pair, compressed=False):
+    """Files generated by the trimming software (trimmomatic, cutadapt or native) for a sample
+
+    :param folder: Sample folder containing trimmed reads
+    :param name: Sample name
+    :param pair: True/False for paired-end reads
+    :param compressed: True/False for gzip compressed reads
+
+    :returns: List of files
+    """
+    suffix = '.fastq.gz' if compressed else '.fastq'
+    if (pair):
+        return ([ os.path.join(folder, name + '_trim_R1' + suffix), os.path.join(folder, name + '_trim_R2' + suffix) ])
+    return ([ os.path.join(folder, name + '_trim' + suffix) ])
+
+#############################################
+def cutadapt_module(list_reads, sample_folder, name, threads, min_read_len, Debug, adapters, extra, compress=False):
     """ Checks if the trimming process have been done previously. If not, it executes it
     calling cutadapt()    
     
@@ -363,6 +433,7 @@ def cutadapt_module(list_reads, sample_folder, name, threads, min_read_len, Debu
     :param Debug: show additional message for debugging purposes.
     :param adapters: dictionary with the introduced adapters
     :param extra: provided extra options for cutadapt trimming process
+    :param compress: trimmed reads compressed while written
 
     :type list_reads: string
     :type sample_folder: string
@@ -371,28 +442,27 @@ def cutadapt_module(list_reads, sample_folder, name, threads, min_read_len, Debu
     :type Debug: boolean
     :type adapters: dictionary
     :type extra: string
-    
+    :type compress: boolean
 
     :returns: None
     """
     
-    ## check if previously trimmed and succeeded
-    filename_stamp = sample_folder + '/.success_cut'
-    if os.path.isfile(filename_stamp):
-        stamp = HCGB_time.read_time_stamp(filename_stamp)
-        print (colored("\tA previous command generated results on: %s [%s -- %s]" %(stamp, name, 'cutadapt'), 'yellow'))
-    else:
+    ## check if previously trimmed with same reads, adapters and parameters
+    outputs = trimmed_files(sample_folder, name, len(list_reads) == 2, compress)
+    record = result_cache.get_record(sample_folder, 'cutadapt', list_reads, 
+                                     {'adapters': adapters, 'min_read_len': min_read_len, 'extra': extra, 'compress': compress}, 'cutadapt')
+    if not result_cache.is_cached(record, outputs, name):
         # Call cutadapt
         cutadapt_exe = set_config.get_exe('cutadapt')
-        code_returned = cutadapt_caller.cutadapt(cutadapt_exe, list_reads, sample_folder, name, threads, min_read_len, Debug, adapters, extra)
-        if code_returned:
-            HCGB_time.print_time_stamp(filename_stamp)
+        code_returned = cutadapt_caller.cutadapt(cutadapt_exe, list_reads, sample_folder, name, threads, min_read_len, Debug, adapters, extra, compress)
+        if (code_returned == 'OK'):
+            result_cache.save_record(record, outputs)
         else:
             print ('** Sample %s failed...' %name)
 
     
 #############################################
-def trimmo_module(list_reads, sample_folder, name, threads, Debug, trimmomatic_params, adapters):
+def trimmo_module(list_reads, sample_folder, name, threads, Debug, trimmomatic_params, adapters, compress=False):
     
     """ This functions generates a trimmomatic call using java and trimmomatic 
     It checks if the trimming process have been done previously. If not, it executes it
@@ -407,6 +477,7 @@ def trimmo_module(list_reads, sample_folder, name, threads, Debug, trimmomatic_p
     :param threads: number of CPUs to use.
     :param Debug: show additional message for debugging purposes.
     :param trimmomatic_params: dictionary with the Trimmomatic parameters
+    :param compress: trimmed and orphan reads compressed while written
     
     :type list_reads: string
     :type sample_folder: string
@@ -414,6 +485,7 @@ def trimmo_module(list_reads, sample_folder, name, threads, Debug, trimmomatic_p
     :type threads: string
     :type Debug: boolean
     :type trimmomatic_params: dictionary
+    :type compress: boolean
     
     :returns: None
     """
@@ -428,13 +500,11 @@ def trimmo_module(list_reads, sample_folder, name, threads, Debug, trimmomatic_p
         print (colored("***ERROR: Trimmomatic adapters file does not exist: " + trimmomatic_params['adapters'],'red'))
         exit()
     
-    ## check if previously trimmed and succeeded
-    filename_stamp = sample_folder + '/.success_trimmo'
-    if os.path.isfile(filename_stamp):
-        stamp = HCGB_time.read_time_stamp(filename_stamp)
-        print (colored("\tA previous command generated results on: %s [%s]" %(stamp, name), 'yellow'))
-    
-    else:
+    ## check if previously trimmed with same reads, adapters and parameters
+    outputs = trimmed_files(sample_folder, name, len(list_reads) == 2, compress)
+    record = result_cache.get_record(sample_folder, 'trimmomatic', list_reads + [trimmomatic_params['adapters']], 
+                                     trimmomatic_params, 'trimmomatic')
+    if not result_cache.is_cached(record, outputs, name):
 
         ## get exe
         trimmomatic_jar = set_config.get_exe('trimmomatic')
@@ -446,8 +516,47 @@ def trimmo_module(list_reads, sample_folder, name, threads, Debug, trimmomatic_p
     
         ## call: prints success if it works
         code_trim = trimmomatic_call.trimmo_call(java_path, sample_folder, name, list_reads, 
-                           trimmomatic_jar, threads, trimmomatic_params, Debug)
-        if code_trim:
-            HCGB_time.print_time_stamp(filename_stamp)
+                           trimmomatic_jar, threads, trimmomatic_params, Debug, compress)
+        if (code_trim == 'OK'):
+            result_cache.save_record(record, outputs)
+        else:
+            print ('** Sample %s failed...' %name)
+
+#############################################
+def native_module(list_reads, sample_folder, name, threads, Debug, trim_params, compress=False):
+    """ Checks if the trimming process have been done previously. If not, it executes it
+    calling native_trim.native_trim using Trimmomatic parameters.
+    
+    :param list_reads: name of the fastqc files of the sample to be trimmed
+    :param sample_folder: path to the sample folder to store the results
+    :param name: Name of the sample to be analyzed
+    :param threads: number of CPUs to use.
+    :param Debug: show additional message for debugging purposes.
+    :param trim_params: dictionary with the Trimmomatic parameters
+    :param compress: trimmed and orphan reads written compressed
+    
+    :type list_reads: string
+    :type sample_folder: string
+    :type name: string
+    :type threads: string
+    :type Debug: boolean
+    :type trim_params: dictionary
+    :type compress: boolean
+    
+    :returns: None
+    """
+    ## check if it exists
+    if not os.path.isfile(trim_params['adapters']):
+        print (colored("***ERROR: Adapters file does not exist: " + trim_params['adapters'],'red'))
+        exit()
+    
+    ## check if previously trimmed with same reads, adapters and parameters
+    outputs = trimmed_files(sample_folder, name, len(list_reads) == 2, compress)
+    record = result_cache.get_record(sample_folder, 'native_trim', list_reads + [trim_params['adapters']], 
+                                     trim_params, 'RSP ' + pipeline_version)
+    if not result_cache.is_cached(record, outputs, name):
+        code_trim = native_trim.native_trim(sample_folder, name, list_reads, threads, trim_params, Debug, compress)
+        if (code_trim == 'OK'):
+            result_cache.save_record(record, outputs)
         else:
             print ('** Sample %s failed...' %name)
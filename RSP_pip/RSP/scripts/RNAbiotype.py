@@ -19,18 +19,16 @@ import concurrent.futures
 
 ## import my modules
 from RSP.config import set_config
+from RSP.scripts import result_cache
+from RSP import __version__ as pipeline_version
 
 ## import HCGB
 from HCGB.functions import system_call_functions, main_functions, time_functions
 from HCGB.functions import files_functions, math_functions
 from HCGB.functions.aesthetics_functions import debug_message
 
-## plots
+## plots: matplotlib is imported when plotting (see pie_plot_results)
 import pandas as pd
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
-from pandas.plotting import table
 
 #####################
 def help_info():
@@ -41,13 +39,16 @@ def help_info():
 #######################################################################
 def pie_plot_results(RNAbiotypes_stats_file, name, folder, Debug):
 	
-	##
-	filename_stamp_plot = folder + '/.success_plot'
-	if os.path.isfile(filename_stamp_plot):
-		stamp = time_functions.read_time_stamp(filename_stamp_plot)
-		print (colored("\tA previous command generated results on: %s [%s -- %s]" %(stamp, name, 'plot results'), 'yellow'))
-	else:
+	## check if previously plotted for same biotype counts
+	name_figure = os.path.join(folder, name + '_RNAbiotypes.pdf')
+	record = result_cache.get_record(folder, 'plot', [RNAbiotypes_stats_file], {'pie_plot_results': name}, 'RSP ' + pipeline_version)
+	if not result_cache.is_cached(record, [name_figure], name):
 		
+		## plotting libraries
+		import matplotlib
+		matplotlib.use('agg')
+		import matplotlib.pyplot as plt
+
 		# PLOT and SHOW results
 		RNAbiotypes_stats = main_functions.get_data(RNAbiotypes_stats_file, '\t', 'header=None')
 	
@@ -95,18 +96,13 @@ def pie_plot_results(RNAbiotypes_stats_file, name, folder, Debug):
 		#tbl.set_fontsize(12)
 		tbl.scale(1.1,1.1)
 	
-		## set PDF name
-		name_figure = os.path.join(folder, name + '_RNAbiotypes.pdf')
-	
 		## generate image
 		plt.savefig(name_figure)		
 		plt.close(name_figure)
 		plt.close()
 		
-		## print time stamps
-		time_functions.print_time_stamp(filename_stamp_plot)
-		filename_stamp_all = folder + '/.success_all'
-		time_functions.print_time_stamp(filename_stamp_all)
+		## save record
+		result_cache.save_record(record, [name_figure])
 		
 #######################################################################
 def main():
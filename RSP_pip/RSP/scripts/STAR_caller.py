@@ -60,7 +60,7 @@ def create_genomeDir(genomeDir, STAR_exe, num_threads, fasta_file, limitGenomeGe
     print ('\t+ genomeDir generation for STAR mapping')
     create_code = system_call_functions.system_call(cmd_create)
     
-    if not create_code:
+    if (create_code != 'OK'):
         print ("** ERROR: Some error occurred during genomeDir creation... **")
         exit()
     
@@ -117,6 +117,78 @@ def remove_Genome(STAR_exe, genomeDir, folder, num_threads):
     remove_code = system_call_functions.system_call(cmd_RM, False, True)
     return (remove_code)
 
+############################################################
+def genome_size(genomeDir):
+    """Size in bytes of the genome loaded in shared memory (Genome, SA and SAindex files)
+
+    :param genomeDir: path to the genome directory
+    :type genomeDir: string
+
+    :returns: size in bytes
+    """
+    size = 0
+    for file_name in ("Genome", "SA", "SAindex"):
+        file_path = os.path.join(genomeDir, file_name)
+        if os.path.isfile(file_path):
+            size += os.path.getsize(file_path)
+    return (size)
+
+############################################################
+def plan_mapping_jobs(threads, num_samples, genomeDir, limitRAM_option, memory, min_threads_job=4,
+                      job_overhead=2000000000, min_sort_RAM=1000000000, shared_genome=True):
+    """Decides the number of STAR jobs to run concurrently against a single loaded genome.
+
+    The genome is loaded once in shared memory (LoadAndKeep) and each STAR job only
+    needs memory for its own buffers and for sorting the BAM file. Jobs are limited by the
+    number of threads available (at least min_threads_job threads per job) and by
+    the memory left once the genome has been loaded. Threads and sorting RAM are split
+    between jobs so the total remains within the memory budget. If the genome is not
+    shared (NoSharedMemory), each job needs memory for its own copy.
+
+    :param threads: total number of threads available
+    :param num_samples: number of samples to map
+    :param genomeDir: path to the genome directory
+    :param limitRAM_option: maximum --limitBAMsortRAM (bytes) for a single job
+    :param memory: memory budget (bytes). Not limited if 0.
+    :param min_threads_job: minimum number of threads for each job
+    :param job_overhead: memory (bytes) used by each STAR job besides sorting
+    :param min_sort_RAM: minimum --limitBAMsortRAM (bytes) for a job
+    :param shared_genome: genome loaded once in shared memory or by each job
+
+    :type threads: int
+    :type num_samples: int
+    :type genomeDir: string
+    :type limitRAM_option: int
+    :type memory: int
+    :type min_threads_job: int
+    :type job_overhead: int
+    :type min_sort_RAM: int
+    :type shared_genome: boolean
+
+    :returns: (number of concurrent jobs, threads per job, --limitBAMsortRAM per job)
+    """
+    threads = max(1, int(threads))
+
+    ## jobs by CPU and by memory left after loading genome (once or by each job)
+    jobs_cpu = max(1, threads // min_threads_job)
+    if shared_genome:
+        memory_left = memory - genome_size(genomeDir)
+    else:
+        memory_left = memory
+        job_overhead = job_overhead + genome_size(genomeDir)
+    jobs_mem = max(1, memory_left // (job_overhead + min_sort_RAM)) if memory else jobs_cpu
+    jobs = int(max(1, min(jobs_cpu, jobs_mem, num_samples)))
+
+    ## split resources
+    threads_job = max(1, threads // jobs)
+    if memory:
+        sort_RAM = max(min_sort_RAM, memory_left // jobs - job_overhead)
+        sort_RAM = int(min(int(limitRAM_option), sort_RAM))
+    else:
+        sort_RAM = int(limitRAM_option)
+
+    return (jobs, threads_job, sort_RAM)
+
 ############################################################
 def mapReads(option, reads, folder, name, STAR_exe, genomeDir, limitRAM_option, num_threads, Debug, multimapping):
     """
@@ -180,6 +252,8 @@ def mapReads(option, reads, folder, name, STAR_exe, genomeDir, limitRAM_option,
     
     ## ReadFiles
     cmd = cmd + " --readFilesIn %s " %jread
+    if all(read.endswith('.gz') for read in reads):
+        cmd = cmd + "--readFilesCommand zcat "
 
     ## logfile & errfile
     logfile = os.path.join(folder, 'STAR.log')
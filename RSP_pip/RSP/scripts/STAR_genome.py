@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Keeps STAR reference genomes loaded in shared memory across RSP calls.
+
+STAR shared memory is available for the host where it was loaded. For each
+genomeDir and host, a state file records whether the genome is loaded, whether
+it has been pinned (``RSP genome load``) and the processes using it. Every change
+of state is done while holding a lockfile so concurrent calls do not reload
+or remove the genome while other processes are mapping.
+"""
+## useful imports
+import os
+import sys
+import json
+import time
+import fcntl
+import socket
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from termcolor import colored
+
+## import my modules
+from HCGB.functions import files_functions
+from RSP.scripts import STAR_caller
+
+############################################################
+def residency_folder(genomeDir):
+    """Returns folder storing the shared memory state for the given genomeDir and host
+
+    :param genomeDir: path to the genome directory
+    :type genomeDir: string
+
+    :returns: Absolute path to the folder
+    """
+    genomeDir = os.path.abspath(genomeDir)
+    key = hashlib.md5(genomeDir.encode()).hexdigest()[:16]
+    folder = os.path.join(tempfile.gettempdir(), 'RSP_STAR_genomes', socket.gethostname() + '_' + key)
+    os.makedirs(folder, exist_ok=True)
+    return (folder)
+
+############################################################
+@contextmanager
+def genome_lock(genomeDir):
+    """Exclusive lock for the shared memory state of a given genomeDir"""
+    lock_file = os.path.join(residency_folder(genomeDir), 'genome.lock')
+    with open(lock_file, 'w') as lock_hd:
+        fcntl.flock(lock_hd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_hd, fcntl.LOCK_UN)
+
+############################################################
+def pid_alive(pid):
+    """Checks whether a given process is still running"""
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return (False)
+    except PermissionError:
+        return (True)
+    return (True)
+
+############################################################
+def read_state(genomeDir):
+    """Reads the shared memory state for the genomeDir. Dead processes are discarded.
+
+    :param genomeDir: path to the genome directory
+    :type genomeDir: string
+
+    :returns: Dictionary containing genomeDir, loaded, pinned and users (pid: start time)
+    """
+    state_file = os.path.join(residency_folder(genomeDir), 'state.json')
+    state = {'genomeDir': os.path.abspath(genomeDir), 'loaded': False, 'pinned': False, 'users': {}}
+    if files_functions.is_non_zero_file(state_file):
+        with open(state_file) as state_hd:
+            state.update(json.load(state_hd))
+
+    state['users'] = { pid: info for pid, info in state['users'].items() if pid_alive(pid) }
+    return (state)
+
+############################################################
+def write_state(genomeDir, state):
+    """Writes the shared memory state for the genomeDir"""
+    state_file = os.path.join(residency_folder(genomeDir), 'state.json')
+    tmp_file = state_file + '.tmp'
+    with open(tmp_file, 'w') as state_hd:
+        json.dump(state, state_hd, indent=4)
+    os.replace(tmp_file, state_file)
+
+############################################################
+def ensure_loaded(state, STAR_exe, genomeDir, folder, num_threads):
+    """Loads the genome in shared memory if not loaded yet. Lock must be held."""
+    if state['loaded']:
+        print ("+ Genome already loaded in shared memory: " + genomeDir)
+        return (True)
+
+    ## remove any previous copy from other calls not managed (if any)
+    STAR_caller.remove_Genome(STAR_exe, genomeDir, folder, num_threads)
+    load_code = STAR_caller.load_Genome(folder, STAR_exe, genomeDir, num_threads)
+    state['loaded'] = (load_code == 'OK')
+    if not state['loaded']:
+        print (colored("** ERROR: STAR genome could not be loaded in shared memory: " + genomeDir, 'red'))
+    return (state['loaded'])
+
+############################################################
+def release_if_unused(state, STAR_exe, genomeDir, folder, num_threads):
+    """Removes the genome from shared memory if not pinned and not in use. Lock must be held."""
+    if state['loaded'] and not state['pinned'] and not state['users']:
+        STAR_caller.remove_Genome(STAR_exe, genomeDir, folder, num_threads)
+        state['loaded'] = False
+    elif state['loaded']:
+        print ("+ Genome kept in shared memory [pinned: %s, processes using it: %s]" %(state['pinned'], len(state['users'])))
+
+############################################################
+def attach_genome(STAR_exe, genomeDir, folder, num_threads, Debug=False):
+    """Attaches this process to the genome in shared memory, loading it if necessary.
+
+    :param STAR_exe: Executable path for STAR binary
+    :param genomeDir: path to the genome directory
+    :param folder: folder to store STAR load/remove logs
+    :param num_threads: number of threads to do the computation
+    :param Debug: show extra information of the process
+
+    :returns: True/False if genome is available in shared memory
+    """
+    with genome_lock(genomeDir):
+        state = read_state(genomeDir)
+        if Debug:
+            print (colored("**DEBUG: STAR genome state **", 'yellow'))
+            print (state)
+
+        if not ensure_loaded(state, STAR_exe, genomeDir, folder, num_threads):
+            write_state(genomeDir, state)
+            return (False)
+
+        state['users'][str(os.getpid())] = time.time()
+        write_state(genomeDir, state)
+    return (True)
+
+############################################################
+def detach_genome(STAR_exe, genomeDir, folder, num_threads, Debug=False):
+    """Detaches this process from the genome. Removed from memory if last user and not pinned."""
+    with genome_lock(genomeDir):
+        state = read_state(genomeDir)
+        state['users'].pop(str(os.getpid()), None)
+        if Debug:
+            print (colored("**DEBUG: STAR genome state **", 'yellow'))
+            print (state)
+
+        release_if_unused(state, STAR_exe, genomeDir, folder, num_threads)
+        write_state(genomeDir, state)
+
+############################################################
+def pin_genome(STAR_exe, genomeDir, folder, num_threads):
+    """Loads the genome and keeps it in shared memory until unpinned (RSP genome load)"""
+    with genome_lock(genomeDir):
+        state = read_state(genomeDir)
+        if ensure_loaded(state, STAR_exe, genomeDir, folder, num_threads):
+            state['pinned'] = True
+        write_state(genomeDir, state)
+    return (state['pinned'])
+
+############################################################
+def unpin_genome(STAR_exe, genomeDir, folder, num_threads):
+    """Unpins the genome (RSP genome unload). It is removed once no process is using it."""
+    with genome_lock(genomeDir):
+        state = read_state(genomeDir)
+        state['pinned'] = False
+        release_if_unused(state, STAR_exe, genomeDir, folder, num_threads)
+        write_state(genomeDir, state)
+    return (state)
+
+############################################################
+def print_status(genomeDir):
+    """Prints shared memory state for the given genomeDir"""
+    with genome_lock(genomeDir):
+        state = read_state(genomeDir)
+
+    print ("+ Host: " + socket.gethostname())
+    print ("+ genomeDir: " + state['genomeDir'])
+    print ("+ Loaded in shared memory: " + str(state['loaded']))
+    print ("+ Pinned: " + str(state['pinned']))
+    print ("+ Processes using it: " + str(len(state['users'])))
+    for pid, start in state['users'].items():
+        print ("\t- PID %s since %s" %(pid, time.ctime(start)))
+    return (state)
@@ -1,13 +1,18 @@
 
 __all__ = [
 	'fastqc_caller',
+	'fastq_stats',
 	
 	'multiQC_report',
+	'run_stats',
+	'dashboard',
 	
 	'trimmomatic_call',
 	'cutadapt_caller',
+	'native_trim',
 	
 	'STAR_caller',
+	'STAR_genome',
 	'salmon',
 	'hisat2',
 	'kallisto',
@@ -15,8 +20,20 @@ __all__ = [
 	'RNAbiotype',
 	'samtools',
 	'featurecounts',
+	'gtf_index',
+	'native_counts',
 	
-	'generate_matrix'
+	'generate_matrix',
+	'quant_matrix',
+	'file_transfer',
+	'compression',
+	'result_cache',
+	'index_registry'
 ]
 
-from RSP.scripts import *
+## modules are imported when first used (e.g. from RSP.scripts import x)
+from importlib import import_module
+def __getattr__(name):
+	if name in __all__:
+		return (import_module('RSP.scripts.' + name))
+	raise AttributeError("module 'RSP.scripts' has no attribute '%s'" %name)
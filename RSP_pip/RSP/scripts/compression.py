@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Compression of intermediate files (option ``--compress_intermediates``).
+
+Files are compressed by ``bgzip`` using blocks (BGZF) and several threads if
+available, otherwise by ``pigz`` (several threads, not BGZF) or python (gzip).
+All of them generate gzip files, so readers (FASTQC, mapping software,
+sampleParser) accept them.
+
+Trimmed reads are compressed while written: RSP native trimming writes into the
+compressor (``open_output``) and trimming software (Trimmomatic, cutadapt)
+writes plain reads into a named pipe read by the compressor (``start_fifo``), so
+uncompressed reads are not written to disk. featureCounts output is compressed
+once finished (``compress_file``), as featureCounts does not write compressed
+files.
+
+For each file compressed, uncompressed and compressed sizes and time are
+recorded in ``compression_benchmark.tsv`` within the same folder, and
+summarized for a project using ``benchmark_report``. For files compressed while
+written, time is the wall time of the step generating them (split between its
+files according to their size), so it includes trimming.
+"""
+## useful imports
+import os
+import gzip
+import glob
+import time
+import shutil
+import threading
+import subprocess
+from termcolor import colored
+
+## benchmark file in each folder
+benchmark_name = 'compression_benchmark.tsv'
+benchmark_header = ['file', 'raw_bytes', 'compressed_bytes', 'ratio', 'seconds', 'MB/s', 'compressor']
+
+############################################################
+def compressor(threads):
+    """Command to compress stdin to stdout using threads given: bgzip (BGZF), pigz or None (python)
+
+    :returns: (name, list of arguments)
+    """
+    threads = max(int(threads), 1)
+    bgzip = shutil.which('bgzip')
+    if bgzip:
+        return ('bgzip', [bgzip, '-@', str(threads), '-c'])
+    pigz = shutil.which('pigz')
+    if pigz:
+        return ('pigz', [pigz, '-p', str(threads), '-c'])
+    return ('python', None)
+
+############################################################
+def open_file(file_name, mode='rt'):
+    """Opens plain or gzip (.gz) files"""
+    if file_name.endswith('.gz'):
+        return (gzip.open(file_name, mode))
+    return (open(file_name, mode))
+
+############################################################
+def open_output(file_name, threads=2):
+    """Opens a file to write bytes: compressed while written if gzip (.gz), using the compressor available.
+
+    :returns: (file handle, compressor process or None). Close using close_output.
+    """
+    if not file_name.endswith('.gz'):
+        return (open(file_name, 'wb'), None)
+
+    (name, command) = compressor(threads)
+    if not command:
+        return (gzip.open(file_name, 'wb', compresslevel=6), None)
+
+    with open(file_name, 'wb') as out_hd:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=out_hd)
+    return (process.stdin, process)
+
+############################################################
+def close_output(handle, process):
+    """Closes a file opened using open_output. Returns True/False if the compressor succeeded."""
+    if not handle.closed:
+        handle.close()
+    if process:
+        return (process.wait() == 0)
+    return (True)
+
+############################################################
+def start_fifo(out_file, threads=2):
+    """Named pipe for software writing plain files: data written into the pipe is compressed into out_file (.gz)
+    by a thread while written (see open_output). Finish using finish_fifo once the software finished.
+
+    :returns: Dictionary containing the pipe to provide to the software (fifo) and details of the thread
+    """
+    ## name ends with the plain extension (e.g. .fastq): software detects the format from it
+    plain_file = out_file[:-3] if out_file.endswith('.gz') else out_file
+    fifo = os.path.join(os.path.dirname(plain_file), '.fifo_' + os.path.basename(plain_file))
+    if os.path.exists(fifo):
+        os.remove(fifo)
+    os.mkfifo(fifo)
+
+    job = {'fifo': fifo, 'out_file': out_file, 'part_file': plain_file + '.part.gz',
+           'compressor': compressor(threads)[0], 'raw_size': 0, 'opened': False, 'ok': False}
+
+    def relay():
+        (out_hd, process) = open_output(job['part_file'], threads)
+        try:
+            with open(fifo, 'rb') as fifo_hd:
+                job['opened'] = True
+                for data in iter(lambda: fifo_hd.read(4*1024*1024), b''):
+                    out_hd.write(data)
+                    job['raw_size'] += len(data)
+        except OSError as exc:
+            print (colored("** ERROR: Compression failed for file %s: %s" %(out_file, exc), 'red'))
+            close_output(out_hd, process)
+            return
+        job['ok'] = close_output(out_hd, process)
+
+    job['thread'] = threading.Thread(target=relay, daemon=True)
+    job['thread'].start()
+    return (job)
+
+############################################################
+def finish_fifo(job):
+    """Waits until data written into the pipe (see start_fifo) is compressed, and removes the pipe.
+
+    :returns: Size of data written (uncompressed) or None if failed
+    """
+    not_opened = not job['opened']
+    if not_opened:
+        ## software failed before opening the pipe: end of file for the thread waiting
+        try:
+            os.close(os.open(job['fifo'], os.O_WRONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+    job['thread'].join()
+    os.remove(job['fifo'])
+
+    if not job['ok'] or (not_opened and not job['raw_size']):
+        if os.path.isfile(job['part_file']):
+            os.remove(job['part_file'])
+        return (None)
+    os.rename(job['part_file'], job['out_file'])
+    return (job['raw_size'])
+
+############################################################
+def record_streamed(files, raw_sizes, seconds, compressor_name):
+    """Records benchmark for files compressed while written by a step: time of the step split according to size"""
+    total_size = sum(raw_sizes)
+    for file_name, raw_size in zip(files, raw_sizes):
+        record_benchmark(file_name, raw_size, os.path.getsize(file_name),
+                         seconds * raw_size / total_size if total_size else seconds / len(files), compressor_name)
+
+############################################################
+def record_benchmark(file_name, raw_size, compressed_size, seconds, compressor_name):
+    """Adds sizes and time for a compressed file to the benchmark of its folder. Unknown values as None."""
+    benchmark_file = os.path.join(os.path.dirname(os.path.abspath(file_name)), benchmark_name)
+    values = [os.path.basename(file_name), raw_size, compressed_size,
+              round(compressed_size / raw_size, 3) if raw_size else None,
+              round(seconds, 2) if seconds is not None else None,
+              round(raw_size / 1024**2 / seconds, 1) if raw_size and seconds else None,
+              compressor_name]
+
+    new_file = not os.path.isfile(benchmark_file)
+    with open(benchmark_file, 'a') as benchmark_hd:
+        if new_file:
+            benchmark_hd.write("\t".join(benchmark_header) + "\n")
+        benchmark_hd.write("\t".join('NA' if v is None else str(v) for v in values) + "\n")
+
+############################################################
+def compress_file(file_name, threads=2):
+    """Compresses a file into <file>.gz and removes the original file.
+
+    :param file_name: File to compress
+    :param threads: Threads for the compressor
+
+    :returns: Compressed file or None if failed
+    """
+    out_file = file_name + '.gz'
+    part_file = out_file + '.part'
+    start_time = time.time()
+    (name, command) = compressor(threads)
+    try:
+        if command:
+            with open(file_name, 'rb') as in_hd, open(part_file, 'wb') as out_hd:
+                code = subprocess.call(command, stdin=in_hd, stdout=out_hd)
+            if code:
+                raise OSError("%s exited with code %s" %(name, code))
+        else:
+            with open(file_name, 'rb') as in_hd, gzip.open(part_file, 'wb', compresslevel=6) as out_hd:
+                shutil.copyfileobj(in_hd, out_hd, 16*1024*1024)
+    except OSError as exc:
+        print (colored("** ERROR: Compression failed for file %s: %s" %(file_name, exc), 'red'))
+        if os.path.isfile(part_file):
+            os.remove(part_file)
+        return (None)
+
+    os.rename(part_file, out_file)
+    raw_size = os.path.getsize(file_name)
+    os.remove(file_name)
+    record_benchmark(out_file, raw_size, os.path.getsize(out_file), time.time() - start_time, name)
+    return (out_file)
+
+############################################################
+def benchmark_report(folders, report_file):
+    """Summarizes compression benchmarks available in the folders given (and subfolders).
+
+    :param folders: Folders containing compression_benchmark.tsv files
+    :param report_file: File to write the summary
+
+    :returns: Dictionary with files, raw and compressed bytes and seconds
+    """
+    rows = []
+    for folder in sorted(set(folders)):
+        for benchmark_file in glob.glob(os.path.join(folder, benchmark_name)) + glob.glob(os.path.join(folder, '*', benchmark_name)):
+            with open(benchmark_file) as benchmark_hd:
+                next(benchmark_hd, None)
+                for line in benchmark_hd:
+                    fields = line.rstrip('\n').split('\t')
+                    rows.append([os.path.join(os.path.dirname(benchmark_file), fields[0])] + fields[1:])
+
+    if not rows:
+        return ({})
+
+    ## totals for files with known sizes and time
+    known = [ r for r in rows if r[1] != 'NA' ]
+    summary = {
+        'files': len(rows),
+        'raw_bytes': sum(int(r[1]) for r in known),
+        'compressed_bytes': sum(int(r[2]) for r in rows),
+        'compressed_bytes_known': sum(int(r[2]) for r in known),
+        'seconds': round(sum(float(r[4]) for r in rows if r[4] != 'NA'), 2),
+    }
+    saved = summary['raw_bytes'] - summary['compressed_bytes_known']
+
+    with open(report_file, 'w') as report_hd:
+        report_hd.write("\t".join(benchmark_header) + "\n")
+        for row in rows:
+            report_hd.write("\t".join(row) + "\n")
+        report_hd.write("## files: %s; raw: %.2f GB; compressed: %.2f GB (saved %.2f GB); compression time: %.1f seconds\n" %(
+            summary['files'], summary['raw_bytes'] / 1024**3, summary['compressed_bytes'] / 1024**3,
+            saved / 1024**3, summary['seconds']))
+
+    print ("+ Compression of intermediate files: %.2f GB saved in %.1f seconds (%s files). See %s" %(
+        saved / 1024**3, summary['seconds'], summary['files'], report_file))
+    return (summary)
@@ -21,12 +21,17 @@ from termcolor import colored
 ## import my modules
 from HCGB import functions
 from RSP.config import set_config
+from RSP.scripts import compression
 
 #############################################
-def cutadapt(cutadapt_exe, reads, path, sample_name, num_threads, min_len_given, Debug, adapters, extra):
+def cutadapt(cutadapt_exe, reads, path, sample_name, num_threads, min_len_given, Debug, adapters, extra, compress=False):
     """
     Executes cutadapt sofware for each sample cutting the adapters of each read
     
+    Extra options are included in the same cutadapt call, so reads are only read
+    and written once. Adapters are removed up to twice from each read (-n 2), as
+    the previous two cutadapt calls did, unless -n (--times) is set in extra options.
+    
     :param cutadapt_exe: to call cutadapt software
     :param reads: name of the fastqc files of the sample to be trimmed
     :param path: path to the sample folder to store the results
@@ -35,6 +40,7 @@ def cutadapt(cutadapt_exe, reads, path, sample_name, num_threads, min_len_given,
     :param Debug: show additional message for debugging purposes.
     :param adapters: dictionary with the introduced adapters
     :param extra: provided extra options for cutadapt trimming process
+    :param compress: write trimmed reads compressed while written (see compression.start_fifo)
     
     :type cutadapt_exe: string
     :type reads: string
@@ -44,86 +50,68 @@ def cutadapt(cutadapt_exe, reads, path, sample_name, num_threads, min_len_given,
     :type Debug: boolean
     :type adapters: dictionary
     :type extra: string
+    :type compress: boolean
     
     :returns: the trimmed files
     """
     logfile = os.path.join(path, sample_name + '.cutadapt.log')
     
+    suffix = '.fastq.gz' if compress else '.fastq'
+
+    ## compress: plain reads written into named pipes read by the compressor (bgzip/pigz)
+    start_time = time.time()
+    jobs = {}
+    def output(out_file):
+        if compress:
+            jobs[out_file] = compression.start_fifo(out_file, max(1, int(num_threads) // len(reads)))
+            return (jobs[out_file]['fifo'])
+        return (out_file)
+    
+    ## additional options within the same call; adapters removed twice unless set
+    extra_param = extra + ' ' if extra else ''
+    if not re.search(r'(^|\s)(-n|--times)(\s|=|\d|$)', extra_param):
+        extra_param = extra_param + '-n 2 '
+    
     if (len(reads) == 2):
-        if not adapters['adapter_a'] or not adapters['adapter_A']:
+        if not adapters.get('adapter_a') or not adapters.get('adapter_A'):
              print ("** ERROR: Missing adapter information")
              exit()
         
-        if extra:
-            o_param = os.path.join(path, sample_name + '_temp1_trim_R1.fastq')
-            p_param = os.path.join(path, sample_name + '_temp1_trim_R2.fastq')
-        else:
-            p_param = os.path.join(path, sample_name + '_trim_R2.fastq')
-            o_param = os.path.join(path, sample_name + '_trim_R1.fastq')
+        o_param = os.path.join(path, sample_name + '_trim_R1' + suffix)
+        p_param = os.path.join(path, sample_name + '_trim_R2' + suffix)
         
         ## paired-end mode, 15 bps as the min length cutoff
-        cmd = '%s -j %s -m %s -a %s -A %s -o %s -p %s %s %s > %s' %(cutadapt_exe,  
+        cmd = '%s %s-j %s -m %s -a %s -A %s -o %s -p %s %s %s > %s' %(cutadapt_exe, extra_param, 
                                                                        num_threads, min_len_given, 
                                                                        adapters['adapter_a'], 
-                                                                       adapters['adapter_A'], o_param, 
-                                                                       p_param, reads[0], reads[1], logfile)
+                                                                       adapters['adapter_A'], output(o_param), 
+                                                                       output(p_param), reads[0], reads[1], logfile)
     elif (len(reads) == 1):
-        if not adapters['adapter_a']:
+        if not adapters.get('adapter_a'):
              print ("** ERROR: Missing adapter information")
              exit()
 
-        if extra:
-            o_param = os.path.join(path, sample_name + '_temp1_trim.fastq')
-        else:
-            o_param = os.path.join(path, sample_name + '_trim.fastq')
+        o_param = os.path.join(path, sample_name + '_trim' + suffix)
         
         ## single-end mode:
-        cmd = '%s -j %s -m %s -a %s -o %s %s > %s' %(cutadapt_exe, num_threads, 
+        cmd = '%s %s-j %s -m %s -a %s -o %s %s > %s' %(cutadapt_exe, extra_param, num_threads, 
                                                      min_len_given,
                                                      adapters['adapter_a'], 
-                                                     o_param, reads[0], logfile)    
+                                                     output(o_param), reads[0], logfile)    
     else:
         print ('** Wrong number of files provided for sample: %s...' %sample_name)
         return(False)
 
+    ## debug message
+    if (Debug):
+        print (colored("**DEBUG: cutadapt command: " + cmd + " **", 'yellow'))
+
     ##
     code = functions.system_call_functions.system_call(cmd)
-
-    ## if additional options, run a second cutadapt command
-    ## to ensure this options take effect.
-    if (extra):
-        if (len(reads) == 2):
-            o_param2 = os.path.join(path, sample_name + '_trim_R1.fastq')
-            p_param2 = os.path.join(path, sample_name + '_trim_R2.fastq')
-        
-            ## paired-end mode
-            extra_cmd = '%s %s -j %s -m %s -a %s -A %s -o %s -p %s %s %s >> %s' %(cutadapt_exe, 
-                                                                                  extra, 
-                                                                                  num_threads, 
-                                                                                  min_len_given, 
-                                                                                  adapters['adapter_a'], 
-                                                                                  adapters['adapter_A'],
-                                                                                  o_param2, p_param2, 
-                                                                                  o_param, p_param, logfile)
-        
-        elif (len(reads) == 1):
-            o_param2 = os.path.join(path, sample_name + '_trim.fastq')
-            ## single-end mode:
-            extra_cmd = '%s %s -j %s -m %s -a %s -o %s %s >> %s' %(cutadapt_exe, 
-                                                                   extra, 
-                                                                   num_threads, 
-                                                                   min_len_given,
-                                                                   adapters['adapter_a'], 
-                                                                   o_param2, o_param, logfile)    
-        
-        code2 = functions.system_call_functions.system_call(extra_cmd)
-        
-        ## remove: o_param p_param
-        if (len(reads) == 2):        
-            os.remove(p_param)
-       
-        os.remove(o_param)
-        return (code2)
-    
-    else:
-        return (code)
+    if jobs:
+        raw_sizes = [ compression.finish_fifo(job) for job in jobs.values() ]
+        if None in raw_sizes:
+            code = 'FAIL'
+        elif (code == 'OK'):
+            compression.record_streamed(list(jobs), raw_sizes, time.time() - start_time, list(jobs.values())[0]['compressor'])
+    return (code)
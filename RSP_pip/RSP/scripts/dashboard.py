@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Cohort summary of quality, trimming, mapping and counting statistics.
+
+The summary is generated from the statistics stored for each sample (see
+:mod:`RSP.scripts.run_stats`), so no sample folder is scanned again. It is
+written as ``report/RSP_summary.html`` (a table for each step) and
+``report/RSP_summary.json`` (sample: step: tool:metric: value). MultiQC
+reports are only generated if requested (``--multiqc``).
+"""
+## useful imports
+import os
+import json
+import time
+import html
+from termcolor import colored
+
+## import my modules
+from RSP.scripts import run_stats
+from RSP import __version__ as pipeline_version
+
+## order of steps in the summary
+steps = ['QC', 'trim', 'QC_trimmed', 'map', 'count']
+
+style = """
+body { font-family: Arial, sans-serif; font-size: 13px; margin: 20px; }
+table { border-collapse: collapse; margin-bottom: 30px; }
+th, td { border: 1px solid #ccc; padding: 3px 6px; text-align: right; }
+th { background: #eee; position: sticky; top: 0; }
+td:first-child, th:first-child { text-align: left; }
+"""
+
+############################################################
+def format_value(value):
+    """Value for the HTML table: integers without decimals, floats with two"""
+    if value != value:
+        return ("")
+    if float(value).is_integer():
+        return ("{:,}".format(int(value)))
+    return ("%.2f" %value)
+
+############################################################
+def html_table(matrix):
+    """HTML table for a matrix: samples x tool:metric"""
+    rows = [ "<tr><th>Sample</th>" + "".join("<th>%s</th>" %html.escape(str(c)) for c in matrix.columns) + "</tr>" ]
+    for sample, values in matrix.iterrows():
+        rows.append("<tr><td>%s</td>" %html.escape(str(sample)) + "".join("<td>%s</td>" %format_value(v) for v in values) + "</tr>")
+    return ("<table>\n" + "\n".join(rows) + "\n</table>")
+
+############################################################
+def build_dashboard(outdir, Debug=False):
+    """Writes HTML and JSON summary for the project using statistics stored.
+
+    :param outdir: Project folder
+    :param Debug: Show debugging messages
+
+    :returns: HTML file generated or None if no statistics available
+    """
+    start_time = time.time()
+    table = run_stats.read_all(outdir)
+    if table.empty:
+        print ("+ No statistics available for the summary report...")
+        return (None)
+
+    report_dir = os.path.join(outdir, 'report')
+    os.makedirs(report_dir, exist_ok=True)
+    html_file = os.path.join(report_dir, 'RSP_summary.html')
+    json_file = os.path.join(report_dir, 'RSP_summary.json')
+
+    ## sample: step: tool:metric: value
+    summary = {}
+    for sample, step, tool, metric, value in zip(table['sample'], table['step'], table['tool'], table['metric'], table['value']):
+        summary.setdefault(sample, {}).setdefault(step, {})[tool + ':' + metric] = value
+
+    ## a table for each step
+    step_list = [ s for s in steps if s in set(table['step']) ] + sorted(set(table['step']) - set(steps))
+    sections = []
+    for step in step_list:
+        step_table = table[table['step'] == step]
+        step_table = step_table.assign(column=step_table['tool'] + ':' + step_table['metric'])
+        matrix = step_table.pivot_table(index='sample', columns='column', values='value', aggfunc='last')
+        sections.append("<h2>%s</h2>\n%s" %(html.escape(step), html_table(matrix)))
+
+    generated = time.strftime("%Y-%m-%d %H:%M:%S")
+    with open(html_file + '.tmp', 'w') as html_hd:
+        html_hd.write("<!DOCTYPE html>\n<html>\n<head>\n<meta charset='utf-8'>\n<title>RSP summary</title>\n<style>%s</style>\n</head>\n<body>\n" %style)
+        html_hd.write("<h1>RSP summary</h1>\n<p>Samples: %s. Generated: %s (RSP %s)</p>\n" %(len(summary), generated, pipeline_version))
+        html_hd.write("\n".join(sections))
+        html_hd.write("\n</body>\n</html>\n")
+    os.replace(html_file + '.tmp', html_file)
+
+    with open(json_file + '.tmp', 'w') as json_hd:
+        json.dump({ 'generated': generated, 'RSP version': pipeline_version, 'samples': summary }, json_hd)
+    os.replace(json_file + '.tmp', json_file)
+
+    if Debug:
+        print (colored("**DEBUG: summary report for %s samples generated in %.2f seconds **" %(len(summary), time.time() - start_time), 'yellow'))
+    print ("+ Summary report available in: %s" %html_file)
+    return (html_file)
@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Quality statistics for FASTQ files computed in python (QC backend: native).
+
+Reads are retrieved in chunks and statistics for each chunk are computed
+with NumPy by a pool of processes: per base quality, per sequence quality,
+per base content and N content, GC content, length distribution, duplication
+levels, overrepresented sequences and k-mers. Results are written in FASTQC
+format (``<file>_fastqc/fastqc_data.txt`` and ``summary.txt``) so MultiQC
+reports are generated as for FASTQC.
+
+With a number of reads to sample (``--qc_subsample``), reads are retrieved
+from random positions of the file (plain FASTQ or BGZF blocks) or by
+reservoir sampling (gzip), and metrics are reported with 95% confidence
+intervals in ``subsample_bounds.txt``.
+"""
+## useful imports
+import os
+import re
+import math
+import gzip
+import zlib
+import struct
+import random
+import shutil
+import subprocess
+import itertools
+import collections
+import concurrent.futures
+import numpy as np
+from termcolor import colored
+
+## import my modules
+from RSP import __version__ as pipeline_version
+
+## reads for each chunk
+chunk_reads = 100000
+
+## reads used to estimate duplication and overrepresented sequences (as FASTQC)
+dup_reads = 100000
+
+## k-mer size
+kmer_size = 7
+
+## base codes: A, C, G, T, N (any other) and 5 for positions after the end of the read
+base_lut = np.full(256, 4, dtype=np.uint8)
+for num, base in enumerate(b"ACGT"):
+    base_lut[base] = num
+    base_lut[ord(chr(base).lower())] = num
+
+############################################################
+def output_name(fastq_file):
+    """Name for results of a FASTQ file, as FASTQC: file name without extension"""
+    return (re.sub(r"\.(fastq|fq)(\.gz)?$", "", os.path.basename(fastq_file)))
+
+############################################################
+def open_fastq(fastq_file):
+    """Returns binary handle for a FASTQ file. Gzip files are decompressed by pigz if available."""
+    if fastq_file.endswith('.gz'):
+        pigz = shutil.which('pigz')
+        if pigz:
+            process = subprocess.Popen([pigz, '-dc', fastq_file], stdout=subprocess.PIPE, bufsize=4*1024*1024)
+            return (process.stdout)
+        return (gzip.open(fastq_file, 'rb'))
+    return (open(fastq_file, 'rb'))
+
+############################################################
+def read_chunks(fastq_handle, size=chunk_reads):
+    """Yields (sequences, qualities) for chunks of reads"""
+    while True:
+        lines = list(itertools.islice(fastq_handle, 4*size))
+        if not lines:
+            return
+        yield ([ line.rstrip(b"\r\n") for line in lines[1::4] ], [ line.rstrip(b"\r\n") for line in lines[3::4] ])
+
+############################################################
+def to_matrix(lines, lengths, mask):
+    """Returns matrix (reads x positions) for the list of lines provided. Positions after the end of each read are 0."""
+    matrix = np.zeros(mask.shape, dtype=np.uint8)
+    matrix[mask] = np.frombuffer(b"".join(lines), dtype=np.uint8)
+    return (matrix)
+
+############################################################
+def chunk_stats(sequences, qualities, k=kmer_size):
+    """Statistics for a chunk of reads
+
+    :param sequences: List of sequences (bytes)
+    :param qualities: List of qualities (bytes), Phred+33
+    :param k: k-mer size
+
+    :returns: Dictionary of NumPy arrays
+    """
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    max_len = int(lengths.max()) if len(lengths) else 0
+    mask = np.arange(max_len) < lengths[:, None]
+    if sum(map(len, qualities)) != int(lengths.sum()):
+        raise ValueError("Length of sequences and qualities do not match")
+
+    codes = base_lut[to_matrix(sequences, lengths, mask)]
+    codes[~mask] = 5
+    quality = to_matrix(qualities, lengths, mask).astype(np.int64) - 33
+    np.clip(quality, 0, 93, out=quality)
+    quality[~mask] = 0
+
+    positions = np.broadcast_to(np.arange(max_len), mask.shape)
+    stats = {'reads': len(sequences)}
+
+    ## per position: counts of bases and quality scores
+    stats['bases'] = np.bincount((positions * 6 + codes).ravel(), minlength=max_len*6).reshape(max_len, 6)[:, :5]
+    stats['quality'] = np.bincount((positions[mask] * 94 + quality[mask]), minlength=max_len*94).reshape(max_len, 94)
+
+    ## per read: length, mean quality and GC content
+    stats['lengths'] = np.bincount(lengths)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_quality = np.round(quality.sum(axis=1) / lengths)
+        acgt = ((codes < 4).sum(axis=1))
+        gc = np.round(100 * ((codes == 1) | (codes == 2)).sum(axis=1) / acgt)
+    stats['mean_quality'] = np.bincount(mean_quality[lengths > 0].astype(np.int64), minlength=94)
+    stats['gc'] = np.bincount(gc[acgt > 0].astype(np.int64), minlength=101)
+
+    ## k-mers: windows without N
+    kmers = np.zeros(4**k, dtype=np.int64)
+    if max_len >= k:
+        windows = max_len - k + 1
+        kcode = np.zeros((len(sequences), windows), dtype=np.int64)
+        invalid = np.zeros((len(sequences), windows), dtype=bool)
+        for i in range(k):
+            column = codes[:, i:i + windows]
+            kcode = kcode * 4 + np.minimum(column, 3)
+            invalid |= column > 3
+        kmers = np.bincount(kcode[~invalid], minlength=4**k)
+    stats['kmers'] = kmers
+    return (stats)
+
+############################################################
+def pad(array, rows):
+    """Adds rows of zeros to an array up to the number of rows given"""
+    if array.shape[0] >= rows:
+        return (array)
+    return (np.concatenate([array, np.zeros((rows - array.shape[0],) + array.shape[1:], dtype=array.dtype)]))
+
+############################################################
+def merge_stats(total, stats):
+    """Adds statistics of a chunk to the total"""
+    if not total:
+        return (stats)
+    for key, value in stats.items():
+        if key == 'reads':
+            total[key] += value
+            continue
+        rows = max(total[key].shape[0], value.shape[0])
+        total[key] = pad(total[key], rows) + pad(value, rows)
+    return (total)
+
+############################################################
+def fastq_stats(fastq_file, threads=2):
+    """Statistics for a FASTQ file. Chunks of reads are processed in parallel.
+
+    :param fastq_file: FASTQ file (plain or gzip)
+    :param threads: Number of processes
+
+    :returns: (dictionary of NumPy arrays, Counter of sequences for the first reads)
+    """
+    total = {}
+    sequences = collections.Counter()
+    handle = open_fastq(fastq_file)
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(int(threads), 1)) as executor:
+            pending = set()
+            sampled = 0
+            for (seqs, quals) in read_chunks(handle):
+                ## duplication: sequences truncated to 50 bp if longer than 75 bp (as FASTQC)
+                if sampled < dup_reads:
+                    sequences.update(s[:50] if len(s) > 75 else s for s in seqs[:dup_reads - sampled])
+                    sampled = min(dup_reads, sampled + len(seqs))
+
+                pending.add(executor.submit(chunk_stats, seqs, quals))
+                ## bounded number of chunks in memory
+                if len(pending) >= 2*max(int(threads), 1):
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for job in done:
+                        total = merge_stats(total, job.result())
+
+            for job in concurrent.futures.as_completed(pending):
+                total = merge_stats(total, job.result())
+    finally:
+        handle.close()
+
+    return (total, sequences)
+
+############################################################
+def percentile(hist, fraction):
+    """Value for the percentile given for each row of a histogram (positions x values)"""
+    cumulative = hist.cumsum(axis=1)
+    return ((cumulative >= fraction * cumulative[:, -1:]).argmax(axis=1))
+
+############################################################
+def status(value, warn, fail, reverse=False):
+    """pass, warn or fail given thresholds (fail if value above, or below if reverse)"""
+    if reverse:
+        value, warn, fail = -value, -warn, -fail
+    if value > fail:
+        return ('fail')
+    if value > warn:
+        return ('warn')
+    return ('pass')
+
+############################################################
+def fastqc_modules(fastq_file, total, sequences):
+    """Returns FASTQC modules (name, status, header, rows) for the statistics provided"""
+    reads = total.get('reads', 0)
+    modules = []
+    if not reads:
+        return ([ ("Basic Statistics", "pass", "#Measure\tValue", [("Filename", os.path.basename(fastq_file)), ("Total Sequences", 0)]) ])
+
+    lengths = np.nonzero(total['lengths'])[0]
+    bases = total['bases'].astype(float)
+    acgt = bases[:, :4].sum()
+    gc_total = 100 * bases[:, 1:3].sum() / acgt if acgt else 0
+
+    ## basic statistics
+    length_string = str(lengths.min()) if lengths.min() == lengths.max() else "%s-%s" %(lengths.min(), lengths.max())
+    modules.append(("Basic Statistics", "pass", "#Measure\tValue", [
+        ("Filename", os.path.basename(fastq_file)), ("File type", "Conventional base calls"),
+        ("Encoding", "Sanger / Illumina 1.9"), ("Total Sequences", reads), ("Sequences flagged as poor quality", 0),
+        ("Sequence length", length_string), ("%GC", int(round(gc_total)))]))
+
+    ## per base sequence quality
+    hist = total['quality']
+    counts = hist.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (hist * np.arange(94)).sum(axis=1) / counts
+    lower = percentile(hist, 0.25)
+    median = percentile(hist, 0.5)
+    upper = percentile(hist, 0.75)
+    p10 = percentile(hist, 0.1)
+    p90 = percentile(hist, 0.9)
+    rows = [ (pos + 1, round(mean[pos], 2), median[pos], lower[pos], upper[pos], p10[pos], p90[pos]) for pos in range(len(counts)) if counts[pos] ]
+    modules.append(("Per base sequence quality",
+                    max(status(lower.min(), 10, 5, True), status(median.min(), 25, 20, True), key=['pass', 'warn', 'fail'].index),
+                    "#Base\tMean\tMedian\tLower Quartile\tUpper Quartile\t10th Percentile\t90th Percentile", rows))
+
+    ## per sequence quality
+    mean_quality = total['mean_quality']
+    modules.append(("Per sequence quality scores", status(int(mean_quality.argmax()), 27, 20, True), "#Quality\tCount",
+                    [ (q, mean_quality[q]) for q in np.nonzero(mean_quality)[0] ]))
+
+    ## per base sequence content
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent = 100 * bases[:, :4] / bases[:, :4].sum(axis=1, keepdims=True)
+    percent = np.nan_to_num(percent)
+    max_diff = max(np.abs(percent[:, 0] - percent[:, 3]).max(), np.abs(percent[:, 1] - percent[:, 2]).max())
+    modules.append(("Per base sequence content", status(max_diff, 10, 20), "#Base\tG\tA\tT\tC",
+                    [ (pos + 1, round(percent[pos, 2], 2), round(percent[pos, 0], 2), round(percent[pos, 3], 2), round(percent[pos, 1], 2))
+                      for pos in range(len(percent)) ]))
+
+    ## per sequence GC content
+    gc = total['gc']
+    modules.append(("Per sequence GC content", "pass", "#GC Content\tCount", [ (num, gc[num]) for num in range(101) ]))
+
+    ## per base N content
+    with np.errstate(divide='ignore', invalid='ignore'):
+        n_percent = np.nan_to_num(100 * bases[:, 4] / bases.sum(axis=1))
+    modules.append(("Per base N content", status(n_percent.max(), 5, 20), "#Base\tN-Count",
+                    [ (pos + 1, round(n_percent[pos], 2)) for pos in range(len(n_percent)) ]))
+
+    ## sequence length distribution
+    length_status = 'fail' if total['lengths'][0] else ('pass' if len(lengths) == 1 else 'warn')
+    modules.append(("Sequence Length Distribution", length_status, "#Length\tCount",
+                    [ (length, total['lengths'][length]) for length in lengths ]))
+
+    ## duplication levels (first reads)
+    sampled = sum(sequences.values())
+    levels = collections.Counter()
+    for count in sequences.values():
+        levels[count] += 1
+    labels = [ (str(l), l, l) for l in range(1, 10) ] + [(">10", 10, 49), (">50", 50, 99), (">100", 100, 499), (">500", 500, 999),
+                                                          (">1k", 1000, 4999), (">5k", 5000, 9999), (">10k+", 10000, float('inf'))]
+    rows = []
+    for label, low, high in labels:
+        distinct = sum(v for k, v in levels.items() if low <= k <= high)
+        reads_level = sum(k * v for k, v in levels.items() if low <= k <= high)
+        rows.append((label, round(100 * distinct / len(sequences), 2), round(100 * reads_level / sampled, 2)))
+    dedup = 100 * len(sequences) / sampled
+    modules.append(("Sequence Duplication Levels", status(100 - dedup, 20, 50),
+                    "#Total Deduplicated Percentage\t%s\n#Duplication Level\tPercentage of deduplicated\tPercentage of total" %round(dedup, 2), rows))
+
+    ## overrepresented sequences
+    rows = [ (seq.decode(), count, round(100 * count / sampled, 4), "No Hit") for seq, count in sequences.most_common() if count > 0.001 * sampled ]
+    over_status = status(max([ r[2] for r in rows ] or [0]), 0.1, 1)
+    modules.append(("Overrepresented sequences", over_status if rows else "pass", "#Sequence\tCount\tPercentage\tPossible Source", rows))
+
+    ## k-mers: observed / expected from base composition
+    kmers = total['kmers']
+    windows = kmers.sum()
+    if windows:
+        composition = bases[:, :4].sum(axis=0) / acgt
+        expected = np.ones(4**kmer_size)
+        for i in range(kmer_size):
+            expected *= composition[(np.arange(4**kmer_size) // 4**(kmer_size - 1 - i)) % 4]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.nan_to_num(kmers / (expected * windows))
+        top = [ code for code in np.argsort(-ratio)[:20] if ratio[code] > 5 and kmers[code] >= 10 ]
+        rows = [ ("".join("ACGT"[(code // 4**(kmer_size - 1 - i)) % 4] for i in range(kmer_size)), kmers[code], 0.0, round(ratio[code], 2), "NA") for code in top ]
+        modules.append(("Kmer Content", "warn" if rows else "pass", "#Sequence\tCount\tPValue\tObs/Exp Max\tMax Obs/Exp Position", rows))
+
+    return (modules)
+
+############################################################
+def write_fastqc_data(folder, fastq_file, modules):
+    """Writes fastqc_data.txt and summary.txt in the folder given"""
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, 'fastqc_data.txt'), 'w') as data_hd:
+        data_hd.write("##FastQC\tRSP native %s\n" %pipeline_version)
+        for name, module_status, header, rows in modules:
+            data_hd.write(">>%s\t%s\n%s\n" %(name, module_status, header))
+            for row in rows:
+                data_hd.write("\t".join(str(v) for v in row) + "\n")
+            data_hd.write(">>END_MODULE\n")
+
+    with open(os.path.join(folder, 'summary.txt'), 'w') as summary_hd:
+        for name, module_status, header, rows in modules:
+            summary_hd.write("%s\t%s\t%s\n" %(module_status.upper(), name, os.path.basename(fastq_file)))
+
+    return (os.path.join(folder, 'fastqc_data.txt'))
+
+############################################################
+def is_bgzf(fastq_file):
+    """Checks whether a file is compressed using blocks (BGZF), e.g. by bgzip"""
+    with open(fastq_file, 'rb') as file_hd:
+        header = file_hd.read(18)
+    return (len(header) == 18 and header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC")
+
+############################################################
+def bgzf_blocks(fastq_file):
+    """Returns list of (offset, size) for each BGZF block, reading only block headers"""
+    blocks = []
+    file_size = os.path.getsize(fastq_file)
+    with open(fastq_file, 'rb') as file_hd:
+        offset = 0
+        while offset < file_size:
+            file_hd.seek(offset)
+            header = file_hd.read(18)
+            if len(header) < 18 or header[12:14] != b"BC":
+                raise ValueError("Not a valid BGZF block at offset %s" %offset)
+            size = struct.unpack("<H", header[16:18])[0] + 1
+            blocks.append((offset, size))
+            offset += size
+    return (blocks)
+
+############################################################
+def records_in(data, max_records):
+    """Complete FASTQ records within a piece of a file starting at any position.
+
+    The first record is identified by a header line (@) followed by sequence, a '+' line and quality of the same length.
+
+    :returns: List of (position of the record within data, sequence, quality)
+    """
+    lines = data.split(b"\n")
+    ## position of each line; first and last lines might be incomplete
+    positions = list(itertools.accumulate([0] + [ len(line) + 1 for line in lines[:-1] ]))[1:-1]
+    lines = lines[1:-1]
+    for start in range(min(len(lines), 8)):
+        if (start + 3 < len(lines) and lines[start].startswith(b"@") and lines[start + 2].startswith(b"+")
+                and len(lines[start + 1]) == len(lines[start + 3])):
+            break
+    else:
+        return ([])
+
+    records = []
+    for num in range(start, len(lines) - 3, 4):
+        if len(records) >= max_records:
+            break
+        records.append((positions[num], lines[num + 1].rstrip(b"\r"), lines[num + 3].rstrip(b"\r")))
+    return (records)
+
+############################################################
+def seek_sample(fastq_file, num_reads, per_seek=20, seed=0):
+    """Retrieves reads from random positions of the file: plain FASTQ (bytes) or BGZF (blocks).
+
+    Positions are drawn without replacement. Pieces read from close positions might overlap,
+    so reads are identified by their position in the file and retrieved once.
+
+    :param fastq_file: FASTQ file, plain or BGZF compressed
+    :param num_reads: Number of reads to retrieve
+    :param per_seek: Consecutive reads retrieved at each position
+    :param seed: Seed for random positions
+
+    :returns: (list of (sequence, quality), estimated total reads, lower bound, upper bound)
+    """
+    rand = random.Random(seed)
+    seeks = int(math.ceil(num_reads / per_seek))
+    records = {}
+    densities = []
+
+    if fastq_file.endswith('.gz'):
+        ## BGZF: decompress several consecutive blocks from random blocks
+        blocks = [ b for b in bgzf_blocks(fastq_file) if b[1] > 28 ]
+        total_size = sum(b[1] for b in blocks)
+        chosen = sorted(rand.sample(range(len(blocks)), min(seeks, len(blocks))))
+        with open(fastq_file, 'rb') as file_hd:
+            for num in chosen:
+                data = b""
+                compressed = 0
+                block_sizes = []
+                for offset, size in blocks[num:num + 2]:
+                    file_hd.seek(offset)
+                    block = file_hd.read(size)
+                    data += zlib.decompress(block[18:-8], -15)
+                    compressed += size
+                    block_sizes.append(len(data))
+                ## reads per compressed byte
+                densities.append(data.count(b"\n") / 4 / compressed)
+                ## position of each read: block and position within the block
+                for position, seq, qual in records_in(data, per_seek):
+                    if position < block_sizes[0]:
+                        records.setdefault((num, position), (seq, qual))
+                    else:
+                        records.setdefault((num + 1, position - block_sizes[0]), (seq, qual))
+    else:
+        ## plain FASTQ: read from random offsets
+        total_size = os.path.getsize(fastq_file)
+        with open(fastq_file, 'rb') as file_hd:
+            positions = range(max(total_size - 65536, 1))
+            for seek in rand.sample(positions, min(seeks, len(positions))):
+                file_hd.seek(seek)
+                data = file_hd.read(65536)
+                densities.append(data.count(b"\n") / 4 / max(len(data), 1))
+                for position, seq, qual in records_in(data, per_seek):
+                    records.setdefault(seek + position, (seq, qual))
+
+    ## total reads estimated from reads per byte at each position: 95% confidence interval
+    (mean, margin) = mean_margin(densities)
+    records = list(records.values())
+    return (records[:num_reads], total_size * mean, total_size * (mean - margin), total_size * (mean + margin))
+
+############################################################
+def reservoir_sample(fastq_file, num_reads, seed=0):
+    """Retrieves reads uniformly from a file that can only be read sequentially (e.g. gzip), skipping
+    reads not selected without parsing them (reservoir sampling, algorithm L).
+
+    :returns: (list of (sequence, quality), total reads, total reads, total reads)
+    """
+    rand = random.Random(seed)
+    handle = open_fastq(fastq_file)
+    try:
+        reservoir = []
+        for (seqs, quals) in read_chunks(handle, num_reads):
+            reservoir = list(zip(seqs, quals))
+            break
+        total = len(reservoir)
+        if total < num_reads:
+            return (reservoir, total, total, total)
+
+        weight = math.exp(math.log(rand.random()) / num_reads)
+        while True:
+            skip = int(math.floor(math.log(rand.random()) / math.log(1 - weight)))
+            ## skip reads not selected: consume lines in pieces
+            end_of_file = False
+            while skip > 0 and not end_of_file:
+                piece = min(skip, 100000)
+                lines = len(list(itertools.islice(handle, piece * 4)))
+                total += lines // 4
+                skip -= piece
+                end_of_file = lines < piece * 4
+            if end_of_file:
+                break
+            record = list(itertools.islice(handle, 4))
+            if len(record) < 4:
+                break
+            total += 1
+            reservoir[rand.randrange(num_reads)] = (record[1].rstrip(b"\r\n"), record[3].rstrip(b"\r\n"))
+            weight *= math.exp(math.log(rand.random()) / num_reads)
+    finally:
+        handle.close()
+    return (reservoir, total, total, total)
+
+############################################################
+def mean_margin(values, z=1.96):
+    """Mean and margin of error (95% confidence interval by default)"""
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return (float(values.mean()) if len(values) else 0.0, 0.0)
+    return (float(values.mean()), float(z * values.std(ddof=1) / math.sqrt(len(values))))
+
+############################################################
+def proportion_bounds(count, total, z=1.96):
+    """Wilson 95% confidence interval (percentage) for a proportion"""
+    if not total:
+        return (0.0, 0.0, 0.0)
+    p = count / total
+    center = (p + z*z / (2*total)) / (1 + z*z / total)
+    margin = z * math.sqrt(p*(1 - p) / total + z*z / (4*total*total)) / (1 + z*z / total)
+    return (100*p, 100*max(center - margin, 0), 100*min(center + margin, 1))
+
+############################################################
+def subsample_stats(fastq_file, num_reads):
+    """Statistics for a sample of reads of the file, with total reads estimated
+
+    :returns: (statistics, Counter of sequences, sampled reads, (estimate, lower, upper) of total reads)
+    """
+    if fastq_file.endswith('.gz') and not is_bgzf(fastq_file):
+        (records, estimate, lower, upper) = reservoir_sample(fastq_file, num_reads)
+    else:
+        (records, estimate, lower, upper) = seek_sample(fastq_file, num_reads)
+
+    if not records:
+        raise ValueError("No reads retrieved")
+    seqs = [ r[0] for r in records ]
+    quals = [ r[1] for r in records ]
+    total = chunk_stats(seqs, quals)
+    sequences = collections.Counter(s[:50] if len(s) > 75 else s for s in seqs)
+    return (total, sequences, records, (estimate, lower, upper))
+
+############################################################
+def write_bounds(folder, fastq_file, records, total_reads):
+    """Writes estimates and 95% confidence intervals for metrics obtained from a sample of reads"""
+    sampled = len(records)
+    lengths = np.array([ len(r[0]) for r in records ], dtype=float)
+    quality = [ (np.frombuffer(r[1], dtype=np.uint8).astype(float) - 33).mean() for r in records if r[1] ]
+    gc = [ 100 * (r[0].count(b"G") + r[0].count(b"C")) / len(r[0]) for r in records if r[0] ]
+    bases = float(lengths.sum())
+    n_bases = sum(r[0].count(b"N") for r in records)
+
+    rows = [ ("Total Sequences", ) + tuple(int(round(v)) for v in total_reads) ]
+    for name, values in (("Mean sequence length", lengths), ("Mean quality", quality), ("%GC", gc)):
+        (mean, margin) = mean_margin(values)
+        rows.append((name, round(mean, 2), round(mean - margin, 2), round(mean + margin, 2)))
+    rows.append(("% reads mean quality < 20",) + tuple(round(v, 2) for v in proportion_bounds(sum(1 for q in quality if q < 20), sampled)))
+    rows.append(("% N bases",) + tuple(round(v, 4) for v in proportion_bounds(n_bases, bases)))
+    distinct = len(set(r[0] for r in records))
+    rows.append(("% Deduplicated (sampled reads)",) + tuple(round(v, 2) for v in proportion_bounds(distinct, sampled)))
+
+    with open(os.path.join(folder, 'subsample_bounds.txt'), 'w') as bounds_hd:
+        bounds_hd.write("#File\t%s\n#Sampled reads\t%s\n" %(os.path.basename(fastq_file), sampled))
+        bounds_hd.write("#Metric\tEstimate\tLower 95%\tUpper 95%\n")
+        for row in rows:
+            bounds_hd.write("\t".join(str(v) for v in row) + "\n")
+    return (os.path.join(folder, 'subsample_bounds.txt'))
+
+############################################################
+def native_qc(path, files, sample, threads, subsample=0):
+    """Quality statistics for each FASTQ file of a sample in FASTQC format: <path>/<file>_fastqc/fastqc_data.txt
+
+    :param path: Output folder
+    :param files: FASTQ files
+    :param sample: Sample name
+    :param threads: Number of processes
+    :param subsample: Number of reads to sample from each file (0: all reads)
+
+    :returns: OK or FAIL
+    """
+    for fastq_file in files:
+        folder = os.path.join(path, output_name(fastq_file) + "_fastqc")
+        try:
+            if subsample:
+                ## statistics for a sample of reads: total reads estimated
+                (total, sequences, records, total_reads) = subsample_stats(fastq_file, subsample)
+                modules = fastqc_modules(fastq_file, total, sequences)
+                modules[0][3][3] = ("Total Sequences", int(round(total_reads[0])))
+                modules[0][3].append(("Sampled sequences", len(records)))
+                write_fastqc_data(folder, fastq_file, modules)
+                write_bounds(folder, fastq_file, records, total_reads)
+            else:
+                (total, sequences) = fastq_stats(fastq_file, threads)
+                modules = fastqc_modules(fastq_file, total, sequences)
+                write_fastqc_data(folder, fastq_file, modules)
+        except (OSError, ValueError, EOFError, zlib.error) as exc:
+            print (colored("** ERROR: Quality check failed for file %s [%s]: %s" %(fastq_file, sample, exc), 'red'))
+            return ('FAIL')
+    return ('OK')
@@ -21,6 +21,9 @@ from termcolor import colored
 ## import my modules
 from HCGB import functions
 from RSP.config import set_config
+from RSP.scripts import result_cache
+from RSP.scripts import fastq_stats
+from RSP import __version__ as pipeline_version
 
 ############
 def call_fastqc(path, files, sample, fastqc_bin, threads):    
@@ -36,27 +39,45 @@ def call_fastqc(path, files, sample, fastqc_bin, threads):
     cmd_fastqc = '%s --extract -t %s -o %s %s > %s 2> %s' %(fastqc_bin, threads, path, files_string, logFile, logFile)
     fastq_code = functions.system_call_functions.system_call( cmd_fastqc )
     
-    if not fastq_code:
+    if (fastq_code != 'OK'):
         print ('** Sample %s failed...' %sample)
 
     ## send command    
     return (fastq_code)
         
 ############
-def run_module_fastqc(path, files, sample, threads):    
+def fastqc_outputs(path, files, backend="fastqc"):
+    """Returns zip files generated by FASTQC for each file provided (fastqc_data.txt for native backend)"""
+    if backend == "native":
+        return ([ os.path.join(path, fastq_stats.output_name(f) + "_fastqc", "fastqc_data.txt") for f in files ])
+    return ([ os.path.join(path, re.sub(r"\.(fastq|fq)(\.gz)?$", "", os.path.basename(f)) + "_fastqc.zip") for f in files ])
+
+############
+def run_module_fastqc(path, files, sample, threads, backend="fastqc", subsample=0):    
     ## Arguments provided via ARGVs
 
-    ## check if previously done and succeeded
-    filename_stamp = path + '/.success'
-    if os.path.isfile(filename_stamp):
-        stamp = functions.time_functions.read_time_stamp(filename_stamp)
-        print (colored("\tA previous command generated results on: %s [%s -- %s]" %(stamp, sample, 'fastqc'), 'yellow'))
+    ## subsample: statistics computed for a number of reads of each file (native backend)
+    if subsample:
+        backend = "native"
+
+    ## check if previously done with same reads and software
+    cmd_fastqc = 'fastqc --extract -o %s %s' %(path, " ".join(files))
+    outputs = fastqc_outputs(path, files, backend)
+    if backend == "native":
+        record = result_cache.get_record(path, 'fastqc', files, 'native subsample %s %s' %(subsample, cmd_fastqc), 'RSP ' + pipeline_version)
     else:
-        ## call fastqc
-        fastqc_bin = set_config.get_exe('fastqc')
-        codeReturn = call_fastqc(path, files, sample, fastqc_bin, threads)
+        record = result_cache.get_record(path, 'fastqc', files, cmd_fastqc, 'fastqc')
+    
+    if not result_cache.is_cached(record, outputs, sample):
+        if backend == "native":
+            ## statistics computed in python: no java process
+            codeReturn = fastq_stats.native_qc(path, files, sample, threads, subsample)
+        else:
+            ## call fastqc
+            fastqc_bin = set_config.get_exe('fastqc')
+            codeReturn = call_fastqc(path, files, sample, fastqc_bin, threads)
 
-        if codeReturn:
-            functions.time_functions.print_time_stamp(filename_stamp)
+        if (codeReturn == 'OK'):
+            result_cache.save_record(record, outputs)
         
-        return ()
+    return ()
@@ -8,13 +8,88 @@
 
 import sys
 import os
+import time
+from termcolor import colored
+
 from RSP.config import set_config
+from RSP.scripts import result_cache
+from RSP.scripts import compression
+from RSP.scripts import generate_matrix
+from RSP.scripts import run_stats
+from RSP import __version__ as pipeline_version
 from HCGB.functions import fasta_functions, time_functions
 from HCGB.functions import aesthetics_functions, system_call_functions
 from HCGB.functions import files_functions, main_functions
+from HCGB.functions.aesthetics_functions import debug_message
 
 #####################
-def featurecounts_call(path, gtf_file, bam_file, name, threads, allow_multimap, stranded, option_featureCount, Debug):
+def featurecounts_cmd(featureCount_exe, gtf_file, out_file, bam_files, logfile, threads, allow_multimap, stranded, option_featureCount):
+	"""Returns featureCounts command line for the mode given (RNAbiotype or Gene Count) and one or several BAM files"""
+
+	if isinstance(bam_files, list):
+		bam_files = " ".join(bam_files)
+
+	## Mode
+	if (option_featureCount=="RNAbiotype"):
+		## Allow multimapping
+		if allow_multimap:
+			cmd_featureCount = ('%s -s %s -M -O -T %s -p -t exon -g transcript_biotype -a %s -o %s %s 2> %s' %(
+				featureCount_exe, stranded, str(threads), gtf_file, out_file, bam_files, logfile)
+			)
+		else:
+			cmd_featureCount = ('%s -s %s --largestOverlap -T %s -p -t exon -g transcript_biotype -a %s -o %s %s 2> %s' %(
+				featureCount_exe, stranded, str(threads), gtf_file, out_file, bam_files, logfile)
+			)
+
+	elif (option_featureCount=="Gene Count"):
+		## "-t exon":   Specify feature type in GTF annotation.
+		##                              `exon' by default. Features used for read
+		##                              counting will be extracted from annotation using the provided value.
+
+		## "-g gene_name":      Specify attribute type in GTF annotation. `gene_id' by
+		##                      default. Meta-features used for read counting will be
+		##                      extracted from annotation using the provided value.
+
+		## inicialmente se hizo con gene_name pero tras ver resultados entendemos que es mejor a nivel de gene_id ya que seran IDs unicos
+
+		## Allow multimapping
+		if allow_multimap:
+			cmd_featureCount = ('%s -p -t exon -g gene_id -s %s -M -O -T %s -p -a %s -o %s %s 2> %s' %(
+				featureCount_exe, stranded, str(threads), gtf_file, out_file, bam_files, logfile)
+				## -T threads
+				## -s stranded
+				## -M multimapping
+			)
+		else:
+			cmd_featureCount = ('%s -p -t exon -g gene_id -s %s --largestOverlap -T %s -a %s -o %s %s 2> %s' %(
+				featureCount_exe, stranded, str(threads), gtf_file, out_file, bam_files, logfile)
+			)
+
+	return (cmd_featureCount)
+
+#####################
+def count_outputs(path, compress=False):
+	"""Outputs for a sample: featureCount.out (or featureCount.out.gz if compressed) and summary"""
+	out_file = os.path.join(path, 'featureCount.out')
+	return ([out_file + '.gz' if compress else out_file, out_file + '.summary'])
+
+#####################
+def compress_counts(out_file, threads):
+	"""Compresses featureCount.out generated by featureCounts. Summary is not compressed (used by MultiQC)."""
+	if not compression.compress_file(out_file, threads):
+		print (colored("** ERROR: Compression failed for " + out_file, 'red'))
+		exit()
+
+#####################
+def sample_record(path, gtf_file, bam_file, name, threads, allow_multimap, stranded, option_featureCount):
+	"""Cache record for a sample: same for single and batched calls"""
+	out_file = os.path.join(path, 'featureCount.out')
+	logfile = os.path.join(path, name + '_RNAbiotype.log')
+	cmd_featureCount = featurecounts_cmd('featureCounts', gtf_file, out_file, bam_file, logfile, threads, allow_multimap, stranded, option_featureCount)
+	return (result_cache.get_record(path, 'featureCounts', [gtf_file, bam_file], cmd_featureCount, 'featureCounts'))
+
+#####################
+def featurecounts_call(path, gtf_file, bam_file, name, threads, allow_multimap, stranded, option_featureCount, Debug, compress=False):
 		
 	## option_featureCount: RNAbiotype, Gene count
 	threads = str(threads)
@@ -29,67 +104,169 @@ def featurecounts_call(path, gtf_file, bam_file, name, threads, allow_multimap,
 	out_file = os.path.join(path, 'featureCount.out')
 	logfile = os.path.join(path, name + '_RNAbiotype.log')
 
-	filename_stamp_featureCounts = path + '/.success_featureCounts'
-	if os.path.isfile(filename_stamp_featureCounts):
-		stamp = time_functions.read_time_stamp(filename_stamp_featureCounts)
-		print (colored("\tA previous command generated results on: %s [%s -- %s]" %(stamp, name, 'featureCounts'), 'yellow'))
-	else:
-            
-		## debugging messages
-		if Debug:
-			print ("** DEBUG:")
-			print ("featureCounts system call for sample: " + name)
-			print ("out_file: " + out_file)
-			print ("logfile: " + logfile)
-			print("option_featureCount: " + option_featureCount)
-
-		## Mode
-		if (option_featureCount=="RNAbiotype"):
-			## Allow multimapping
-			if allow_multimap:
-				cmd_featureCount = ('%s -s %s -M -O -T %s -p -t exon -g transcript_biotype -a %s -o %s %s 2> %s' %(
-					featureCount_exe, stranded, str(threads), gtf_file, out_file, bam_file, logfile)
-				)
-			else:
-				cmd_featureCount = ('%s -s %s --largestOverlap -T %s -p -t exon -g transcript_biotype -a %s -o %s %s 2> %s' %(
-					featureCount_exe, stranded, str(threads), gtf_file, out_file, bam_file, logfile)
-				)
-
-		elif (option_featureCount=="Gene Count"):
-			## "-t exon":   Specify feature type in GTF annotation.
-			##                              `exon' by default. Features used for read
-			##                              counting will be extracted from annotation using the provided value.
-
-			## "-g gene_name":      Specify attribute type in GTF annotation. `gene_id' by
-			##                      default. Meta-features used for read counting will be
-			##                      extracted from annotation using the provided value.
-
-			## inicialmente se hizo con gene_name pero tras ver resultados entendemos que es mejor a nivel de gene_id ya que seran IDs unicos
-
-			## Allow multimapping
-			if allow_multimap:
-				cmd_featureCount = ('%s -p -t exon -g gene_id -s %s -M -O -T %s -p -a %s -o %s %s 2> %s' %(
-					featureCount_exe, stranded, str(threads), gtf_file, out_file, bam_file, logfile)
-					## -T threads
-					## -s stranded
-					## -M multimapping
-				)
-			else:
-				cmd_featureCount = ('%s -p -t exon -g gene_id -s %s --largestOverlap -T %s -a %s -o %s %s 2> %s' %(
-					featureCount_exe, stranded, str(threads), gtf_file, out_file, bam_file, logfile)
-				)
+	## debugging messages
+	if Debug:
+		print ("** DEBUG:")
+		print ("featureCounts system call for sample: " + name)
+		print ("out_file: " + out_file)
+		print ("logfile: " + logfile)
+		print("option_featureCount: " + option_featureCount)
+
+	cmd_featureCount = featurecounts_cmd(featureCount_exe, gtf_file, out_file, bam_file, logfile, threads, allow_multimap, stranded, option_featureCount)
 
+	## check if previously counted with same BAM, annotation, parameters and software
+	record = sample_record(path, gtf_file, bam_file, name, threads, allow_multimap, stranded, option_featureCount)
+	outputs = count_outputs(path, compress)
+	if not result_cache.is_cached(record, outputs, name):
 		## send command for feature count
 		## system call
 		cmd_featureCount_code = system_call_functions.system_call(cmd_featureCount, False, True)
-		if not cmd_featureCount_code:
+		if cmd_featureCount_code != 'OK':
 			print("** ERROR: featureCount failed for sample " + name)
 			exit()
+		
+		if (compress):
+			compress_counts(out_file, threads)
 				
-		## print time stamp
-		time_functions.print_time_stamp(filename_stamp_featureCounts)
+		## save record
+		result_cache.save_record(record, outputs)
+		
+	return (outputs[0])
+
+#####################
+def split_batch_output(batch_file, samples, compress=False, threads=1):
+	"""Splits featureCounts output generated for several BAM files into featureCount.out (and summary) for each sample.
+
+	:param batch_file: featureCounts output containing a column for each BAM file
+	:param samples: List of (folder, name, BAM file) in the same order as provided to featureCounts
+	:param compress: Write featureCount.out compressed while split
+	:param threads: Threads for the compressor of each file
+
+	:returns: List of featureCount.out files
+	"""
+	out_files = [ count_outputs(path, compress)[0] for (path, name, bam_file) in samples ]
+
+	## counts: program line, header and annotation columns (6) followed by a column for each BAM
+	start_time = time.time()
+	outputs = [ compression.open_output(out_file, threads) for out_file in out_files ]
+	raw_sizes = [ 0 for out_file in out_files ]
+	with open(batch_file, 'rb') as batch_hd:
+		for line in batch_hd:
+			if line.startswith(b'#'):
+				lines = [ line for out_file in out_files ]
+			else:
+				fields = line.rstrip(b'\n').split(b'\t')
+				annotation = b"\t".join(fields[:6])
+				lines = [ annotation + b"\t" + fields[6 + num] + b"\n" for num in range(len(out_files)) ]
+
+			for num, (out_hd, process) in enumerate(outputs):
+				out_hd.write(lines[num])
+				raw_sizes[num] += len(lines[num])
+
+	for out_file, (out_hd, process) in zip(out_files, outputs):
+		if not compression.close_output(out_hd, process):
+			print (colored("** ERROR: Compression failed for " + out_file, 'red'))
+			exit()
+	if (compress):
+		compression.record_streamed(out_files, raw_sizes, time.time() - start_time, compression.compressor(threads)[0])
+
+	## summary: status column followed by a column for each BAM
+	handles = [ open(count_outputs(path)[1], 'w') for (path, name, bam_file) in samples ]
+	with open(batch_file + '.summary') as batch_hd:
+		for line in batch_hd:
+			fields = line.rstrip('\n').split('\t')
+			for num, out_hd in enumerate(handles):
+				out_hd.write(fields[0] + "\t" + fields[1 + num] + "\n")
+	for out_hd in handles:
+		out_hd.close()
+
+	return (out_files)
+
+#####################
+def featurecounts_batch(batch_folder, logfile, gtf_file, samples, threads, allow_multimap, stranded, option_featureCount, Debug, compress=False):
+	"""Counts several BAM files using a single featureCounts call, so the annotation is parsed once.
+
+	Results are split into featureCount.out and featureCount.out.summary for each sample, as
+	generated by featurecounts_call. Samples with results previously generated are not counted again.
+	A single log is kept for the call and the log of each sample refers to it.
+
+	:param batch_folder: Folder to store featureCounts output for all samples
+	:param logfile: Log file for the featureCounts call
+	:param gtf_file: Annotation file in GTF format
+	:param samples: List of (folder, name, BAM file) for each sample
+	:param threads: Number of threads
+	:param allow_multimap: Count multimapping reads
+	:param stranded: 0 (unstranded), 1 (stranded) or 2 (reversely stranded)
+	:param option_featureCount: Gene Count or RNAbiotype
+	:param Debug: Show debugging messages
+	:param compress: Compress featureCount.out for each sample
+
+	:type batch_folder: string
+	:type logfile: string
+	:type gtf_file: string
+	:type samples: list
+	:type threads: int
+	:type allow_multimap: boolean
+	:type stranded: int
+	:type option_featureCount: string
+	:type Debug: boolean
+	:type compress: boolean
+
+	:returns: List of featureCount.out files or FAIL if featureCounts failed
+	"""
+	threads = str(threads)
+	stranded = str(stranded)
+
+	## check previous results for each sample
+	pending = []
+	records = []
+	for (path, name, bam_file) in samples:
+		if not os.path.isdir(path):
+			files_functions.create_folder(path)
+
+		record = sample_record(path, gtf_file, bam_file, name, threads, allow_multimap, stranded, option_featureCount)
+		if result_cache.is_cached(record, count_outputs(path, compress), name):
+			continue
+		if not os.path.isfile(bam_file):
+			print (colored("** ERROR: BAM file not available for sample %s: %s" %(name, bam_file), 'red'))
+			continue
+
+		pending.append((path, name, bam_file))
+		records.append(record)
+
+	if pending:
+		featureCount_exe = set_config.get_exe('featureCounts')
+		if not os.path.isdir(batch_folder):
+			files_functions.create_folder(batch_folder)
+
+		batch_file = os.path.join(batch_folder, 'featureCount.out')
+		os.makedirs(os.path.dirname(logfile), exist_ok=True)
+		cmd_featureCount = featurecounts_cmd(featureCount_exe, gtf_file, batch_file, [ s[2] for s in pending ],
+											 logfile, threads, allow_multimap, stranded, option_featureCount)
 		
-	return (out_file)
+		## debugging messages
+		if Debug:
+			debug_message("featureCounts batch call for samples: " + ", ".join([ s[1] for s in pending ]))
+			debug_message(cmd_featureCount)
+
+		print ("+ Counting %s samples in a single featureCounts call..." %len(pending))
+		cmd_featureCount_code = system_call_functions.system_call(cmd_featureCount, False, True)
+		if cmd_featureCount_code != 'OK':
+			print (colored("** ERROR: featureCount failed for samples: " + ", ".join([ s[1] for s in pending ]) + ". See " + logfile, 'red'))
+			return ('FAIL')
+
+		## split results for each sample: log refers to the log of the call
+		split_batch_output(batch_file, pending, compress, max(1, int(threads) // len(pending)))
+		for (path, name, bam_file), record in zip(pending, records):
+			with open(os.path.join(path, name + '_RNAbiotype.log'), 'w') as log_hd:
+				log_hd.write("featureCounts call for samples: %s\nLog: %s\n" %(", ".join([ s[1] for s in pending ]), logfile))
+			result_cache.save_record(record, count_outputs(path, compress))
+
+		## remove batch output: available for each sample
+		for f in (batch_file, batch_file + '.summary'):
+			os.remove(f)
+
+	return ([ count_outputs(path, compress)[0] for (path, name, bam_file) in samples ])
 
 #####################
 def biotype_count(path, gtf_file, bam_file, name, threads, Debug, allow_multimap, stranded):
@@ -124,194 +301,75 @@ def parse_featureCount(out_file, path, name, bam_file, Debug):
 	out_tsv_file_name = out_file + '.tsv'
 	RNA_biotypes_file_name = os.path.join(path, name + '_RNAbiotype.tsv')
 
-	##
-	filename_stamp_parse = path + '/.success_parse'
-	if os.path.isfile(filename_stamp_parse):
-		stamp = time_functions.read_time_stamp(filename_stamp_parse)
-		print (colored("\tA previous command generated results on: %s [%s -- %s]" %(stamp, name, 'parse results'), 'yellow'))
-	else:
+	## check if previously parsed for same featureCounts and mapping results
+	mapping_folder = os.path.dirname(bam_file)
+	mapping_stats = os.path.join(mapping_folder, 'Log.final.out')
+	record = result_cache.get_record(path, 'parse', [out_file, out_file + '.summary', mapping_stats], 
+									{'parse_featureCount': name}, 'RSP ' + pipeline_version)
+	if not result_cache.is_cached(record, [out_tsv_file_name, RNA_biotypes_file_name], name):
 	
 		## debugging messages
 		if Debug:
-			print ("** DEBUG:")
-			print ("Parse results for sample: " + name)
-			
-		## parse results
-		out_tsv_file = open(out_tsv_file_name, 'w')
-		RNA_biotypes_file = open(RNA_biotypes_file_name, 'w')
-		tRNA_count = 0
-		
-		##########################################
-		### read count file
-		##########################################
-		count_file = open(out_file)
-		count_file_text = count_file.read()
-		count_file_lines = count_file_text.splitlines()	
-	
-		for line in count_file_lines:
-			if line.startswith('#'):
-				continue
-			elif line.startswith('Geneid'):
-				continue
-			else:
-				ID = line.split('\t')[0]
-				count = int(line.split('\t')[-1])
-				string2write_raw = "%s\t%s\n" %(ID, count)
-				out_tsv_file.write(string2write_raw)
-	
-				tRNA_search = re.search(r".*tRNA", ID)
-				if tRNA_search:
-					tRNA_count = int(tRNA_count) + int(count)				
-				elif (count > 0):
-					RNA_biotypes_file.write(string2write_raw)
-		
-		## count and summary tRNA
-		string2write = "tRNA\t%s\n" %tRNA_count
-		RNA_biotypes_file.write(string2write)
-		RNA_biotypes_file.close()
-		
-		##########################################
-		### read summary count file
-		##########################################
-		summary_count_file = open(out_file + '.summary')
-		summary_count_file_text = summary_count_file.read()
-		summary_count_file_lines = summary_count_file_text.splitlines()	
-	
-		for line in summary_count_file_lines:
-			if line.startswith('Status'):
-				continue
-			elif line.startswith('Assigned'):
-				continue
-			else:
-				## adds Unassigned_Ambiguity
-				## adds Unassigned_NoFeatures
-				ID = line.split('\t')[0]
-				count = int(line.split('\t')[-1])
-	
-				## skip empty entries
-				if count == 0:
-					continue
-				string2write_raw = "%s\t%s\n" %(ID, count)
-				out_tsv_file.write(string2write_raw)
-	
+			debug_message("Parse results for sample: " + name)
+
 		##########################################
-		## get mapping statistics according to mapping software
+		### read count file: IDs and counts
 		##########################################
-		count_multi = 0
-		count_unmap = 0
-		mapping_folder = os.path.dirname(bam_file)
-		mapping_stats = mapping_folder + '/Log.final.out'
-		
-		## ATTENTION: See example at the end of this file
-		
-		## -------------------------------- ##
-		### STAR mapping		
-		## -------------------------------- ##
-		if files_functions.is_non_zero_file(mapping_stats):
-			## debugging messages
-			if Debug:
-				print ("** DEBUG:")
-				print ("STAR mapping available for sample: " + name)
-				print ("mapping_folder: " + mapping_folder)
-	
-			mapping_stats_file = open(mapping_stats)
-			mapping_stats_file_text = mapping_stats_file.read()
-			mapping_stats_file_lines = mapping_stats_file_text.splitlines()	
-	
-			for line in mapping_stats_file_lines:
-				multi_search = re.search(r".*Number of reads mapped to", line)
-				unmap_search = re.search(r".*Number of reads unmapped", line)
-				input_search = re.search(r".*input reads.*", line)
-			
-				if Debug:
-					debug_message("mapping_stats_file Line")
-					debug_message(line)
-			
-				if input_search:
-					total_input_reads = int(line.split('\t')[-1])
-					if Debug:
-						print("total_input_reads")
-						print(type(total_input_reads))
-						print(total_input_reads)
-							
-				if multi_search:
-					count_tmp = int(line.split('\t')[-1])
-					count_multi = count_multi + count_tmp
-					if Debug:
-						print("count_tmp")
-						print(type(count_tmp))
-						print(count_tmp)
-						print("count_multi")
-						print(type(count_multi))
-						print(count_multi)
-	
-				if unmap_search:
-					count_reads_tmp = int(line.split('\t')[-1])
-					#count_reads = math_functions.percentage(perc_tmp, total_input_reads)
-					count_unmap = count_unmap + count_reads_tmp
-					if Debug:
-						print("perc_tmp")
-						print(type(count_reads_tmp))
-						print(count_reads_tmp)
-						
-						print("count_unmap")
-						print(type(count_unmap))
-						print(count_unmap)
+		(ids, counts) = generate_matrix.read_counts(out_file, 'Geneid')
+		if ids is None:
+			(ids, counts) = ([], [])
+		counts = [ int(c) for c in counts ]
+		ids = [ str(i) for i in ids ]
+
+		## tRNA counts summarized
+		tRNA = [ 'tRNA' in i for i in ids ]
+		tRNA_count = sum(c for c, is_tRNA in zip(counts, tRNA) if is_tRNA)
+
+		with open(out_tsv_file_name, 'w') as out_tsv_file, open(RNA_biotypes_file_name, 'w') as RNA_biotypes_file:
+			out_tsv_file.writelines("%s\t%s\n" %(i, c) for i, c in zip(ids, counts))
+			RNA_biotypes_file.writelines("%s\t%s\n" %(i, c) for i, c, is_tRNA in zip(ids, counts, tRNA) if c > 0 and not is_tRNA)
+			RNA_biotypes_file.write("tRNA\t%s\n" %tRNA_count)
 		
-		else:
-	
-			## -------------------------------- ##
-			## tophat
-			## -------------------------------- ##
-	
-			mapping_stats = mapping_folder + '/align_summary.txt' 
-			count_map = 0
-			total_input_reads = 0
-			
+			##########################################
+			### summary count file: not assigned (e.g. Unassigned_Ambiguity, Unassigned_NoFeatures)
+			##########################################
+			for status, count in run_stats.parse_featurecounts(out_file + '.summary').items():
+				if status != 'Assigned' and count > 0:
+					out_tsv_file.write("%s\t%s\n" %(status, count))
+
+			##########################################
+			## mapping statistics according to mapping software
+			##########################################
+			## ATTENTION: See example at the end of this file
+			count_unmap = 0
 			if files_functions.is_non_zero_file(mapping_stats):
-				## debugging messages
+				## STAR: sum of reads unmapped (too many mismatches, too short, other)
+				stats = run_stats.parse_star(mapping_stats)
+				count_unmap = sum(int(v) for k, v in stats.items() if k.startswith('number_of_reads_unmapped'))
 				if Debug:
-					print ("** DEBUG:")
-					print ("tophat mapping available for sample: " + name)
-					print ("mapping_folder: " + mapping_folder)
-				
-				mapping_stats_file = open(mapping_stats)
-				mapping_stats_file_text = mapping_stats_file.read()
-				mapping_stats_file_lines = mapping_stats_file_text.splitlines()	
-	
-				for line in mapping_stats_file_lines:
-					map_search2 = re.search(r"Aligned.*\:\s+(\d+).*", line)
-					input_search2 = re.search(r".*Input.*\:\s+(\d+).*", line)
-					if input_search2:
-						total_input_reads = input_search2.group(1)
-					if map_search2:
-						count_map = map_search2.group(1)
-		
-				####
-				count_unmap = int(total_input_reads) - int(count_map)
+					debug_message("STAR mapping statistics for sample %s: %s" %(name, stats))
+
+			elif files_functions.is_non_zero_file(os.path.join(mapping_folder, 'align_summary.txt')):
+				## tophat
+				stats = run_stats.parse_hisat2(os.path.join(mapping_folder, 'align_summary.txt'))
+				count_unmap = int(stats.get('input', 0)) - int(stats.get('aligned_pairs', stats.get('mapped', 0)))
 	
 			else:
 				## other
 				print ("Neither tophat or STAR..., no mapping statistics")
 	
-		### print mapping stats
-		string2write_unmap = "unmapped\t%s\n" %count_unmap
-		out_tsv_file.write(string2write_unmap)
+			### print mapping stats
+			out_tsv_file.write("unmapped\t%s\n" %count_unmap)
 		
-		## close files
-		out_tsv_file.close()
-		summary_count_file.close()
-		mapping_stats_file.close()
-		count_file.close()
-		## print timestamp
-		time_functions.print_time_stamp(filename_stamp_parse)
+		## save record
+		result_cache.save_record(record, [out_tsv_file_name, RNA_biotypes_file_name])
 
 	return(out_tsv_file_name, RNA_biotypes_file_name)
 
 ###########################
-def get_counts_gene(path, gtf_file, bam_file, name, threads, allow_multimap, stranded, Debug):
+def get_counts_gene(path, gtf_file, bam_file, name, threads, allow_multimap, stranded, Debug, compress=False):
 
-	out_file = featurecounts_call(path, gtf_file, bam_file, name, threads, allow_multimap, stranded, 'Gene Count', Debug)
+	out_file = featurecounts_call(path, gtf_file, bam_file, name, threads, allow_multimap, stranded, 'Gene Count', Debug, compress)
 	return(out_file)
 
 	
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Parallel copy and merge of sequencing files.
+
+Each destination file is generated from one (copy) or several (merge) source
+files using large buffers. The MD5 checksum is calculated while data is
+copied, so files are only read once. If checksums are not required, data is
+copied within the kernel (``copy_file_range`` or ``sendfile``).
+
+Files are written as ``<file>.part`` and renamed once finished. Completed
+transfers are recorded in a manifest, so an interrupted transfer is resumed:
+finished files are skipped and partial copies continue from the last byte
+written. Size and modification time of the source are stored next to the
+partial copy (``<file>.part.json``): if the source changed, the copy starts
+again.
+"""
+## useful imports
+import os
+import json
+import time
+import hashlib
+import threading
+import concurrent.futures
+from termcolor import colored
+
+## 16 Mb buffer
+buffer_size = 16*1024*1024
+
+## lock to update the manifest from several threads
+manifest_lock = threading.Lock()
+
+############################################################
+def source_stat(files):
+    """Size and modification time for each source file"""
+    return ([ [os.path.abspath(f), os.path.getsize(f), os.stat(f).st_mtime_ns] for f in files ])
+
+############################################################
+def read_manifest(manifest_file):
+    """Returns transfers completed previously (destination: details)"""
+    if manifest_file and os.path.isfile(manifest_file):
+        try:
+            with open(manifest_file) as manifest_hd:
+                return (json.load(manifest_hd))
+        except ValueError:
+            pass
+    return ({})
+
+############################################################
+def read_part_info(part_file):
+    """Source files (see source_stat) of a partial copy, or None if not available"""
+    try:
+        with open(part_file + '.json') as info_hd:
+            return (json.load(info_hd))
+    except (OSError, ValueError):
+        return (None)
+
+############################################################
+def write_part_info(part_file, stats):
+    """Stores source files (see source_stat) of a partial copy"""
+    with open(part_file + '.json', 'w') as info_hd:
+        json.dump(stats, info_hd)
+
+############################################################
+def update_manifest(manifest_file, manifest, result):
+    """Adds a completed transfer to the manifest and writes it to disk"""
+    if not manifest_file:
+        return
+    with manifest_lock:
+        manifest[result['destination']] = result
+        tmp_file = manifest_file + '.tmp'
+        with open(tmp_file, 'w') as manifest_hd:
+            json.dump(manifest, manifest_hd, indent=4)
+        os.replace(tmp_file, manifest_file)
+
+############################################################
+def kernel_copy(src_hd, dst_hd, size):
+    """Copies size bytes from the current position of src_hd to dst_hd within the kernel, if possible.
+
+    :returns: True if copied, False if not supported (nothing copied)
+    """
+    src_fd = src_hd.fileno()
+    dst_fd = dst_hd.fileno()
+    for method in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, method):
+            continue
+        copied = 0
+        try:
+            while copied < size:
+                if method == 'copy_file_range':
+                    sent = os.copy_file_range(src_fd, dst_fd, min(size - copied, 1024*buffer_size))
+                else:
+                    sent = os.sendfile(dst_fd, src_fd, None, min(size - copied, 1024*buffer_size))
+                if sent == 0:
+                    break
+                copied += sent
+        except OSError:
+            if copied:
+                raise
+            continue
+        return (True)
+    return (False)
+
+############################################################
+def buffer_copy(src_hd, dst_hd, checksum=None):
+    """Copies src_hd into dst_hd using a large buffer, updating the checksum with data copied"""
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    copied = 0
+    while True:
+        size = src_hd.readinto(buffer)
+        if not size:
+            break
+        dst_hd.write(view[:size])
+        if checksum:
+            checksum.update(view[:size])
+        copied += size
+    return (copied)
+
+############################################################
+def transfer(sources, destination, checksum=True, manifest=None, manifest_file=None):
+    """Copies or concatenates (merge) source files into destination.
+
+    :param sources: List of source files. Several files are concatenated in the order given.
+    :param destination: Destination file
+    :param checksum: Calculate MD5 of the destination file
+    :param manifest: Transfers completed previously (see read_manifest)
+    :param manifest_file: File to record transfers completed
+
+    :type sources: list
+    :type destination: string
+    :type checksum: boolean
+    :type manifest: dict
+    :type manifest_file: string
+
+    :returns: Dictionary with sources, destination, size, seconds, MB/s, md5 and status (done, copied, resumed)
+    """
+    start_time = time.time()
+    if manifest is None:
+        manifest = {}
+    destination = os.path.abspath(destination)
+    stats = source_stat(sources)
+    total_size = sum(s[1] for s in stats)
+
+    ## completed previously with the same sources
+    previous = manifest.get(destination)
+    if (previous and previous['sources'] == stats and os.path.isfile(destination)
+            and os.path.getsize(destination) == total_size and (previous['md5'] or not checksum)):
+        return (dict(previous, status='done', seconds=0, MBps=0))
+
+    ## resume partial copy of a single file, if source did not change
+    part_file = destination + '.part'
+    offset = 0
+    status = 'copied'
+    md5 = hashlib.md5() if checksum else None
+    if (len(sources) == 1 and os.path.isfile(part_file) and os.path.getsize(part_file) <= total_size
+            and read_part_info(part_file) == stats):
+        offset = os.path.getsize(part_file)
+        status = 'resumed'
+        if md5:
+            with open(part_file, 'rb') as part_hd:
+                for block in iter(lambda: part_hd.read(buffer_size), b''):
+                    md5.update(block)
+    else:
+        write_part_info(part_file, stats)
+
+    with open(part_file, 'ab' if offset else 'wb') as dst_hd:
+        for source, size, mtime in stats:
+            with open(source, 'rb') as src_hd:
+                if offset:
+                    src_hd.seek(offset)
+                ## data buffered must be written before copying within the kernel
+                dst_hd.flush()
+                if md5 or not kernel_copy(src_hd, dst_hd, size - offset):
+                    buffer_copy(src_hd, dst_hd, md5)
+
+    if os.path.getsize(part_file) != total_size:
+        raise IOError("Size of %s does not match source files" %part_file)
+    os.rename(part_file, destination)
+    os.remove(part_file + '.json')
+
+    seconds = time.time() - start_time
+    result = {
+        'sources': stats,
+        'destination': destination,
+        'size': total_size,
+        'md5': md5.hexdigest() if md5 else "",
+        'seconds': round(seconds, 2),
+        'MBps': round((total_size - offset) / 1024 / 1024 / seconds, 2) if seconds else 0,
+        'status': status,
+    }
+    update_manifest(manifest_file, manifest, result)
+    return (result)
+
+############################################################
+def transfer_files(jobs, threads, manifest_file=None, checksum=True, Debug=False):
+    """Copies or merges files in parallel using a bounded pool of threads.
+
+    :param jobs: List of (list of source files, destination file)
+    :param threads: Number of files transferred at the same time
+    :param manifest_file: File recording transfers completed, used to resume
+    :param checksum: Calculate MD5 for each destination file
+    :param Debug: Show debugging messages
+
+    :returns: List of results for each job (see transfer), in the same order as jobs provided
+    """
+    manifest = read_manifest(manifest_file)
+    results = [None] * len(jobs)
+    start_time = time.time()
+
+    ## largest files first
+    order = sorted(range(len(jobs)), key=lambda num: -sum(os.path.getsize(f) for f in jobs[num][0]))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(int(threads), 1)) as executor:
+        commandsSent = { executor.submit(transfer, jobs[num][0], jobs[num][1], checksum, manifest, manifest_file): num for num in order }
+        for cmd2 in concurrent.futures.as_completed(commandsSent):
+            num = commandsSent[cmd2]
+            try:
+                results[num] = cmd2.result()
+                if Debug:
+                    print (colored("**DEBUG: %s: %s (%s MB/s) **" %(results[num]['status'], results[num]['destination'], results[num]['MBps']), 'yellow'))
+            except Exception as exc:
+                print ('***ERROR:')
+                print (cmd2)
+                print('%r generated an exception: %s' % (jobs[num][1], exc))
+
+    ## summary
+    done = [ r for r in results if r ]
+    size = sum(r['size'] for r in done if r['status'] != 'done')
+    seconds = time.time() - start_time
+    print ("+ %s files transferred (%s already available): %.2f GB in %.1f seconds (%.1f MB/s)" %(
+        len(done), len([ r for r in done if r['status'] == 'done' ]), size / 1024**3, seconds, size / 1024**2 / seconds if seconds else 0))
+
+    return (results)
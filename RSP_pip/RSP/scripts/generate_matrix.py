@@ -1,37 +1,163 @@
-
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Generates count matrices from featureCounts-like results of several samples.
+"""
+import concurrent.futures
+import numpy as np
 import pandas as pd
+from termcolor import colored
 
+from RSP.scripts import compression
 
 ############################################################
-def generate_matrix(dict_files, index_name, Debug=False):
-	######################################################
-	### For a dictionary containing names as keys and files as values, 
-	###	generates a count matrix with the classification from featurecounts
-	###		
-	### It returns a dataframe containing for each index generated
-	### count values for each sample (sample_name) in columns
-	###
-	#########################################################
-	all_data = pd.DataFrame()
-	for key,values in dict_files.items():
-		print ('+ Reading information from sample: ', key)	
-		#print ('+ File: ' + values)
-
-		## check if file values exists
-		data = pd.read_csv(values, sep='\t', skiprows=1)
-		if Debug:
-			print ("\n**DEBUG: values content file **")
-			print (data)
-		
-		## skip if file is empty
-		if data.empty:
+def get_header(file_given, index_name):
+	"""Retrieves header information for a featureCounts-like file
+
+	Comment lines (starting with '#', e.g. featureCounts program line) are skipped.
+	If the first line does not contain the index_name provided, the file is considered
+	to have no header: first column contains IDs and last column contains counts.
+
+	:param file_given: Absolute path to the file (plain or gzip compressed)
+	:param index_name: Name of the column containing the IDs
+
+	:returns: Tuple containing (number of lines to skip, column names or None, column for counts)
+	"""
+	skip = 0
+	with compression.open_file(file_given) as in_file:
+		for line in in_file:
+			if line.startswith('#'):
+				skip += 1
+				continue
+
+			columns = line.rstrip('\n').split('\t')
+			if index_name in columns:
+				return (skip, columns, columns[-1])
+
+			## no header: ID + ... + count
+			return (skip, None, len(columns) - 1)
+
+	## empty file
+	return (skip, None, None)
+
+############################################################
+def read_counts(file_given, index_name, read_index=True):
+	"""Reads the counts column (and IDs if desired) of a featureCounts-like file
+
+	Only the columns required are parsed, avoiding Chr/Start/End/Strand/Length
+	columns that might be large for multi-exon genes.
+
+	:param file_given: Absolute path to the file
+	:param index_name: Name of the column containing the IDs
+	:param read_index: Retrieve the IDs column or only the counts.
+
+	:returns: Tuple containing (IDs or None, counts numpy array). (None, None) if empty.
+	"""
+	(skip, columns, count_col) = get_header(file_given, index_name)
+	if count_col is None:
+		return (None, None)
+
+	if columns:
+		usecols = [index_name, count_col] if read_index else [count_col]
+		data = pd.read_csv(file_given, sep='\t', skiprows=skip, usecols=usecols)
+	else:
+		usecols = [0, count_col] if read_index else [count_col]
+		data = pd.read_csv(file_given, sep='\t', skiprows=skip, header=None, usecols=usecols)
+		data.columns = [index_name, count_col][-len(usecols):]
+
+	if data.empty:
+		return (None, None)
+
+	counts = data[count_col].to_numpy()
+	if read_index:
+		return (data[index_name].to_numpy(), counts)
+	return (None, counts)
+
+############################################################
+def generate_matrix(dict_files, index_name, Debug=False, threads=2):
+	"""Generates a count matrix for all the samples provided
+
+	For a dictionary containing names as keys and files as values,
+	generates a count matrix with the classification from featurecounts.
+
+	Files are parsed in parallel and a int32 matrix (IDs x samples) is filled column
+	by column. IDs of each sample are compared with IDs of the first sample: samples
+	with different or reordered IDs are aligned to the union of IDs (missing values as NaN).
+	Samples that could not be read are reported as failed (see attribute 'failed').
+
+	:param dict_files: Dictionary containing sample names as keys and files as values
+	:param index_name: Name of the column containing the IDs, e.g. Geneid
+	:param Debug: True/False for debugging messages
+	:param threads: Number of files to parse in parallel
+
+	:returns: Dataframe containing for each index generated count values for each sample (sample_name) in columns
+	"""
+	## read IDs and counts for all samples in parallel
+	results = {}
+	failed = []
+	with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(threads))) as executor:
+		commandsSent = { executor.submit(read_counts, values, index_name): key for key, values in dict_files.items() }
+		for cmd2 in concurrent.futures.as_completed(commandsSent):
+			key = commandsSent[cmd2]
+			try:
+				results[key] = cmd2.result()
+			except Exception as exc:
+				print (colored('** ERROR: counts could not be read for sample %s: %s' %(key, exc), 'red'))
+				failed.append(key)
+
+	## keep order provided; skip empty files
+	sample_names = []
+	for key in dict_files:
+		print ('+ Reading information from sample: ', key)
+		if results.get(key, (None, None))[1] is None:
 			continue
+		sample_names.append(key)
+
+	if failed:
+		print (colored('** ERROR: %s sample(s) failed and are not included in the count matrix: %s' %(len(failed), ", ".join(sorted(failed))), 'red'))
+
+	## no data available
+	if not sample_names:
+		all_data = pd.DataFrame()
+		all_data.attrs['failed'] = failed
+		return (all_data)
+
+	## reference IDs from first sample
+	ref_index = results[sample_names[0]][0]
+	misaligned = [ key for key in sample_names if not np.array_equal(results[key][0], ref_index) ]
+
+	if not misaligned:
+		## fill preallocated matrix
+		all_counts = np.zeros((len(ref_index), len(sample_names)), dtype=np.int32)
+		for pos, key in enumerate(sample_names):
+			all_counts[:, pos] = results[key][1]
+		all_data = pd.DataFrame(all_counts, index=pd.Index(ref_index, name=index_name), columns=sample_names)
+	else:
+		## samples with different IDs: align to the union of IDs
+		if Debug:
+			print ("\n**DEBUG: samples with different IDs **")
+			print (misaligned)
+
+		all_index = pd.Index(ref_index)
+		for key in misaligned:
+			all_index = all_index.append(pd.Index(results[key][0]).difference(all_index))
+		all_counts = np.full((len(all_index), len(sample_names)), np.nan)
+		for pos, key in enumerate(sample_names):
+			all_counts[all_index.get_indexer(results[key][0]), pos] = results[key][1]
+		all_data = pd.DataFrame(all_counts, index=all_index.rename(index_name), columns=sample_names)
+		## same IDs in a different order: no missing values
+		if not np.isnan(all_counts).any():
+			all_data = all_data.astype(np.int32)
+	all_data.attrs['failed'] = failed
 
-		## get info, generate unique name and merge for samples
-		data = data.set_index(index_name)
-		data = data.iloc[:,-1:] ## subset
-		data.columns = [*data.columns[:-1], key] ## rename
-		all_data = pd.concat([all_data, data], axis=1, sort=True)
+	if Debug:
+		print ("\n**DEBUG: all_data **")
+		print (all_data)
 
-	return (all_data)
+	return (all_data.sort_index())
 	##
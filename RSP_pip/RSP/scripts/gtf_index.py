@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Interval index of GTF features (e.g. exons) for counting reads.
+
+The GTF file is parsed once and features are stored as NumPy arrays sorted by
+chromosome, length class (powers of two) and start position. Features of the
+same class have similar lengths, so the features overlapping an interval are
+within a range of start positions found using a binary search
+(``np.searchsorted``), whatever the length of other features. Overlaps for many
+intervals (e.g. all aligned blocks of a chunk of reads) are found at once.
+
+The index is saved in a folder and loaded using memory-mapped arrays, so many
+processes counting reads share the same pages in memory. It is generated only
+once for each GTF file (content), feature type and attribute.
+"""
+## useful imports
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import functools
+import numpy as np
+from termcolor import colored
+
+## import my modules
+from RSP.scripts import result_cache
+from RSP.scripts import index_registry
+
+## change to rebuild indexes generated with a previous format
+index_format = 2
+
+## strand codes
+strand_code = {'+': 1, '-': -1, '.': 0}
+
+############################################################
+def index_key(gtf_file, feature_type, attribute):
+    """Key for the GTF index: content of the GTF, feature type and attribute"""
+    digest = result_cache.file_digest(os.path.abspath(gtf_file))
+    key_string = json.dumps({'digest': digest, 'feature_type': feature_type,
+                             'attribute': attribute, 'format': index_format}, sort_keys=True)
+    return (hashlib.sha256(key_string.encode()).hexdigest()[:16])
+
+############################################################
+def default_folder(gtf_file, alternative_folder):
+    """Folder to store GTF indexes: next to the GTF file if writable, otherwise the alternative folder provided"""
+    gtf_folder = os.path.dirname(os.path.abspath(gtf_file))
+    if os.access(gtf_folder, os.W_OK):
+        return (os.path.join(gtf_folder, '.' + os.path.basename(gtf_file) + '_RSP_index'))
+    return (alternative_folder)
+
+############################################################
+def parse_gtf(gtf_file, feature_type, attribute):
+    """Reads features of the type given from a GTF file.
+
+    :param gtf_file: GTF file
+    :param feature_type: Feature type (3rd column) to retrieve, e.g. exon
+    :param attribute: Attribute to group features into meta-features, e.g. gene_id
+
+    :returns: (list of chromosome, start, end, strand, meta-feature index; list of meta-feature ids)
+    """
+    attribute_regex = re.compile(attribute + r' "([^"]*)"')
+    features = []
+    genes = {}
+    gene_ids = []
+
+    with open(gtf_file) as gtf_hd:
+        for line in gtf_hd:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t', 8)
+            if len(fields) < 9 or fields[2] != feature_type:
+                continue
+
+            match = attribute_regex.search(fields[8])
+            if not match:
+                continue
+
+            gene = match.group(1)
+            if gene not in genes:
+                genes[gene] = len(gene_ids)
+                gene_ids.append(gene)
+
+            features.append((fields[0], int(fields[3]), int(fields[4]), strand_code.get(fields[6], 0), genes[gene]))
+
+    return (features, gene_ids)
+
+############################################################
+def merged_length(intervals):
+    """Total length of the union of intervals (1-based, inclusive)"""
+    total = 0
+    current_start, current_end = None, None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end + 1:
+            if current_end is not None:
+                total += current_end - current_start + 1
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start + 1
+    return (total)
+
+############################################################
+def write_index(folder, features, gene_ids):
+    """Saves arrays, meta-feature annotation (featureCounts columns) and chromosome offsets in the folder given"""
+    ## meta-feature annotation columns: Geneid Chr Start End Strand Length
+    strand_char = {1: '+', -1: '-', 0: '.'}
+    gene_features = [ [] for gene in gene_ids ]
+    for chrom, start, end, strand, gene in features:
+        gene_features[gene].append((chrom, start, end, strand))
+
+    with open(os.path.join(folder, 'genes.tsv'), 'w') as genes_hd:
+        for gene, gene_list in zip(gene_ids, gene_features):
+            genes_hd.write("\t".join([gene,
+                                      ";".join(f[0] for f in gene_list),
+                                      ";".join(str(f[1]) for f in gene_list),
+                                      ";".join(str(f[2]) for f in gene_list),
+                                      ";".join(strand_char[f[3]] for f in gene_list),
+                                      str(merged_length([(f[1], f[2]) for f in gene_list]))]) + "\n")
+
+    ## sort features by chromosome, length class and start
+    chroms = sorted(set(f[0] for f in features))
+    chrom_rank = { chrom: num for num, chrom in enumerate(chroms) }
+    chrom_num = np.array([chrom_rank[f[0]] for f in features], dtype=np.int64)
+    starts = np.array([f[1] for f in features], dtype=np.int64)
+    ends = np.array([f[2] for f in features], dtype=np.int64)
+    strands = np.array([f[3] for f in features], dtype=np.int8)
+    genes = np.array([f[4] for f in features], dtype=np.int32)
+
+    length_class = np.floor(np.log2(np.maximum(ends - starts + 1, 1))).astype(np.int64)
+    order = np.lexsort((ends, starts, length_class, chrom_num))
+    (chrom_num, length_class, starts, ends, strands, genes) = (array[order] for array in (chrom_num, length_class, starts, ends, strands, genes))
+
+    ## a bin for each chromosome and length class: first and last feature and maximum length
+    new_bin = np.ones(len(starts), dtype=bool)
+    new_bin[1:] = (chrom_num[1:] != chrom_num[:-1]) | (length_class[1:] != length_class[:-1])
+    bin_low = np.flatnonzero(new_bin)
+    bin_high = np.append(bin_low[1:], len(starts))
+    max_length = np.maximum.reduceat(ends - starts + 1, bin_low)
+    bins = np.column_stack((bin_low, bin_high, max_length)).astype(np.int64)
+
+    ## binary search key: bin and start
+    bin_num = np.cumsum(new_bin) - 1
+    keys = (bin_num << 32) + starts
+
+    ## bins for each chromosome
+    offsets = {}
+    bin_chrom = chrom_num[bin_low]
+    for num, chrom in enumerate(chroms):
+        chrom_bins = np.flatnonzero(bin_chrom == num)
+        offsets[chrom] = [int(chrom_bins[0]), int(chrom_bins[-1]) + 1]
+
+    for name, array in (('starts', starts), ('ends', ends), ('strands', strands), ('genes', genes), ('keys', keys), ('bins', bins)):
+        np.save(os.path.join(folder, name + '.npy'), array)
+
+    return (offsets)
+
+############################################################
+def build_index(gtf_file, folder, feature_type="exon", attribute="gene_id", Debug=False):
+    """Returns folder containing the index for the GTF file, building it if not available.
+
+    The index is built in a temporary folder and moved into place once finished. Concurrent
+    calls for the same GTF wait for the first one to finish.
+
+    :param gtf_file: GTF file
+    :param folder: Main folder to store indexes
+    :param feature_type: Feature type to use, e.g. exon
+    :param attribute: Attribute grouping features, e.g. gene_id or transcript_biotype
+    :param Debug: Show debugging messages
+
+    :returns: Folder containing the index
+    """
+    gtf_file = os.path.abspath(gtf_file)
+    os.makedirs(folder, exist_ok=True)
+    key = index_key(gtf_file, feature_type, attribute)
+    index_folder = os.path.join(folder, feature_type + '_' + attribute + '_' + key)
+
+    with index_registry.file_lock(os.path.join(folder, '.' + key + '.lock')):
+        if os.path.isfile(os.path.join(index_folder, 'index_info.json')):
+            print ("+ GTF index available: " + index_folder)
+            return (index_folder)
+
+        print ("+ Generating GTF index (%s, %s) for file: %s" %(feature_type, attribute, gtf_file))
+        start_time = time.time()
+        tmp_folder = tempfile.mkdtemp(prefix='.tmp_' + key + '_', dir=folder)
+        try:
+            (features, gene_ids) = parse_gtf(gtf_file, feature_type, attribute)
+            if not features:
+                print (colored("** ERROR: No features %s with attribute %s in GTF file: %s" %(feature_type, attribute, gtf_file), 'red'))
+                exit()
+
+            offsets = write_index(tmp_folder, features, gene_ids)
+            info = { 'gtf': gtf_file, 'key': key, 'feature_type': feature_type, 'attribute': attribute,
+                     'format': index_format, 'features': len(features), 'genes': len(gene_ids),
+                     'chromosomes': offsets, 'date': time.strftime("%Y/%m/%d %H:%M:%S"),
+                     'build_time': round(time.time() - start_time, 2) }
+            with open(os.path.join(tmp_folder, 'index_info.json'), 'w') as info_hd:
+                json.dump(info, info_hd, indent=4)
+
+            os.rename(tmp_folder, index_folder)
+        finally:
+            if os.path.isdir(tmp_folder):
+                shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    if (Debug):
+        print (colored("**DEBUG: GTF index: %s features; %s genes **" %(info['features'], info['genes']), 'yellow'))
+
+    print ("+ GTF index generated in %.1f seconds: %s" %(time.time() - start_time, index_folder))
+    return (index_folder)
+
+############################################################
+@functools.lru_cache(maxsize=4)
+def load_index(index_folder):
+    """Loads the index (memory-mapped arrays) from the folder given. Cached for each process.
+
+    :returns: Dictionary containing info, arrays and gene_ids
+    """
+    with open(os.path.join(index_folder, 'index_info.json')) as info_hd:
+        info = json.load(info_hd)
+
+    index = {'info': info, 'folder': index_folder}
+    for name in ('starts', 'ends', 'strands', 'genes', 'keys', 'bins'):
+        index[name] = np.load(os.path.join(index_folder, name + '.npy'), mmap_mode='r')
+    return (index)
+
+############################################################
+def chromosome_ids(index, chrom_names):
+    """Position of each chromosome name in the index (-1 if not annotated)"""
+    chrom_pos = { chrom: num for num, chrom in enumerate(index['info']['chromosomes']) }
+    return (np.array([ chrom_pos.get(chrom, -1) for chrom in chrom_names ], dtype=np.int64))
+
+############################################################
+def expand_ranges(low, high):
+    """Expands ranges [low, high) into (range number, position) for each position"""
+    size = np.maximum(high - low, 0)
+    range_num = np.repeat(np.arange(len(low)), size)
+    first = np.cumsum(size) - size
+    position = np.repeat(low, size) + np.arange(int(size.sum())) - np.repeat(first, size)
+    return (range_num, position)
+
+############################################################
+def overlaps(index, chroms, starts, ends):
+    """Features overlapping the intervals given (1-based, inclusive).
+
+    :param index: GTF index (see load_index)
+    :param chroms: Array of chromosome positions (see chromosome_ids)
+    :param starts: Array of interval starts
+    :param ends: Array of interval ends
+
+    :returns: (array of interval positions, array of feature positions) for each overlap
+    """
+    chroms = np.asarray(chroms, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    ## bins of the chromosome for each interval
+    chrom_bins = np.array(list(index['info']['chromosomes'].values()), dtype=np.int64).reshape(-1, 2)
+    query = np.flatnonzero(chroms >= 0)
+    (query_num, bin_num) = expand_ranges(chrom_bins[chroms[query], 0], chrom_bins[chroms[query], 1])
+    query = query[query_num]
+
+    ## features of each bin starting at most max_length - 1 bases before the interval
+    bins = index['bins']
+    low = np.searchsorted(index['keys'], (bin_num << 32) + np.maximum(starts[query] - bins[bin_num, 2] + 1, 0), side='left')
+    high = np.searchsorted(index['keys'], (bin_num << 32) + ends[query], side='right')
+    (range_num, feature) = expand_ranges(low, high)
+    query = query[range_num]
+
+    found = index['ends'][feature] >= starts[query]
+    return (query[found], feature[found])
@@ -17,6 +17,7 @@ from sys import argv
 from termcolor import colored
 
 import os 
+import time
 import argparse
 import glob
 
@@ -39,24 +40,64 @@ def hisat2_index(path_reference, reference_genome, index, threads, Debug):
         return(index_abs_path)
     
     else: #if there is no .ht2 in the path_reference --> build index 
-        
-        hisat2_build = set_config.get_exe('hisat2-build')
-
-        reference_abs_path = reference_genome #path reference genome
         index_abs_path = os.path.join(path_reference, index) #path index
-        indexing = hisat2_build + ' -p ' + str(threads) + ' ' + reference_abs_path + ' ' + index_abs_path #bash command 
         print("Path to the index:", index_abs_path) 
-
-        ## system call & return
-        code = HCGB_sys.system_call(indexing, False, True)
+        hisat2_build(path_reference, reference_genome, index, threads, "", Debug)
         return(index_abs_path)
 
+####BUILD INDEX FUNCTION#####################################################################################################################
+def hisat2_build(path_reference, reference_genome, index, threads, extra_index, Debug):
+    """Builds HISAT2 index for the reference genome provided
+
+    :param path_reference: Folder to store index files
+    :param reference_genome: Reference genome in fasta format
+    :param index: Index name (prefix of the index files)
+    :param threads: Number of threads
+    :param extra_index: Additional options to include in the index call
+    :param Debug: Print debugging messages or not
+
+    :returns: Code returned by system call: OK/FAIL
+    """
+    hisat2_build_exe = set_config.get_exe('hisat2-build')
+
+    index_abs_path = os.path.join(path_reference, index) #path index
+    indexing = hisat2_build_exe + ' -p ' + str(threads) + ' ' #bash command 
+    if extra_index:
+        indexing = indexing + extra_index + ' '
+    indexing = indexing + reference_genome + ' ' + index_abs_path
+
+    if (Debug):
+        print (colored("**DEBUG: hisat2-build call **", 'yellow'))
+        print (indexing)
+
+    ## system call & return
+    code = HCGB_sys.system_call(indexing, False, True)
+    return(code)
+
 ####MAPPING FUNCTION#########################################################################################################################
-def hisat2_mapping(sample_name, index_path_reference, reads_list, output, threads, extra_params, Debug):
-        
+## sorted BAM generated for each sample: same name as STAR
+bam_file_name = "Aligned.sortedByCoord.out.bam"
+
+def hisat2_mapping(sample_name, index_path_reference, reads_list, output, threads, extra_params, Debug, sort_memory="768M"):
+    """Maps reads using HISAT2 and sends alignments directly to samtools sort: no SAM file is generated.
+
+    Generates sorted and indexed BAM file (see bam_file_name) and a throughput summary.
+
+    :param sample_name: Sample name
+    :param index_path_reference: HISAT2 index prefix
+    :param reads_list: List of reads (one: single-end; two: paired-end)
+    :param output: Output folder
+    :param threads: Number of threads for HISAT2 and samtools sort
+    :param extra_params: Additional parameters for HISAT2
+    :param Debug: Print debugging messages or not
+    :param sort_memory: Maximum memory per thread for samtools sort, e.g. 768M
+
+    :returns: Code: OK/FAIL
+    """
+    start_time = time.time()
     outputs_name = sample_name #variable that will go through the functions, sample name
     path_results = os.path.join(output, outputs_name)
-    path_sam = path_results + ".sam" # safe sam in results folder
+    path_bam = os.path.join(output, bam_file_name)
     errLog = path_results + ".err" 
     outLog = path_results + ".log" 
     outSummary = path_results + ".summary"
@@ -82,16 +123,6 @@ def hisat2_mapping(sample_name, index_path_reference, reads_list, output, thread
         #hisat2 paired end mapping command
         mapping = hisat2 + " -x " + index_path_reference + " -p " + str(threads) 
         mapping = mapping + " -1 " + read1 + " -2 " + read2 
-        mapping = mapping + " -S " + path_sam
-        mapping = mapping + " --rg-id " + sample_name + ' --rg ' + sample_name
-        mapping = mapping + " --new-summary --summary-file " + outSummary
-        mapping = mapping + extra_params
-        mapping = mapping + " > " +  outLog + " 2> " + errLog
-        
-        ## system call & return
-        code = HCGB_sys.system_call(mapping, False, True)
-        return(code)
-        # samtools.sam_to_bam(path_results, path_sam, threads, Debug)
         
     else:
         print("Single-end analysis")
@@ -104,21 +135,50 @@ def hisat2_mapping(sample_name, index_path_reference, reads_list, output, thread
             print (colored("**DEBUG: single_read **", 'yellow'))
             print (single_read)
             
-            
         ## mapping call
         mapping = hisat2 + " -x " + index_path_reference + " -p " + str(threads) 
         mapping = mapping + " -U " + single_read
-        mapping = mapping + " -S " + path_sam 
-        mapping = mapping + " --rg-id " + sample_name + ' --rg ' + sample_name
-        mapping = mapping + " --new-summary --summary-file " + outSummary
-        mapping = mapping + extra_params
-        mapping = mapping + " > " +  outLog + " 2> " + errLog
-        
-        ## system call & return
-        code = HCGB_sys.system_call(mapping, False, True)
-        return(code)
 
-            
+    ## alignments to standard output: sorted by samtools
+    mapping = mapping + " --rg-id " + sample_name + ' --rg ' + sample_name
+    mapping = mapping + " --new-summary --summary-file " + outSummary
+    mapping = mapping + extra_params
+
+    ## system call & return
+    code = samtools.stream_to_sorted_bam(mapping, path_bam, threads, sort_memory, errLog, outLog, Debug)
+    if code != "OK":
+        return (code)
+
+    if not samtools.index_bam(path_bam, threads, "bai", Debug):
+        return ("FAIL")
+
+    throughput_summary(path_results, reads_list, path_bam, outSummary, time.time() - start_time)
+    return (code)
+
+####THROUGHPUT SUMMARY#########################################################################################################################
+def throughput_summary(path_results, reads_list, path_bam, outSummary, seconds):
+    """Writes throughput for the mapping (reads and Mb processed per second) in <sample>.throughput"""
+    ## total reads or pairs from HISAT2 summary
+    total_reads = 0
+    if os.path.isfile(outSummary):
+        with open(outSummary) as summary_hd:
+            for line in summary_hd:
+                if line.startswith("Total reads:") or line.startswith("Total pairs:"):
+                    total_reads = int(line.split(":")[1].strip())
+
+    input_size = sum(os.path.getsize(f) for f in reads_list) / 1024**2
+    bam_size = os.path.getsize(path_bam) / 1024**2
+    seconds = max(seconds, 0.01)
+    stats = [("seconds", round(seconds, 2)), ("reads", total_reads), ("reads_per_second", round(total_reads / seconds, 1)),
+             ("input_MB", round(input_size, 2)), ("input_MB_per_second", round(input_size / seconds, 2)), ("bam_MB", round(bam_size, 2))]
+
+    with open(path_results + ".throughput", 'w') as throughput_hd:
+        for key, value in stats:
+            throughput_hd.write("%s\t%s\n" %(key, value))
+
+    print ("+ HISAT2 mapping for %s: %s reads in %.1f seconds (%.0f reads/s; %.1f MB/s)" %(
+        os.path.basename(path_results), total_reads, seconds, total_reads / seconds, input_size / seconds))
+    return (path_results + ".throughput")
 
 ####MAIN FUNCTION##############################################################################################################################
 def main():
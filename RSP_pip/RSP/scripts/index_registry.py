@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Registry of reference genome indexes shared by several users and jobs.
+
+Each index is identified by a key generated from the content of the reference
+fasta (transcripts for salmon and kallisto, and decoy genome for salmon), the additional index options (``--extra_index``), the software version
+and the index name. Indexes are stored as::
+
+    <reference folder>/<software>/<index name>_<key>/
+    <reference folder>/registry.json
+
+Indexes are built in a temporary folder and renamed into place once finished,
+so an index folder is complete if it exists. A lock for each key makes
+concurrent jobs wait for the first build instead of starting a new one.
+"""
+## useful imports
+import os
+import glob
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+from termcolor import colored
+
+## import my modules
+from RSP.config import set_config
+from RSP.scripts import STAR_caller
+from RSP.scripts import hisat2
+from RSP.scripts import salmon
+from RSP.scripts import kallisto
+from RSP.scripts import result_cache
+
+## file describing each index, written before the index is moved into place
+index_info_file = 'index_info.json'
+
+############################################################
+@contextmanager
+def file_lock(lock_file):
+    """Exclusive lock on the file given. Waits until the lock is released by other processes."""
+    with open(lock_file, 'a') as lock_hd:
+        fcntl.flock(lock_hd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_hd, fcntl.LOCK_UN)
+
+############################################################
+def is_index(soft_name, folder, index_name):
+    """Checks whether a folder contains an index for the software given (not managed by the registry)
+
+    :param soft_name: Software name: star, hisat2, salmon or kallisto
+    :param folder: Folder containing the index
+    :param index_name: Index name (prefix of files for hisat2, file name for kallisto)
+
+    :returns: True/False
+    """
+    if soft_name == "star":
+        return (os.path.isfile(os.path.join(folder, "SA")) and os.path.isfile(os.path.join(folder, "genomeParameters.txt")))
+    elif soft_name == "hisat2":
+        return (len(glob.glob(os.path.join(folder, index_name + "*.ht2"))) > 0)
+    elif soft_name == "salmon":
+        return (os.path.isfile(os.path.join(folder, "versionInfo.json")) and os.path.isfile(os.path.join(folder, "info.json")))
+    elif soft_name == "kallisto":
+        return (os.path.isfile(os.path.join(folder, index_name + ".idx")))
+    return (False)
+
+############################################################
+def index_path(soft_name, folder, index_name):
+    """Path to provide to the mapping software: genomeDir for STAR, index prefix for HISAT2, index folder for salmon or index file for kallisto"""
+    if soft_name == "hisat2":
+        return (os.path.join(folder, index_name))
+    if soft_name == "kallisto":
+        return (os.path.join(folder, index_name + ".idx"))
+    return (folder)
+
+############################################################
+def build_star(folder, fasta_file, index_name, threads, extra_index, limitGenomeGenerateRAM, Debug, decoy_file=None):
+    """Builds STAR genomeDir in the folder given"""
+    STAR_exe = set_config.get_exe("STAR", Debug=Debug)
+    STAR_caller.create_genomeDir(folder, STAR_exe, threads, fasta_file, limitGenomeGenerateRAM, extra_index)
+    return (is_index("star", folder, index_name))
+
+############################################################
+def build_hisat2(folder, fasta_file, index_name, threads, extra_index, limitGenomeGenerateRAM, Debug, decoy_file=None):
+    """Builds HISAT2 index files in the folder given"""
+    code = hisat2.hisat2_build(folder, fasta_file, index_name, threads, extra_index, Debug)
+    return (code == 'OK' and is_index("hisat2", folder, index_name))
+
+############################################################
+def build_salmon(folder, fasta_file, index_name, threads, extra_index, limitGenomeGenerateRAM, Debug, decoy_file=None):
+    """Builds salmon index for the transcripts in the folder given: decoy-aware if the genome is provided"""
+    code = salmon.salmon_index(folder, fasta_file, threads, extra_index, Debug, genome_fasta=decoy_file)
+    return (code == 'OK' and is_index("salmon", folder, index_name))
+
+############################################################
+def build_kallisto(folder, fasta_file, index_name, threads, extra_index, limitGenomeGenerateRAM, Debug, decoy_file=None):
+    """Builds kallisto index for the transcripts in the folder given"""
+    code = kallisto.kallisto_index(index_path("kallisto", folder, index_name), fasta_file, extra_index, Debug)
+    return (code == 'OK' and is_index("kallisto", folder, index_name))
+
+## software: (executable to get version, build function)
+builders = {
+    'star': ('STAR', build_star),
+    'hisat2': ('hisat2-build', build_hisat2),
+    'salmon': ('salmon', build_salmon),
+    'kallisto': ('kallisto', build_kallisto),
+}
+
+############################################################
+def read_registry(path_reference):
+    """Returns the registry of indexes stored in the reference folder"""
+    registry_file = os.path.join(path_reference, 'registry.json')
+    registry = {'fasta': {}, 'indexes': {}}
+    if os.path.isfile(registry_file):
+        with open(registry_file) as registry_hd:
+            registry.update(json.load(registry_hd))
+    return (registry)
+
+############################################################
+def write_registry(path_reference, registry):
+    """Writes the registry of indexes. Lock on the registry must be held."""
+    registry_file = os.path.join(path_reference, 'registry.json')
+    tmp_file = registry_file + '.tmp'
+    with open(tmp_file, 'w') as registry_hd:
+        json.dump(registry, registry_hd, indent=4)
+    os.replace(tmp_file, registry_file)
+
+############################################################
+def index_key(soft_name, path_reference, fasta_file, index_name, extra_index, decoy_file=None):
+    """Generates the key for an index: fasta content (and decoys), extra index options, software version and index name.
+
+    Digests of fasta files are stored in the registry and only calculated again if the file changes.
+
+    :returns: (key, description of the index)
+    """
+    lock_file = os.path.join(path_reference, '.registry.lock')
+    with file_lock(lock_file):
+        registry = read_registry(path_reference)
+        fasta = result_cache.input_digests([fasta_file] + ([decoy_file] if decoy_file else []), registry['fasta'])
+        registry['fasta'].update(fasta)
+        write_registry(path_reference, registry)
+
+    (exe, version) = result_cache.tool_version(builders[soft_name][0])
+    info = {
+        'software': soft_name,
+        'version': str(version),
+        'index_name': index_name,
+        'fasta': os.path.abspath(fasta_file),
+        'fasta_digest': fasta[os.path.abspath(fasta_file)]['digest'],
+        'extra_index': extra_index if extra_index else "",
+    }
+    key_fields = ['software', 'version', 'index_name', 'fasta_digest', 'extra_index']
+    if decoy_file:
+        info['decoys'] = os.path.abspath(decoy_file)
+        info['decoys_digest'] = fasta[os.path.abspath(decoy_file)]['digest']
+        key_fields.append('decoys_digest')
+    key_string = json.dumps({ k: info[k] for k in key_fields }, sort_keys=True)
+    return (hashlib.sha256(key_string.encode()).hexdigest()[:16], info)
+
+############################################################
+def get_index(soft_name, path_reference, fasta_file, index_name, threads, extra_index, limitGenomeGenerateRAM, Debug, decoy_file=None):
+    """Returns index for the reference genome provided, building it if it is not available in the registry.
+
+    :param soft_name: Software name: star, hisat2, salmon or kallisto
+    :param path_reference: Reference folder containing the registry
+    :param fasta_file: Reference genome (or transcripts for salmon and kallisto) in fasta format
+    :param index_name: Index name
+    :param threads: Number of threads
+    :param extra_index: Additional options to include in the index call
+    :param limitGenomeGenerateRAM: limit RAM bytes to be used in the computation (STAR)
+    :param Debug: Print debugging messages or not
+    :param decoy_file: Reference genome used as decoy (salmon)
+
+    :type soft_name: string
+    :type path_reference: string
+    :type fasta_file: string
+    :type index_name: string
+    :type threads: int
+    :type extra_index: string
+    :type limitGenomeGenerateRAM: int
+    :type Debug: boolean
+    :type decoy_file: string
+
+    :returns: genomeDir (STAR), index prefix (HISAT2), index folder (salmon) or index file (kallisto)
+    """
+    path_reference = os.path.abspath(path_reference)
+    soft_folder = os.path.join(path_reference, soft_name)
+    os.makedirs(soft_folder, exist_ok=True)
+
+    (key, info) = index_key(soft_name, path_reference, fasta_file, index_name, extra_index, decoy_file)
+    index_folder = os.path.join(soft_folder, index_name + '_' + key)
+
+    if (Debug):
+        print (colored("**DEBUG: index key: " + key + " **", 'yellow'))
+        print (info)
+
+    ## unmanaged index from previous versions
+    if is_index(soft_name, soft_folder, index_name):
+        print (colored("+ Index in %s was not generated by the index registry. Provide it using --index_folder to use it." %soft_folder, 'yellow'))
+
+    ## wait for any other process building this index
+    with file_lock(os.path.join(soft_folder, '.' + index_name + '_' + key + '.lock')):
+        if os.path.isfile(os.path.join(index_folder, index_info_file)):
+            print ("+ Index available for %s: %s" %(soft_name, index_folder))
+            return (index_path(soft_name, index_folder, index_name))
+
+        ## build in temporary folder within the same filesystem
+        print ("+ Building %s index: %s" %(soft_name, index_folder))
+        tmp_folder = tempfile.mkdtemp(prefix='.tmp_' + index_name + '_' + key + '_', dir=soft_folder)
+        try:
+            start_time = time.time()
+            if not builders[soft_name][1](tmp_folder, fasta_file, index_name, threads, extra_index, limitGenomeGenerateRAM, Debug, decoy_file):
+                print (colored("** ERROR: %s failed to index genome provided..." %soft_name, 'red'))
+                exit()
+
+            info['key'] = key
+            info['date'] = time.strftime("%Y/%m/%d %H:%M:%S")
+            info['build_time'] = round(time.time() - start_time, 2)
+            with open(os.path.join(tmp_folder, index_info_file), 'w') as info_hd:
+                json.dump(info, info_hd, indent=4)
+
+            ## move into place: index available for everybody once renamed
+            os.rename(tmp_folder, index_folder)
+        finally:
+            if os.path.isdir(tmp_folder):
+                shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    ## register index
+    with file_lock(os.path.join(path_reference, '.registry.lock')):
+        registry = read_registry(path_reference)
+        registry['indexes'][key] = dict(info, folder=index_folder)
+        write_registry(path_reference, registry)
+
+    print ("+ Index available for %s: %s" %(soft_name, index_folder))
+    return (index_path(soft_name, index_folder, index_name))
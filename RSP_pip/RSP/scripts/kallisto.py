@@ -2,121 +2,238 @@
 ############################################################
 ## Author: Jose F. Sanchez & Mireia Marin                 ##
 ## Copyright (C) 2022                                     ##
-## High Content Genomics and Bioinformatics IGPT Unit     ## 
+## High Content Genomics and Bioinformatics IGPT Unit     ##
 ## Lauro Sumoy Lab, IGTP, Spain                           ##
 ############################################################
+"""
+Alignment-free quantification of transcripts using kallisto pseudoalignment.
 
+A single sample is quantified with ``kallisto quant``. Several samples are
+quantified in batch mode (``kallisto pseudo --quant -b batch.txt``, kallisto
+0.46 to 0.48), so the index is loaded once for the whole cohort: results are
+split into an ``abundance.tsv`` file for each sample, as generated by
+``kallisto quant``. If batch mode is not available, samples are quantified one
+by one.
+
+The fragment length distribution (``--fragment_length``, ``--fragment_sd``) is
+provided to kallisto for single and paired-end reads, and it is used to
+calculate effective lengths and TPM in batch mode, so TPM values are
+equivalent in both modes. Results for all samples are merged into transcript and gene matrices
+(see :mod:`RSP.scripts.quant_matrix`).
+"""
+## useful imports
 import os
-import argparse
+import json
+import numpy as np
+import pandas as pd
+from termcolor import colored
 
 ## import my modules
-from HCGB import functions
+import HCGB.functions.system_call_functions as HCGB_sys
+
 from RSP.config import set_config
-from RSP.scripts import samtools
-
-
-### INDEXING FUNCTION ###
-def kallisto_index(path_reference, reference_genome, index, kmers):
-
-    
-    reference_abs_path = os.path.join(path_reference, reference_genome) #path reference genome
-    index_abs_path = os.path.join(path_reference, index) #path index
-    
-    #check if the index has already been created
-    
-    if os.path.exists(index_abs_path) == False:
-        indexing = "kallisto index -i " + index_abs_path +" "+ path_reference #kmers option can be added
-
-        print("Indexing the transcriptome")
-        print("Path to the index:", index_abs_path)
-        print(indexing)
-        os.system(indexing)
-    
-    else:
-        print("Transcriptome is already indexed")
-        print("Path to the index:", index_abs_path)
-    
-def kallisto_quant(path_reference, index, reads_list, output, threads):
-    
-    path_index = os.path.join(path_reference, index) #path to the genome index
-    
-    #loop to check number of reads
-         
-    for i in reads_list: #for every list inside reads_list
-        if len(i) == 3: #if there are three elements it's a pair-end analysis
-            print("Pair-end analysis")
-            read1 = i[1] #reads forward 
-            read2 = i[2] #read reverse
-            outputs_name = i[0] #variable that will go through the functions, sample name
-                      
-            folder_results = os.path.join(output, outputs_name) #path to results folder + sample
-            os.mkdir(folder_results)
-            
-            path_results = os.path.join(folder_results, outputs_name)
-            
-            print ("Sample name", outputs_name, "\nRead forward:", read1, "\nRead reverse:", read2)
-
-            quant =  "kallisto quant -i " + path_index + " -t " + threads + " -o " + path_results +" "+ read1 + " " + read2 
-
-            print(quant)
-            
-            os.system(quant)
-            
-        else:
-            print("Single-end analysis")
-            single_read = i[1] #single end analysis
-            outputs_name = i[0] #variable that will go through the functions 
-            folder_results = os.path.join(output, outputs_name) #path to results folder + sample
-            os.mkdir(folder_results)
-            
-            path_results = os.path.join(folder_results, outputs_name)
-            
-            print ("Sample name", outputs_name, "\nSingle read:", single_read)
-            
-            quant = "kallisto quant -i " + path_index + " -t " + threads + " -o " + path_results + read1             
-            print(quant)
-            os.system(quamnt)
-           
-
-### MAIN FUNCTION ###  
-    
-def main():
-    
-    parser = argparse.ArgumentParser (description = 'Indexation and mapping using HISAT2') #all arguments are mandatory 
-    parser.add_argument('-p', '--path_reference', help = 'Directory where the reference genome is, it will be the index directory too ', required = "TRUE")
-    parser.add_argument('-g', '--reference_genome', help = 'Name of the file containing the reference genome', required = "TRUE")
-    parser.add_argument('-i', '--index', help= 'Name of the folder containing the index (it must be in the same path of the reference) or name you want to give to the folder that will be created to store the index', required = "TRUE")
-    parser.add_argument('-r', '--path_reads', help='Path to your txt with the format: $PATH/sample_name;$PATH/read1;$PATH/read or $PATH/sample_name;$PATH/read1. IT IS VERY IMPORTANT TO MANTAIN THE ORDER OF THE ELEMENTS AND THAT THEY ARE SEPARATED BY ;', required = "TRUE")
-    parser.add_argument('-o', '--output', help= 'Path where the outputs will be created', required = "TRUE")
-    parser.add_argument('-t', '--threads', type = int, help = 'Choose how many threads you want to use to execute HISAT2')
-    parser.add_argument ('-k', '--kmers', type = int, help = 'Desired k-mers length when indexing. Default: 31')
-        
-    args = parser.parse_args() #interprets the arguments 
-    
-    
-    
-    ## inputs for other functions (can't be called as args.)
-    
-    path_reference = args.path_reference
-    reference_genome = args.reference_genome
-    index = args.index
-    path_reads = args.path_reads
-    output = args.output 
-    threads = args.threads
-    kmers =args.kmers
-    
-  
-    lines = open(path_reads).readlines() #read the txt with the information of the reads 
-    reads_list = [] #empty list
-    for i in lines: #for every sample
-        reads_list.append(i.strip().split(';')) #split the different camps
-        
-    # lines.close() #close document
-        
-    print("Reads in main", reads_list)
-    
-    
-    
-if __name__ == '__main__':
-    main()
-    
+from RSP.scripts import compression
+from RSP.scripts import result_cache
+
+## quantification file generated for each sample
+quant_file_name = "abundance.tsv"
+
+####INDEXING FUNCTION########################################################################################################################
+def kallisto_index(index_file, transcriptome_fasta, extra_index, Debug):
+    """Builds kallisto index for the transcripts provided
+
+    :param index_file: Index file to generate
+    :param transcriptome_fasta: Transcript sequences in fasta format (cDNA)
+    :param extra_index: Additional options to include in the index call, e.g. -k 25
+    :param Debug: Print debugging messages or not
+
+    :returns: Code returned by system call: OK/FAIL
+    """
+    kallisto_exe = set_config.get_exe('kallisto')
+
+    indexing = kallisto_exe + ' index -i ' + index_file
+    if extra_index:
+        indexing = indexing + ' ' + extra_index
+    indexing = indexing + ' ' + transcriptome_fasta
+
+    if (Debug):
+        print (colored("**DEBUG: kallisto index call **", 'yellow'))
+        print (indexing)
+
+    ## system call & return
+    code = HCGB_sys.system_call(indexing, False, True)
+    return(code)
+
+####QUANTIFICATION FUNCTIONS#################################################################################################################
+def fragment_options(fragment_length, fragment_sd, single_end):
+    """Options for fragment length mean and standard deviation (and single-end reads)"""
+    options = ' -l ' + str(fragment_length) + ' -s ' + str(fragment_sd)
+    if single_end:
+        options = ' --single' + options
+    return (options)
+
+def kallisto_quant(sample_name, index_file, reads_list, output, threads, fragment_length, fragment_sd, Debug):
+    """Quantifies transcripts for a sample using kallisto quant
+
+    :param sample_name: Sample name
+    :param index_file: kallisto index
+    :param reads_list: List of reads (one: single-end; two: paired-end)
+    :param output: Output folder
+    :param threads: Number of threads
+    :param fragment_length: Fragment length mean
+    :param fragment_sd: Fragment length standard deviation
+    :param Debug: Print debugging messages or not
+
+    :returns: Code: OK/FAIL
+    """
+    kallisto_exe = set_config.get_exe('kallisto')
+    path_results = os.path.join(output, sample_name)
+
+    quant = kallisto_exe + ' quant -i ' + index_file + ' -o ' + output + ' -t ' + str(threads)
+    quant = quant + fragment_options(fragment_length, fragment_sd, len(reads_list) != 2)
+    quant = quant + ' ' + ' '.join(reads_list)
+    quant = quant + ' > ' + path_results + '.log 2> ' + path_results + '.err'
+
+    if (Debug):
+        print (colored("**DEBUG: kallisto quant call **", 'yellow'))
+        print (quant)
+
+    ## system call & return
+    code = HCGB_sys.system_call(quant, False, True)
+    if code != "OK" or not os.path.isfile(os.path.join(output, quant_file_name)):
+        print (colored("** ERROR: kallisto failed for sample %s. See %s" %(sample_name, path_results + '.err'), 'red'))
+        return ("FAIL")
+    return (code)
+
+def batch_available():
+    """Batch mode (kallisto pseudo --quant) is available for kallisto 0.46 to 0.48"""
+    (exe, version) = result_cache.tool_version('kallisto')
+    try:
+        version = tuple(int(v) for v in str(version).split('.')[:2])
+    except ValueError:
+        return (False)
+    return ((0, 46) <= version < (0, 50))
+
+def read_mtx(mtx_file, shape):
+    """Dense matrix from a MatrixMarket coordinate file: rows and columns as in shape (transposed if necessary)"""
+    entries = pd.read_csv(mtx_file, sep=r'\s+', comment='%', header=None)
+    (rows, cols) = entries.iloc[0, :2].astype(int)
+    entries = entries.iloc[1:]
+    matrix = np.zeros((rows, cols))
+    matrix[entries[0].to_numpy(dtype=np.int64) - 1, entries[1].to_numpy(dtype=np.int64) - 1] = entries[2].to_numpy(dtype=np.float64)
+    if (rows, cols) != tuple(shape):
+        matrix = matrix.T
+    return (matrix)
+
+def transcript_lengths(transcriptome_fasta):
+    """Length of each transcript in the fasta file"""
+    lengths = {}
+    name = None
+    with compression.open_file(transcriptome_fasta) as fasta_hd:
+        for line in fasta_hd:
+            if line.startswith('>'):
+                name = line[1:].split()[0]
+                lengths[name] = 0
+            elif name:
+                lengths[name] += len(line.rstrip())
+    return (lengths)
+
+def effective_lengths(length, fragment_length, fragment_sd):
+    """Effective length of each transcript as calculated by kallisto: length - mean fragment length + 1.
+
+    Fragment lengths follow a normal distribution truncated at the length of each
+    transcript. Transcripts with an effective length below 1 keep their length.
+    """
+    max_fragment = int(np.ceil(fragment_length + 5 * max(fragment_sd, 1)))
+    fragments = np.arange(1, max_fragment + 1, dtype=np.float64)
+    density = np.exp(-0.5 * ((fragments - fragment_length) / max(fragment_sd, 1e-6)) ** 2)
+    cum_density = np.concatenate(([0], np.cumsum(density)))
+    cum_fragments = np.concatenate(([0], np.cumsum(density * fragments)))
+
+    position = np.clip(np.nan_to_num(length).astype(np.int64), 0, max_fragment)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_fragment = cum_fragments[position] / cum_density[position]
+        eff_length = length - mean_fragment + 1
+    return (np.where(np.isnan(eff_length) | (eff_length < 1), length, eff_length))
+
+def kallisto_batch(samples, index_file, batch_folder, threads, fragment_length, fragment_sd, transcriptome_fasta, Debug):
+    """Quantifies transcripts for several samples loading the index once (kallisto pseudo --quant)
+
+    All samples must be either paired-end or single-end. Results are split into the
+    output folder of each sample (abundance.tsv and run_info.json). TPM values are
+    calculated using effective lengths, as kallisto quant.
+
+    :param samples: Dictionary containing sample names as keys and (reads list, output folder) as values
+    :param index_file: kallisto index
+    :param batch_folder: Folder to store batch file and results for all samples
+    :param threads: Number of threads
+    :param fragment_length: Fragment length mean
+    :param fragment_sd: Fragment length standard deviation
+    :param transcriptome_fasta: Transcripts used to generate the index (lengths)
+    :param Debug: Print debugging messages or not
+
+    :returns: List of samples quantified
+    """
+    kallisto_exe = set_config.get_exe('kallisto')
+    os.makedirs(batch_folder, exist_ok=True)
+    batch_file = os.path.join(batch_folder, 'batch.txt')
+    with open(batch_file, 'w') as batch_hd:
+        for name, (reads_list, output) in samples.items():
+            batch_hd.write(name + '\t' + '\t'.join(reads_list) + '\n')
+
+    ## single-end and paired-end reads can not be mixed
+    layouts = set(len(reads_list) == 2 for reads_list, output in samples.values())
+    if len(layouts) > 1:
+        print (colored("** ERROR: kallisto batch mode requires all samples either paired-end or single-end", 'red'))
+        return ([])
+
+    quant = kallisto_exe + ' pseudo --quant -i ' + index_file + ' -o ' + batch_folder + ' -t ' + str(threads) + ' -b ' + batch_file
+    quant = quant + fragment_options(fragment_length, fragment_sd, not layouts.pop())
+    quant = quant + ' > ' + os.path.join(batch_folder, 'kallisto.log') + ' 2> ' + os.path.join(batch_folder, 'kallisto.err')
+
+    if (Debug):
+        print (colored("**DEBUG: kallisto batch call **", 'yellow'))
+        print (quant)
+
+    print ("+ Quantifying %s samples using kallisto batch mode: index loaded once" %len(samples))
+    code = HCGB_sys.system_call(quant, False, True)
+    mtx_file = os.path.join(batch_folder, 'matrix.abundance.mtx')
+    if code != "OK" or not os.path.isfile(mtx_file):
+        print (colored("** ERROR: kallisto batch mode failed. See %s" %os.path.join(batch_folder, 'kallisto.err'), 'red'))
+        return ([])
+
+    ## samples x transcripts
+    with open(os.path.join(batch_folder, 'matrix.cells')) as cells_hd:
+        sample_names = [ line.strip() for line in cells_hd if line.strip() ]
+    with open(os.path.join(batch_folder, 'transcripts.txt')) as transcripts_hd:
+        transcripts = [ line.strip() for line in transcripts_hd if line.strip() ]
+    counts = read_mtx(mtx_file, (len(sample_names), len(transcripts)))
+
+    lengths = transcript_lengths(transcriptome_fasta)
+    length = np.array([ lengths.get(t, np.nan) for t in transcripts ], dtype=np.float64)
+    eff_length = effective_lengths(length, fragment_length, fragment_sd)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = counts / eff_length
+        tpm = np.nan_to_num(rate / np.nansum(rate, axis=1, keepdims=True) * 1e6)
+
+    ## information for the batch: reads processed are not available for each sample
+    run_info = {}
+    run_info_file = os.path.join(batch_folder, 'run_info.json')
+    if os.path.isfile(run_info_file):
+        with open(run_info_file) as info_hd:
+            run_info = { k: v for k, v in json.load(info_hd).items() if k in ('n_targets', 'kallisto_version', 'index_version', 'start_time', 'call') }
+
+    ## an abundance file for each sample (same columns as kallisto quant)
+    done = []
+    for pos, name in enumerate(sample_names):
+        if name not in samples:
+            continue
+        output = samples[name][1]
+        os.makedirs(output, exist_ok=True)
+        pd.DataFrame({ 'target_id': transcripts, 'length': length, 'eff_length': eff_length,
+                       'est_counts': counts[pos], 'tpm': tpm[pos] }).to_csv(os.path.join(output, quant_file_name), sep='\t', index=False, na_rep='NA')
+        with open(os.path.join(output, 'run_info.json'), 'w') as info_hd:
+            json.dump(dict(run_info, n_pseudoaligned=float(counts[pos].sum()), batch=batch_folder), info_hd, indent=4)
+        done.append(name)
+
+    return (done)
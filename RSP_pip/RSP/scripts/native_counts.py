@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Built-in counting of reads per meta-feature (e.g. gene) using a GTF index.
+
+Reads are assigned following featureCounts options used by RSP:
+
+- ``-p``: mates of a pair are counted once as a fragment.
+- ``-s 0/1/2``: unstranded, stranded or reversely stranded (strand of read 1).
+- ``-M``: multimapping alignments (NH > 1) are counted, otherwise not assigned.
+- ``-O``: fragments overlapping several meta-features are assigned to all of them.
+- ``--largestOverlap``: fragments are assigned to the meta-feature with the
+  largest number of overlapping bases.
+
+Results are written using featureCounts output format (``featureCount.out``
+and ``featureCount.out.summary``) so reports and count matrices do not change.
+"""
+## useful imports
+import os
+import time
+import numpy as np
+from termcolor import colored
+
+## import my modules
+from RSP.scripts import gtf_index
+from RSP.scripts import compression
+from RSP.scripts import result_cache
+from RSP.scripts import featurecounts
+from RSP import __version__ as pipeline_version
+
+## status reported by featureCounts in summary files
+summary_status = ['Assigned', 'Unassigned_Unmapped', 'Unassigned_Read_Type', 'Unassigned_Singleton',
+                  'Unassigned_MappingQuality', 'Unassigned_Chimera', 'Unassigned_FragmentLength',
+                  'Unassigned_Duplicate', 'Unassigned_MultiMapping', 'Unassigned_Secondary',
+                  'Unassigned_NonSplit', 'Unassigned_NoFeatures', 'Unassigned_Overlapping_Length',
+                  'Unassigned_Ambiguity']
+
+## attribute for each featureCounts mode
+mode_attribute = {'Gene Count': 'gene_id', 'RNAbiotype': 'transcript_biotype'}
+
+## fragments assigned at once
+chunk_size = 100000
+
+############################################################
+def read_blocks(read):
+    """Aligned blocks for a read: list of (start, end), 1-based and inclusive"""
+    return ([ (start + 1, end) for start, end in read.get_blocks() ])
+
+############################################################
+def assign_fragments(index, chroms, starts, ends, fragments, fragment_strands, stranded, allow_overlap, largest_overlap):
+    """Assigns fragments to meta-features. All aligned blocks of a chunk of fragments are processed at once.
+
+    :param index: GTF index (see gtf_index.load_index)
+    :param chroms: Chromosome of each block (see gtf_index.chromosome_ids)
+    :param starts: Start of each block
+    :param ends: End of each block
+    :param fragments: Fragment number of each block
+    :param fragment_strands: Strand of each fragment (according to read 1): 1 or -1
+    :param stranded: 0 (unstranded), 1 (stranded) or 2 (reversely stranded)
+    :param allow_overlap: Assign to all meta-features overlapping (-O)
+    :param largest_overlap: Assign to the meta-feature with largest overlap (--largestOverlap)
+
+    :returns: (NumPy array of counts for each meta-feature, dictionary of status counts)
+    """
+    n_genes = index['info']['genes']
+    n_fragments = len(fragment_strands)
+    fragments = np.asarray(fragments, dtype=np.int64)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+
+    (block, feature) = gtf_index.overlaps(index, chroms, starts, ends)
+    fragment = fragments[block]
+    gene = index['genes'][feature].astype(np.int64)
+
+    ## strand required for features
+    if stranded:
+        fragment_strand = np.asarray(fragment_strands, dtype=np.int8)[fragment]
+        if stranded == 2:
+            fragment_strand = -fragment_strand
+        strand = index['strands'][feature]
+        keep = (strand == 0) | (strand == fragment_strand)
+        (block, feature, fragment, gene) = (block[keep], feature[keep], fragment[keep], gene[keep])
+
+    ## fragment and meta-feature pairs
+    (pairs, pair_num) = np.unique(fragment * n_genes + gene, return_inverse=True)
+    pair_fragment = pairs // n_genes
+    pair_gene = pairs % n_genes
+    hits = np.bincount(pair_fragment, minlength=n_fragments)
+
+    if largest_overlap and len(pairs):
+        ## bases overlapping each meta-feature: union of overlaps sorted by start
+        hit_start = np.maximum(starts[block], index['starts'][feature])
+        hit_end = np.minimum(ends[block], index['ends'][feature])
+        order = np.lexsort((hit_start, pair_num))
+        (pair_num, hit_start, hit_end) = (pair_num[order], hit_start[order], hit_end[order])
+
+        ## maximum end of previous overlaps of the same pair
+        previous_end = np.maximum.accumulate((pair_num << 32) + hit_end) - (pair_num << 32)
+        previous_end = np.concatenate(([0], previous_end[:-1]))
+        previous_end[np.concatenate(([True], pair_num[1:] != pair_num[:-1]))] = 0
+        new_bases = np.maximum(hit_end - np.maximum(hit_start, previous_end + 1) + 1, 0)
+        bases = np.bincount(pair_num, weights=new_bases, minlength=len(pairs))
+
+        ## meta-features with the largest overlap for each fragment (pairs sorted by fragment)
+        first_pair = np.flatnonzero(np.concatenate(([True], pair_fragment[1:] != pair_fragment[:-1])))
+        max_bases = np.repeat(np.maximum.reduceat(bases, first_pair), np.diff(np.append(first_pair, len(pairs))))
+        largest = bases == max_bases
+        (pair_fragment, pair_gene) = (pair_fragment[largest], pair_gene[largest])
+
+    assigned = np.bincount(pair_fragment, minlength=n_fragments)
+    if not allow_overlap:
+        single = (assigned == 1)[pair_fragment]
+        (pair_fragment, pair_gene) = (pair_fragment[single], pair_gene[single])
+
+    summary = { 'Assigned': int(np.sum(assigned == 1) + (np.sum(assigned > 1) if allow_overlap else 0)),
+                'Unassigned_NoFeatures': int(np.sum(hits == 0)),
+                'Unassigned_Ambiguity': 0 if allow_overlap else int(np.sum(assigned > 1)) }
+    return (np.bincount(pair_gene, minlength=n_genes), summary)
+
+############################################################
+def count_bam(index, bam_file, stranded=0, allow_multimap=False, allow_overlap=False, largest_overlap=False, threads=1):
+    """Counts fragments in a BAM file for each meta-feature in the GTF index.
+
+    Reads are paired into fragments while reading the BAM file, and fragments are
+    assigned in chunks (see assign_fragments).
+
+    :param index: GTF index (see gtf_index.load_index)
+    :param bam_file: BAM file (sorted or not)
+    :param stranded: 0 (unstranded), 1 (stranded) or 2 (reversely stranded)
+    :param allow_multimap: Count multimapping alignments (-M)
+    :param allow_overlap: Assign to all meta-features overlapping (-O)
+    :param largest_overlap: Assign to the meta-feature with largest overlap (--largestOverlap)
+    :param threads: Threads to decompress the BAM file
+
+    :returns: (NumPy array of counts, dictionary of status counts)
+    """
+    try:
+        import pysam
+    except ImportError:
+        print (colored("** ERROR: pysam is required for the native counting engine. Install it or use --count_engine featureCounts", 'red'))
+        exit()
+
+    counts = np.zeros(index['info']['genes'], dtype=np.int64)
+    summary = dict.fromkeys(summary_status, 0)
+
+    ## blocks of fragments waiting to be assigned
+    chunk = {'chroms': [], 'starts': [], 'ends': [], 'fragments': [], 'strands': []}
+
+    def assign_chunk():
+        if not chunk['strands']:
+            return
+        (chunk_counts, chunk_summary) = assign_fragments(index, chunk['chroms'], chunk['starts'], chunk['ends'], chunk['fragments'],
+                                                         chunk['strands'], stranded, allow_overlap, largest_overlap)
+        counts[:] += chunk_counts
+        for status, value in chunk_summary.items():
+            summary[status] += value
+        for values in chunk.values():
+            values.clear()
+
+    def add_fragment(chrom, blocks, reverse, multimapping):
+        if multimapping and not allow_multimap:
+            summary['Unassigned_MultiMapping'] += 1
+            return
+        fragment = len(chunk['strands'])
+        chunk['strands'].append(-1 if reverse else 1)
+        for block_chrom, (start, end) in zip(chrom, blocks):
+            chunk['chroms'].append(block_chrom)
+            chunk['starts'].append(start)
+            chunk['ends'].append(end)
+            chunk['fragments'].append(fragment)
+        if fragment + 1 >= chunk_size:
+            assign_chunk()
+
+    ## first mate of each pair seen, waiting for the second one
+    pending = {}
+    with pysam.AlignmentFile(bam_file, 'rb', threads=max(int(threads), 1)) as bam_hd:
+        ## chromosome of the index for each reference in the BAM file
+        chrom_ids = gtf_index.chromosome_ids(index, bam_hd.references).tolist()
+
+        for read in bam_hd.fetch(until_eof=True):
+            if read.is_supplementary:
+                continue
+
+            if read.is_unmapped:
+                ## count each unmapped fragment once
+                if not read.is_paired or (read.mate_is_unmapped and read.is_read1):
+                    summary['Unassigned_Unmapped'] += 1
+                continue
+
+            multimapping = read.has_tag('NH') and read.get_tag('NH') > 1
+            reverse = read.is_reverse != (read.is_paired and read.is_read2)
+            blocks = read_blocks(read)
+            chrom = [chrom_ids[read.reference_id]] * len(blocks)
+
+            ## single-end reads or mate not available
+            if not read.is_paired or read.mate_is_unmapped:
+                add_fragment(chrom, blocks, reverse, multimapping)
+                continue
+
+            ## mates of the same alignment share name and positions
+            key = (read.query_name, read.reference_id, read.reference_start, read.next_reference_id, read.next_reference_start)
+            mate = pending.pop(key, None)
+            if mate is None:
+                pending[(read.query_name, read.next_reference_id, read.next_reference_start, read.reference_id, read.reference_start)] = (chrom, blocks, reverse, multimapping)
+                continue
+
+            add_fragment(mate[0] + chrom, mate[1] + blocks, reverse if read.is_read1 else mate[2], multimapping or mate[3])
+
+        ## mates not found, e.g. filtered
+        for chrom, blocks, reverse, multimapping in pending.values():
+            add_fragment(chrom, blocks, reverse, multimapping)
+        assign_chunk()
+
+    return (counts, summary)
+
+############################################################
+def write_counts(out_file, index, bam_file, counts, summary, command, threads=1):
+    """Writes counts and summary using featureCounts format. Counts are compressed while written if out_file is gzip (.gz)
+
+    :returns: Size of counts (uncompressed)
+    """
+    with open(os.path.join(index['folder'], 'genes.tsv')) as genes_hd:
+        lines = [ '# Program:RSP native counts v%s; Command:"%s"\n' %(pipeline_version, command),
+                  "\t".join(['Geneid', 'Chr', 'Start', 'End', 'Strand', 'Length', bam_file]) + "\n" ]
+        lines += [ "%s\t%s\n" %(line.rstrip('\n'), count) for line, count in zip(genes_hd, counts) ]
+    data = "".join(lines).encode()
+
+    (out_hd, process) = compression.open_output(out_file, threads)
+    out_hd.write(data)
+    if not compression.close_output(out_hd, process):
+        print (colored("** ERROR: Compression failed for " + out_file, 'red'))
+        exit()
+
+    summary_file = out_file[:-3] if out_file.endswith('.gz') else out_file
+    with open(summary_file + '.summary', 'w') as summary_hd:
+        summary_hd.write("Status\t%s\n" %bam_file)
+        for status in summary_status:
+            summary_hd.write("%s\t%s\n" %(status, summary[status]))
+    return (len(data))
+
+############################################################
+def native_counts_call(path, index_folder, gtf_file, bam_file, name, threads, allow_multimap, stranded, option_featureCount, Debug, compress=False):
+    """Counts reads using the GTF index provided. Same arguments and outputs as featurecounts.featurecounts_call.
+
+    :param path: Folder to store results
+    :param index_folder: Folder containing the GTF index (see gtf_index.build_index)
+    :param gtf_file: GTF file used to generate the index
+    :param bam_file: BAM file
+    :param name: Sample name
+    :param threads: Threads to decompress the BAM file
+    :param allow_multimap: Count multimapping reads
+    :param stranded: 0 (unstranded), 1 (stranded) or 2 (reversely stranded)
+    :param option_featureCount: Gene Count or RNAbiotype
+    :param Debug: Show debugging messages
+    :param compress: Compress featureCount.out
+
+    :returns: featureCount.out file (featureCount.out.gz if compressed)
+    """
+    os.makedirs(path, exist_ok=True)
+
+    index = gtf_index.load_index(index_folder)
+    if index['info']['attribute'] != mode_attribute[option_featureCount]:
+        print (colored("** ERROR: GTF index %s was not generated for %s" %(index_folder, option_featureCount), 'red'))
+        exit()
+
+    ## same options as featureCounts calls
+    stranded = int(stranded)
+    options = "-p -t %s -g %s -s %s %s" %(index['info']['feature_type'], index['info']['attribute'], stranded,
+                                          "-M -O" if allow_multimap else "--largestOverlap")
+
+    ## check if previously counted with same BAM, annotation and parameters
+    record = result_cache.get_record(path, 'featureCounts', [gtf_file, bam_file], 'native ' + options, 'RSP ' + pipeline_version)
+    outputs = featurecounts.count_outputs(path, compress)
+    if result_cache.is_cached(record, outputs, name):
+        return (outputs[0])
+
+    if Debug:
+        print (colored("**DEBUG: native counting for sample %s: %s **" %(name, options), 'yellow'))
+
+    start_time = time.time()
+    (counts, summary) = count_bam(index, bam_file, stranded, allow_multimap, allow_overlap=allow_multimap,
+                                  largest_overlap=not allow_multimap, threads=threads)
+    raw_size = write_counts(outputs[0], index, bam_file, counts, summary, options, threads)
+    if (compress):
+        compression.record_streamed(outputs[:1], [raw_size], time.time() - start_time, compression.compressor(threads)[0])
+
+    print ("+ Counting done for sample %s: %s assigned fragments (%.1f seconds)" %(name, summary['Assigned'], time.time() - start_time))
+    result_cache.save_record(record, outputs)
+    return (outputs[0])
@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Built-in adapter and quality trimming of FASTQ files (trimming software: native).
+
+Reads are processed in chunks by a pool of processes using Trimmomatic
+parameters and steps, in the same order as ``trimmomatic_call.trimmo_call``:
+
+- ``ILLUMINACLIP:<adapters>:<seed mismatches>:<palindrome>:<simple>[:<minAdapterLength>:<keepBothReads>]``: adapters
+  are found by bit-parallel matching (Shift-And allowing mismatches). Adapters
+  are packed in 64-bit words and each position is compared for all reads and
+  adapters at the same time. Full matches within the read and partial matches
+  at the 3' end (minimum overlap according to the simple clip threshold) are
+  removed. For paired-end reads, read-through into the adapters (palindrome
+  mode) is found aligning the first read to the reverse complement of the
+  second read, and the bases after the insert to the reverse complement of
+  ``Prefix*/2`` and ``Prefix*/1`` sequences. Pairs scoring at least the
+  palindrome threshold are cut at the end of the insert, so adapters as short
+  as ``<minAdapterLength>`` bases (default 1) are removed. As Trimmomatic,
+  the second read is then dropped unless ``<keepBothReads>`` is true.
+- ``LEADING`` and ``TRAILING``: bases below the quality given are removed
+  from the start and the end of the read.
+- ``SLIDINGWINDOW:<window>:<quality>``: the read is cut at the first window
+  with an average quality below the one given and low quality bases before
+  the window are removed.
+- ``MINLEN``: reads shorter than the length given are dropped.
+
+Outputs are named as Trimmomatic outputs: ``<sample>_trim_R1.fastq`` and
+``<sample>_trim_R2.fastq`` (pairs with both reads surviving),
+``<sample>_orphan_R1/R2.fastq`` (only one read surviving) or
+``<sample>_trim.fastq`` for single-end reads. If compressed, outputs are
+written gzip compressed (``.fastq.gz``) while trimming.
+"""
+## useful imports
+import os
+import math
+import time
+import itertools
+import concurrent.futures
+import numpy as np
+from termcolor import colored
+
+## import my modules
+from RSP.scripts import fastq_stats
+from RSP.scripts import compression
+from RSP.scripts import trimmomatic_call
+
+## reads for each chunk
+chunk_reads = 100000
+
+## maximum mismatches allowed in adapter matches
+max_mismatches = 3
+
+## 64-bit words
+word_size = 64
+
+complement = bytes.maketrans(b"ACGTNacgtn", b"TGCANtgcan")
+
+############################################################
+def read_adapters(fasta_file):
+    """Returns list of (name, sequence) for adapters in the fasta file given"""
+    adapters = []
+    with open(fasta_file) as fasta_hd:
+        for line in fasta_hd:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('>'):
+                adapters.append([line[1:].split()[0], ""])
+            elif adapters:
+                adapters[-1][1] += line.upper()
+    return ([ (name, seq) for name, seq in adapters if seq ])
+
+############################################################
+def reverse_complement(seq):
+    return (seq.encode().translate(complement)[::-1].decode())
+
+############################################################
+def select_adapters(adapters, mate, paired):
+    """Adapter sequences to search in reads of the mate given (1 or 2).
+
+    Sequences named ``Prefix*/1`` or ``Prefix*/2`` are used for paired-end reads only: the
+    adapter of the other mate is found in reverse complement. Other sequences are searched
+    in all reads, as Trimmomatic simple clipping.
+
+    :returns: List of sequences (unique, truncated to 64 bases)
+    """
+    selected = []
+    for name, seq in adapters:
+        if name.startswith('Prefix'):
+            if not paired or not name.endswith('/' + str(3 - mate)):
+                continue
+            seq = reverse_complement(seq)
+        elif name.endswith('/1') or name.endswith('/2'):
+            if paired and not name.endswith('/' + str(mate)):
+                continue
+        seq = seq[:word_size]
+        if seq not in selected:
+            selected.append(seq)
+    return (selected)
+
+############################################################
+def palindrome_adapters(adapters):
+    """Adapter pairs for palindrome mode: reverse complement of ``Prefix*/2`` and ``Prefix*/1``,
+    found after the insert in the first and second read respectively.
+
+    :returns: List of (adapter for read 1, adapter for read 2) as base code arrays
+    """
+    prefixes = { 1: [], 2: [] }
+    for name, seq in adapters:
+        if name.startswith('Prefix') and name[-2:] in ('/1', '/2'):
+            prefixes[int(name[-1])].append(seq)
+
+    pairs = []
+    for seq1, seq2 in zip(prefixes[1], prefixes[2]):
+        pair = tuple( fastq_stats.base_lut[np.frombuffer(reverse_complement(seq).encode(), dtype=np.uint8)] 
+                      for seq in (seq2, seq1) )
+        if not any((pair[0].tobytes(), pair[1].tobytes()) == (a.tobytes(), b.tobytes()) for a, b in pairs):
+            pairs.append(pair)
+    return (pairs)
+
+############################################################
+def adapter_masks(sequences, min_overlap):
+    """Packs adapters in 64-bit words for bit-parallel matching.
+
+    :param sequences: Adapter sequences
+    :param min_overlap: Minimum overlap for partial matches at the end of reads
+
+    :returns: Dictionary with match masks for each base (base code x word), start, final
+              and partial bits for each word, and adapters (offset, length) in each word
+    """
+    words = []
+    for seq in sorted(sequences, key=len, reverse=True):
+        for word in words:
+            if sum(length for offset, length, s in word) + len(seq) <= word_size:
+                word.append((sum(length for offset, length, s in word), len(seq), seq))
+                break
+        else:
+            words.append([ (0, len(seq), seq) ])
+
+    ## base codes as in fastq_stats: A, C, G, T, N (no match), 5 after the end of the read
+    base_mask = np.zeros((6, len(words)), dtype=np.uint64)
+    start = np.zeros(len(words), dtype=np.uint64)
+    final = np.zeros(len(words), dtype=np.uint64)
+    partial = np.zeros(len(words), dtype=np.uint64)
+    for num, word in enumerate(words):
+        for offset, length, seq in word:
+            start[num] |= np.uint64(1 << offset)
+            final[num] |= np.uint64(1 << (offset + length - 1))
+            for pos in range(min_overlap - 1, length - 1):
+                partial[num] |= np.uint64(1 << (offset + pos))
+            for pos, base in enumerate(seq):
+                if base in "ACGT":
+                    base_mask["ACGT".index(base), num] |= np.uint64(1 << (offset + pos))
+
+    return ({'base_mask': base_mask, 'start': start, 'final': final, 'partial': partial,
+             'words': [ [ (offset, length) for offset, length, seq in word ] for word in words ]})
+
+############################################################
+def adapter_cuts(codes, lengths, masks, mismatches, min_overlap):
+    """Position of the first adapter found in each read.
+
+    States for all reads and words are updated for each position (Shift-And with
+    substitutions): bit i of the state for k mismatches is set if the first i+1 bases
+    of an adapter match the bases ending at the current position with up to k mismatches.
+
+    :param codes: Base codes (reads x positions)
+    :param lengths: Length of each read
+    :param masks: Adapter masks (see adapter_masks)
+    :param mismatches: Maximum number of mismatches
+    :param min_overlap: Minimum overlap for partial matches at the end of reads
+
+    :returns: NumPy array with the length to keep for each read
+    """
+    (num_reads, max_len) = codes.shape
+    cuts = lengths.copy()
+    if not masks['words'] or not num_reads:
+        return (cuts)
+
+    one = np.uint64(1)
+    start = masks['start']
+    states = np.zeros((mismatches + 1, num_reads, len(masks['words'])), dtype=np.uint64)
+    for pos in range(max_len):
+        match = masks['base_mask'][codes[:, pos]]
+        previous = None
+        for k in range(mismatches + 1):
+            shifted = (states[k] << one) | start
+            new_state = shifted & match
+            if previous is not None:
+                ## mismatch: advance from states with one mismatch less
+                new_state |= previous
+            previous = shifted
+            states[k] = new_state
+
+        ## full matches within the read
+        hits = np.nonzero((states[mismatches] & masks['final']) != 0)
+        for read, word in zip(*hits):
+            if pos >= lengths[read]:
+                continue
+            value = int(states[mismatches][read, word])
+            for offset, length in masks['words'][word]:
+                if value >> (offset + length - 1) & 1:
+                    cuts[read] = min(cuts[read], pos - length + 1)
+
+        ## partial matches at the end of reads
+        ending = np.nonzero(lengths == pos + 1)[0]
+        if not len(ending):
+            continue
+        partial = states[mismatches][ending] & masks['partial']
+        for num, word in zip(*np.nonzero(partial != 0)):
+            read = ending[num]
+            value = int(partial[num, word])
+            for offset, length in masks['words'][word]:
+                bits = (value >> offset) & ((1 << length) - 1)
+                if bits:
+                    cuts[read] = min(cuts[read], pos + 1 - bits.bit_length())
+    return (cuts)
+
+############################################################
+def seed_mismatches(codes, adapter, seed):
+    """Mismatches between the first adapter bases (up to seed) and the read bases starting at each position (reads x positions)"""
+    mismatches = np.zeros(codes.shape, dtype=np.int16)
+    for pos in range(min(seed, len(adapter))):
+        bases = codes[:, pos:]
+        mismatches[:, :codes.shape[1] - pos] += (bases < 4) & (bases != adapter[pos])
+    return (mismatches)
+
+############################################################
+def palindrome_cuts(reads1, reads2, params, seed=8):
+    """Insert length for pairs reading through into the adapters (palindrome mode).
+
+    For each insert length, the first read is aligned to the reverse complement of the second
+    read and the bases after the insert to the adapters. Each matching base scores log10(4) and
+    each mismatch subtracts its quality / 10, as Trimmomatic. Only pairs where the first adapter
+    bases (up to seed) match in both reads are aligned: one mismatch allowed in each read if at
+    least 4 adapter bases, none otherwise.
+
+    :param reads1: Base codes, quality and lengths for first reads (see read_matrices)
+    :param reads2: Base codes, quality and lengths for second reads (see read_matrices)
+    :param params: Parameters (see trimming_params)
+    :param seed: Adapter bases checked before aligning the reads
+
+    :returns: NumPy array with the insert length for each pair (length of the longest read if not found)
+    """
+    (codes1, quality1, lengths1) = reads1
+    (codes2, quality2, lengths2) = reads2
+    max_len = max(codes1.shape[1], codes2.shape[1])
+    inserts = np.maximum(lengths1, lengths2)
+    if not params['palindrome_adapters'] or not len(inserts):
+        return (inserts)
+
+    ## both reads with the same width; complement of second read codes
+    (codes1, quality1, codes2, quality2) = [ np.pad(matrix, ((0, 0), (0, max_len - matrix.shape[1])), constant_values=fill) 
+                                           for matrix, fill in ((codes1, 5), (quality1, 0), (codes2, 5), (quality2, 0)) ]
+    complement2 = np.where(codes2 < 4, 3 - codes2, codes2)
+    match_score = math.log10(4)
+
+    def score(codes, quality, expected):
+        valid = (codes < 4) & (expected < 4)
+        mismatch = valid & (codes != expected)
+        return ((valid & ~mismatch).sum(axis=1) * match_score - (quality * mismatch).sum(axis=1) / 10.0)
+
+    ## candidates (pair, insert length): adapter long enough and seed matching in both reads
+    adapter_length = inserts[:, None] - np.arange(max_len)[None, :]
+    allowed = np.where(adapter_length >= 4, 1, 0)
+    candidates = []
+    for adapter1, adapter2 in params['palindrome_adapters']:
+        seeds = ((seed_mismatches(codes1, adapter1, seed) <= allowed) & (seed_mismatches(codes2, adapter2, seed) <= allowed) 
+                 & (adapter_length >= max(params['min_adapter'], 1)))
+        seeds[:, 0] = False
+        (pairs, positions) = np.nonzero(seeds)
+        candidates.append((adapter1, adapter2, pairs, positions))
+
+    ## shortest insert scoring at least the palindrome threshold
+    found = np.zeros(len(inserts), dtype=bool)
+    for insert in range(1, max_len):
+        for adapter1, adapter2, pairs, positions in candidates:
+            pairs = pairs[positions == insert]
+            pairs = pairs[~found[pairs]]
+            if not len(pairs):
+                continue
+
+            ## insert: first read against the reverse complement of the second read
+            total = score(codes1[pairs, :insert], quality1[pairs, :insert], complement2[pairs, insert - 1::-1])
+            ## adapters after the insert
+            for codes, quality, adapter in ((codes1, quality1, adapter1), (codes2, quality2, adapter2)):
+                size = min(max_len - insert, len(adapter))
+                total = total + score(codes[pairs, insert:insert + size], quality[pairs, insert:insert + size], 
+                                      adapter[None, :size])
+
+            hits = pairs[total >= params['palindrome']]
+            inserts[hits] = insert
+            found[hits] = True
+    return (inserts)
+
+############################################################
+def last_above(quality, threshold, start, end):
+    """End position (exclusive) after removing bases below the threshold at the end of [start, end) for each read"""
+    columns = np.arange(quality.shape[1])
+    above = (quality >= threshold) & (columns >= start[:, None]) & (columns < end[:, None])
+    last = quality.shape[1] - above[:, ::-1].argmax(axis=1)
+    return (np.where(above.any(axis=1), last, start))
+
+############################################################
+def quality_trim(quality, lengths, cuts, params):
+    """Applies LEADING, TRAILING and SLIDINGWINDOW steps for all reads.
+
+    :param quality: Quality scores (reads x positions)
+    :param lengths: Length of each read
+    :param cuts: Length to keep for each read after adapter clipping
+    :param params: Parameters (see trimming_params)
+
+    :returns: (start, end) positions to keep for each read
+    """
+    (num_reads, max_len) = quality.shape
+    columns = np.arange(max_len)
+    end = np.minimum(lengths, cuts)
+
+    ## LEADING
+    above = (quality >= params['leading']) & (columns < end[:, None])
+    start = np.where(above.any(axis=1), above.argmax(axis=1), end)
+
+    ## TRAILING
+    end = last_above(quality, params['trailing'], start, end)
+
+    ## SLIDINGWINDOW
+    window = params['window']
+    if max_len >= window:
+        cumulative = np.zeros((num_reads, max_len + 1), dtype=np.int64)
+        np.cumsum(quality, axis=1, out=cumulative[:, 1:])
+        sums = cumulative[:, window:] - cumulative[:, :-window]
+        positions = columns[:max_len - window + 1]
+        fail = ((sums < params['window_quality'] * window) & (positions >= start[:, None])
+                & (positions + window <= end[:, None]))
+        failed = fail.any(axis=1)
+        cut = np.where(failed, fail.argmax(axis=1), end)
+        end = np.where(failed, last_above(quality, params['window_quality'], start, cut), end)
+
+    return (start, end)
+
+############################################################
+def trimming_params(trim_params, paired):
+    """Parameters for native trimming from Trimmomatic parameters (see trim.get_trim_params)"""
+    ## <seed mismatches>:<palindrome>:<simple>[:<minAdapterLength>:<keepBothReads>]
+    values = str(trim_params['ILLUMINACLIP']).split(':')
+    illuminaclip = [ float(value) for value in values[:4] ]
+    (window, window_quality) = [ int(value) for value in str(trim_params['SLIDINGWINDOW']).split(':') ]
+
+    ## simple clip threshold: about 0.6 per matching base
+    min_overlap = max(int(math.ceil(illuminaclip[2] / 0.6)) if len(illuminaclip) > 2 else 1, 1)
+    adapters = read_adapters(trim_params['adapters'])
+    return ({
+        'mismatches': min(int(illuminaclip[0]), max_mismatches),
+        'min_overlap': min_overlap,
+        'masks': [ adapter_masks(select_adapters(adapters, mate, paired), min_overlap) for mate in (1, 2) ],
+        'palindrome': illuminaclip[1] if len(illuminaclip) > 1 else 30,
+        'palindrome_adapters': palindrome_adapters(adapters) if paired else [],
+        'min_adapter': int(illuminaclip[3]) if len(illuminaclip) > 3 else 1,
+        'keep_both': len(values) > 4 and values[4].lower() == 'true',
+        'leading': int(trim_params['LEADING']),
+        'trailing': int(trim_params['TRAILING']),
+        'window': window,
+        'window_quality': window_quality,
+        'minlen': int(trim_params['MINLEN']),
+    })
+
+############################################################
+def read_matrices(records):
+    """Base codes, quality scores (reads x positions) and lengths for a list of FASTQ records (4 lines each)"""
+    sequences = [ line.rstrip(b"\r\n") for line in records[1::4] ]
+    qualities = [ line.rstrip(b"\r\n") for line in records[3::4] ]
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    if sum(map(len, qualities)) != int(lengths.sum()):
+        raise ValueError("Length of sequences and qualities do not match")
+
+    max_len = int(lengths.max()) if len(lengths) else 0
+    mask = np.arange(max_len) < lengths[:, None]
+    codes = fastq_stats.base_lut[fastq_stats.to_matrix(sequences, lengths, mask)]
+    codes[~mask] = 5
+    quality = fastq_stats.to_matrix(qualities, lengths, mask).astype(np.int16) - 33
+    quality[~mask] = 0
+    return (codes, quality, lengths)
+
+############################################################
+def write_records(records, start, end, keep):
+    """FASTQ records trimmed for reads to keep"""
+    output = []
+    for num in np.nonzero(keep)[0]:
+        (read_start, read_end) = (int(start[num]), int(end[num]))
+        output.append(records[4*num])
+        output.append(records[4*num + 1].rstrip(b"\r\n")[read_start:read_end] + b"\n")
+        output.append(b"+\n")
+        output.append(records[4*num + 3].rstrip(b"\r\n")[read_start:read_end] + b"\n")
+    return (b"".join(output))
+
+############################################################
+def trim_chunk(records_list, params):
+    """Trims a chunk of reads (one list of records for each mate).
+
+    :returns: (trimmed reads for each mate, orphan reads for each mate, number of reads for both/first/second only/dropped)
+    """
+    reads = [ read_matrices(records) for records in records_list ]
+    cuts = [ adapter_cuts(codes, lengths, params['masks'][mate], params['mismatches'], params['min_overlap']) 
+             for mate, (codes, quality, lengths) in enumerate(reads) ]
+
+    ## palindrome: both reads cut at the end of the insert; second read dropped unless keepBothReads
+    if len(reads) == 2:
+        inserts = palindrome_cuts(reads[0], reads[1], params)
+        through = inserts < np.maximum(reads[0][2], reads[1][2])
+        cuts[0] = np.minimum(cuts[0], inserts)
+        cuts[1] = np.minimum(cuts[1], inserts if params['keep_both'] else np.where(through, 0, inserts))
+
+    kept = []
+    positions = []
+    for (codes, quality, lengths), cut in zip(reads, cuts):
+        (start, end) = quality_trim(quality, lengths, cut, params)
+        kept.append(end - start >= params['minlen'])
+        positions.append((start, end))
+
+    if len(records_list) == 1:
+        return ([ write_records(records_list[0], *positions[0], kept[0]) ], [],
+                [int(kept[0].sum()), 0, 0, int((~kept[0]).sum())])
+
+    both = kept[0] & kept[1]
+    trimmed = [ write_records(records_list[mate], *positions[mate], both) for mate in (0, 1) ]
+    orphans = [ write_records(records_list[0], *positions[0], kept[0] & ~kept[1]),
+                write_records(records_list[1], *positions[1], kept[1] & ~kept[0]) ]
+    counts = [int(both.sum()), int((kept[0] & ~kept[1]).sum()), int((kept[1] & ~kept[0]).sum()),
+              int((~kept[0] & ~kept[1]).sum())]
+    return (trimmed, orphans, counts)
+
+############################################################
+def read_records(handles, size=chunk_reads):
+    """Yields lists of records (lines) for chunks of reads for each file"""
+    while True:
+        chunk = [ list(itertools.islice(handle, 4*size)) for handle in handles ]
+        if not chunk[0]:
+            if any(chunk):
+                raise ValueError("Number of reads in paired-end files do not match")
+            return
+        if len(set(len(lines) for lines in chunk)) > 1:
+            raise ValueError("Number of reads in paired-end files do not match")
+        yield (chunk)
+
+############################################################
+def summary_line(counts, paired):
+    """Summary of reads surviving as reported by Trimmomatic"""
+    total = sum(counts)
+    percent = [ 100.0 * count / total if total else 0 for count in counts ]
+    if paired:
+        return ("Input Read Pairs: %s Both Surviving: %s (%.2f%%) Forward Only Surviving: %s (%.2f%%) "
+                "Reverse Only Surviving: %s (%.2f%%) Dropped: %s (%.2f%%)" %(
+                    total, counts[0], percent[0], counts[1], percent[1], counts[2], percent[2], counts[3], percent[3]))
+    return ("Input Reads: %s Surviving: %s (%.2f%%) Dropped: %s (%.2f%%)" %(
+        total, counts[0], percent[0], counts[3], percent[3]))
+
+############################################################
+def native_trim(sample_folder, sample_name, files, threads, trim_params, Debug, compress=False):
+    """Trims adapters and low quality bases for single-end or paired-end reads.
+
+    :param sample_folder: Folder to store trimmed reads (must exist)
+    :param sample_name: Sample name
+    :param files: FASTQ file(s): one or two (paired-end)
+    :param threads: Number of processes
+    :param trim_params: Trimmomatic parameters (see trim.get_trim_params)
+    :param Debug: Show debugging messages
+    :param compress: Write trimmed and orphan reads gzip compressed
+
+    :returns: OK/FAIL
+    """
+    paired = len(files) == 2
+    params = trimming_params(trim_params, paired)
+    if (Debug):
+        print (colored("**DEBUG: native trimming for sample %s: %s mismatches; minimum overlap %s **" %(
+            sample_name, params['mismatches'], params['min_overlap']), 'yellow'))
+
+    extension = '.fastq.gz' if compress else '.fastq'
+    if paired:
+        out_files = [ os.path.join(sample_folder, sample_name + suffix + extension) for suffix in
+                      ('_trim_R1', '_trim_R2', '_orphan_R1', '_orphan_R2') ]
+    else:
+        out_files = [ os.path.join(sample_folder, sample_name + '_trim' + extension) ]
+
+    start_time = time.time()
+    counts = [0, 0, 0, 0]
+    handles = [ fastq_stats.open_fastq(fastq_file) for fastq_file in files ]
+
+    ## compressed while written: threads for the compressor of each file
+    threads_compress = max(1, int(threads) // len(out_files))
+    part_files = [ out_file[:-3] + '.part.gz' if compress else out_file + '.part' for out_file in out_files ]
+    outputs = [ compression.open_output(part_file, threads_compress) for part_file in part_files ]
+    out_handles = [ out_hd for out_hd, process in outputs ]
+    raw_sizes = [ 0 for out_file in out_files ]
+
+    def write_result(result):
+        (trimmed, orphans, chunk_counts) = result
+        for num, (out_hd, data) in enumerate(zip(out_handles, trimmed + orphans)):
+            out_hd.write(data)
+            raw_sizes[num] += len(data)
+        for num, count in enumerate(chunk_counts):
+            counts[num] += count
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max(int(threads), 1)) as executor:
+            ## chunks written in the same order as read, bounded number in memory
+            pending = []
+            for chunk in read_records(handles):
+                pending.append(executor.submit(trim_chunk, chunk, params))
+                if len(pending) >= 2*max(int(threads), 1):
+                    write_result(pending.pop(0).result())
+            for job in pending:
+                write_result(job.result())
+        if not all([ compression.close_output(out_hd, process) for out_hd, process in outputs ]):
+            raise OSError("compression of trimmed reads failed")
+    except (OSError, ValueError, EOFError) as exc:
+        print (colored("** ERROR: Trimming failed for sample %s: %s" %(sample_name, exc), 'red'))
+        return ('FAIL')
+    finally:
+        for handle in handles:
+            handle.close()
+        for out_hd, process in outputs:
+            compression.close_output(out_hd, process)
+
+    for part_file, out_file in zip(part_files, out_files):
+        os.rename(part_file, out_file)
+    if (compress):
+        compression.record_streamed(out_files, raw_sizes, time.time() - start_time, compression.compressor(threads_compress)[0])
+
+    ## summary as Trimmomatic
+    summary = summary_line(counts, paired)
+    log_file = os.path.join(sample_folder, sample_name + '.log')
+    with open(log_file, 'w') as log_hd:
+        log_hd.write("RSP native trimming: " + " ".join(files) + "\n")
+        log_hd.write(summary + "\nCompleted successfully\n")
+    trimmomatic_call.write_stats(log_file, os.path.join(sample_folder, sample_name + '_trim_stats.json'))
+
+    print ("+ Trimming done for sample %s (%.1f seconds): %s" %(sample_name, time.time() - start_time, summary))
+    return ('OK')
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Transcript and gene matrices from alignment-free quantification (salmon, kallisto).
+
+Each sample generates a table with a row for each transcript (``quant.sf`` or
+``abundance.tsv``). Only the columns required are parsed for each file, in
+parallel, and values are stored in a preallocated matrix (transcripts x
+samples). Transcripts are summarized at gene level using the GTF annotation
+(``transcript_id`` -> ``gene_id``) or GENCODE-like transcript names
+(``transcript|gene|...``).
+"""
+## useful imports
+import os
+import concurrent.futures
+import numpy as np
+import pandas as pd
+from termcolor import colored
+
+############################################################
+def read_quant(file_given, id_col, value_cols, read_index=True):
+    """Reads the IDs (if desired) and value columns of a quantification file
+
+    :param file_given: Quantification file, e.g. quant.sf
+    :param id_col: Column containing transcript IDs, e.g. Name
+    :param value_cols: List of columns to retrieve, e.g. [NumReads, TPM]
+    :param read_index: Retrieve the IDs column or only the values
+
+    :returns: Tuple containing (IDs or None, float numpy array: rows x value_cols)
+    """
+    usecols = [id_col] + value_cols if read_index else value_cols
+    data = pd.read_csv(file_given, sep='\t', usecols=usecols, dtype={ col: np.float64 for col in value_cols })
+    values = data[value_cols].to_numpy()
+    if read_index:
+        return (data[id_col].to_numpy(), values)
+    return (None, values)
+
+############################################################
+def merge_quant(dict_files, id_col, value_cols, Debug=False, threads=2):
+    """Generates a matrix (transcripts x samples) for each value column
+
+    All samples quantified with the same index contain the same transcripts in the
+    same order, so values are copied as a block; samples with different IDs are
+    aligned to the IDs of the first sample.
+
+    :param dict_files: Dictionary containing sample names as keys and files as values
+    :param id_col: Column containing transcript IDs
+    :param value_cols: List of columns to retrieve
+    :param Debug: True/False for debugging messages
+    :param threads: Number of files to parse in parallel
+
+    :returns: Dictionary containing a DataFrame for each value column (empty if no data)
+    """
+    dict_files = { name: f for name, f in dict_files.items() if os.path.isfile(f) }
+    if not dict_files:
+        return ({})
+
+    ## read values for all samples in parallel
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(threads))) as executor:
+        commandsSent = { executor.submit(read_quant, file_given, id_col, value_cols): key for key, file_given in dict_files.items() }
+        for cmd2 in concurrent.futures.as_completed(commandsSent):
+            key = commandsSent[cmd2]
+            try:
+                results[key] = cmd2.result()
+            except Exception as exc:
+                print ('***ERROR:')
+                print (cmd2)
+                print('%r generated an exception: %s' % (key, exc))
+
+    sample_names = [ key for key in dict_files if key in results ]
+    if not sample_names:
+        return ({})
+
+    ## IDs from the first sample
+    ref_index = results[sample_names[0]][0]
+
+    ## fill preallocated matrix for each column
+    all_values = np.full((len(value_cols), len(ref_index), len(sample_names)), np.nan)
+    ref_position = None
+    for pos, key in enumerate(sample_names):
+        (index_sample, values) = results[key]
+        if len(index_sample) == len(ref_index) and np.array_equal(index_sample, ref_index):
+            all_values[:, :, pos] = values.T
+            continue
+
+        if Debug:
+            print (colored("**DEBUG: sample %s contains different IDs **" %key, 'yellow'))
+        if ref_position is None:
+            ref_position = pd.Index(ref_index)
+        position = ref_position.get_indexer(index_sample)
+        found = position >= 0
+        all_values[:, position[found], pos] = values[found].T
+
+    index = pd.Index(ref_index, name=id_col)
+    return ({ col: pd.DataFrame(all_values[i], index=index, columns=sample_names) for i, col in enumerate(value_cols) })
+
+############################################################
+def tx2gene(gtf_file):
+    """Transcript to gene table from a GTF file (transcript_id and gene_id attributes)
+
+    :returns: Series: transcript_id -> gene_id
+    """
+    gtf = pd.read_csv(gtf_file, sep='\t', comment='#', header=None, usecols=[2, 8], names=['feature', 'attributes'], dtype=str)
+    transcripts = gtf[gtf['feature'] == 'transcript']
+    if transcripts.empty:
+        transcripts = gtf[gtf['feature'] == 'exon']
+
+    ids = pd.DataFrame({
+        'transcript_id': transcripts['attributes'].str.extract(r'transcript_id "([^"]+)"', expand=False),
+        'gene_id': transcripts['attributes'].str.extract(r'gene_id "([^"]+)"', expand=False)}).dropna()
+    ids = ids.drop_duplicates('transcript_id')
+    return (pd.Series(ids['gene_id'].to_numpy(), index=ids['transcript_id'].to_numpy()))
+
+############################################################
+def strip_version(ids):
+    """IDs without version, e.g. ENST00000456328.2 -> ENST00000456328"""
+    return (pd.Index(ids).astype(str).str.replace(r'\.[0-9]+$', '', regex=True))
+
+############################################################
+def gene_ids(transcript_ids, gtf_file=None):
+    """Gene for each transcript using GTF annotation or GENCODE-like names (transcript|gene|...)
+
+    :returns: numpy array of genes (None if not available)
+    """
+    transcript_ids = pd.Index(transcript_ids).astype(str)
+    names = transcript_ids.str.split('|').str[0]
+
+    if gtf_file:
+        table = tx2gene(gtf_file)
+        genes = pd.Series(names).map(table)
+        ## transcript versions not included in names or annotation
+        if genes.isna().mean() > 0.5:
+            table.index = strip_version(table.index)
+            table = table[~table.index.duplicated()]
+            genes = pd.Series(strip_version(names)).map(table)
+        missing = int(genes.isna().sum())
+        if missing:
+            print (colored("** Warning: %s transcripts not found in the annotation provided" %missing, 'yellow'))
+        return (genes.fillna('unknown').to_numpy())
+
+    if transcript_ids.str.contains('|', regex=False).all():
+        return (transcript_ids.str.split('|').str[1].to_numpy())
+    return (None)
+
+############################################################
+def gene_matrix(matrix, genes):
+    """Sums transcripts for each gene"""
+    return (matrix.groupby(genes, sort=True).sum(min_count=1).rename_axis('gene_id'))
+
+############################################################
+def write_matrices(soft_name, dict_files, id_col, count_col, tpm_col, outdir, gtf_file=None, Debug=False, threads=2):
+    """Writes transcript and gene matrices (counts and TPM) for all samples in the report folder given
+
+    :param soft_name: Software name, used as prefix for files
+    :param dict_files: Dictionary containing sample names as keys and files as values
+    :param id_col: Column containing transcript IDs
+    :param count_col: Column containing estimated counts
+    :param tpm_col: Column containing TPM
+    :param outdir: Folder to store matrices
+    :param gtf_file: Annotation to summarize at gene level (optional)
+    :param Debug: True/False for debugging messages
+    :param threads: Number of files to parse in parallel
+
+    :returns: List of files generated
+    """
+    matrices = merge_quant(dict_files, id_col, [count_col, tpm_col], Debug, threads)
+    if not matrices:
+        print ("+ No %s quantification available..." %soft_name)
+        return ([])
+
+    os.makedirs(outdir, exist_ok=True)
+    files = []
+    genes = gene_ids(matrices[count_col].index, gtf_file)
+    for col, suffix in ((count_col, 'counts'), (tpm_col, 'TPM')):
+        matrix = matrices[col].rename_axis('transcript_id')
+        out_file = os.path.join(outdir, '%s_transcripts_%s.csv' %(soft_name, suffix))
+        matrix.to_csv(out_file)
+        files.append(out_file)
+
+        if genes is not None:
+            out_file = os.path.join(outdir, '%s_genes_%s.csv' %(soft_name, suffix))
+            gene_matrix(matrix, genes).to_csv(out_file)
+            files.append(out_file)
+
+    if genes is None:
+        print ("+ No annotation provided (--ref_annot): no gene level matrix for %s..." %soft_name)
+    print ("+ %s quantification for %s samples available in: %s" %(soft_name, matrices[count_col].shape[1], outdir))
+    return (files)
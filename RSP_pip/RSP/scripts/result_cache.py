@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Content-addressed cache of results generated by each step.
+
+For each step, a key is generated from the content of the input files, the
+version of the tool and the command line (threads are not taken into account).
+The key is stored next to the outputs (``.cache_<step>.json``) once the step
+succeeds. A step is only done again if the key changes or outputs are missing.
+
+Digests of input files are reused from the previous record while the file
+size, modification time and inode do not change, so large files are only
+read again when modified.
+"""
+## useful imports
+import os
+import re
+import json
+import time
+import hashlib
+import functools
+from termcolor import colored
+
+## import my modules
+from RSP.config import set_config
+
+## options for number of threads: not part of the key
+threads_regex = re.compile(r"(\s(?:-T|-t|-p|-@|--threads|--runThreadN|-threads|--cores|-j))(\s+)\d+")
+
+############################################################
+def cache_file(folder, step):
+    """Returns file containing the cache record for a step within the folder given"""
+    return (os.path.join(folder, '.cache_' + step + '.json'))
+
+############################################################
+def file_stat(path):
+    """Returns size, modification time and inode for a file (following symbolic links)"""
+    stat = os.stat(path)
+    return ({'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'inode': stat.st_ino})
+
+############################################################
+def file_digest(path, block_size=4*1024*1024):
+    """Digest of the content of a file. For a folder, digest of names, sizes and modification times of its files.
+
+    :param path: Absolute path to file or folder
+    :param block_size: Bytes to read each time
+
+    :returns: Hexadecimal digest
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    if os.path.isdir(path):
+        for root, dirs, files in sorted(os.walk(path)):
+            for file_name in sorted(files):
+                file_path = os.path.join(root, file_name)
+                stat = file_stat(file_path)
+                digest.update(("%s\t%s\t%s\n" %(os.path.relpath(file_path, path), stat['size'], stat['mtime'])).encode())
+        return (digest.hexdigest())
+
+    with open(path, 'rb') as file_hd:
+        for block in iter(lambda: file_hd.read(block_size), b''):
+            digest.update(block)
+    return (digest.hexdigest())
+
+############################################################
+def input_digests(files, previous={}):
+    """Digest and stat for each input file. Digests from a previous record are reused if stat did not change.
+
+    :param files: List of input files
+    :param previous: Dictionary of inputs from a previous record
+
+    :returns: Dictionary (file: {size, mtime, inode, digest})
+    """
+    inputs = {}
+    for path in files:
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            inputs[path] = {'digest': 'missing'}
+            continue
+
+        stat = file_stat(path)
+        old = previous.get(path, {})
+        if all(old.get(key) == value for key, value in stat.items()) and 'digest' in old:
+            stat['digest'] = old['digest']
+        else:
+            stat['digest'] = file_digest(path)
+        inputs[path] = stat
+    return (inputs)
+
+############################################################
+@functools.lru_cache(maxsize=None)
+def tool_version(prog):
+    """Returns path and version of the software (see set_config.get_exe)"""
+    return (set_config.get_exe(prog, Return_Version=True))
+
+############################################################
+def normalize_command(command):
+    """Command line as a string without the number of threads"""
+    if not isinstance(command, str):
+        command = json.dumps(command, sort_keys=True)
+    return (threads_regex.sub(r"\1\2N", " " + command).strip())
+
+############################################################
+def read_record(folder, step):
+    """Returns the cache record stored for a step (empty if not available)"""
+    record_file = cache_file(folder, step)
+    if not os.path.isfile(record_file):
+        return ({})
+    try:
+        with open(record_file) as record_hd:
+            return (json.load(record_hd))
+    except ValueError:
+        return ({})
+
+############################################################
+def get_record(folder, step, inputs, command, prog):
+    """Generates the cache record for a step given its inputs, command line and software.
+
+    :param folder: Folder containing the outputs of the step
+    :param step: Name of the step, e.g. featureCounts
+    :param inputs: List of input files (or folders)
+    :param command: Command line (string) or parameters (dictionary) for the step
+    :param prog: Software name (see dependencies) or version string if not an external software
+
+    :type folder: string
+    :type step: string
+    :type inputs: list
+    :type command: string or dict
+    :type prog: string
+
+    :returns: Dictionary containing folder, step, key, inputs, version and command
+    """
+    previous = read_record(folder, step)
+
+    if prog in set_config.extern_progs.read_dependencies().index:
+        (exe, version) = tool_version(prog)
+        version = prog + ' ' + str(version)
+    else:
+        version = str(prog)
+
+    record = {
+        'folder': os.path.abspath(folder),
+        'step': step,
+        'inputs': input_digests(inputs, previous.get('inputs', {})),
+        'version': version,
+        'command': normalize_command(command),
+    }
+    key_string = json.dumps({ 'inputs': sorted(v['digest'] for v in record['inputs'].values()),
+                              'version': record['version'], 'command': record['command'] }, sort_keys=True)
+    record['key'] = hashlib.sha256(key_string.encode()).hexdigest()
+    return (record)
+
+############################################################
+def is_cached(record, outputs=[], name=""):
+    """Checks whether results for the record were previously generated and are still available.
+
+    :param record: Cache record (see get_record)
+    :param outputs: Output files that must exist
+    :param name: Sample name to print
+
+    :returns: True/False
+    """
+    previous = read_record(record['folder'], record['step'])
+    if not previous or previous.get('key') != record['key']:
+        return (False)
+
+    if not all(os.path.exists(f) for f in outputs):
+        return (False)
+
+    print (colored("\tA previous command generated results on: %s [%s -- %s]" %(previous.get('date', ''), name, record['step']), 'yellow'))
+    return (True)
+
+############################################################
+def save_record(record, outputs=[]):
+    """Stores the record next to the outputs once the step has succeeded"""
+    record['outputs'] = [ os.path.abspath(f) for f in outputs ]
+    record['date'] = time.strftime("%Y/%m/%d %H:%M:%S")
+
+    record_file = cache_file(record['folder'], record['step'])
+    tmp_file = record_file + '.tmp'
+    with open(tmp_file, 'w') as record_hd:
+        json.dump(record, record_hd, indent=4)
+    os.replace(tmp_file, record_file)
+    return (record_file)
+
+############################################################
+def remove_record(folder, step):
+    """Removes the record for a step, e.g. if the step failed"""
+    record_file = cache_file(folder, step)
+    if os.path.isfile(record_file):
+        os.remove(record_file)
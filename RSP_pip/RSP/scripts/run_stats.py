@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+############################################################
+## Author: Jose F. Sanchez & Mireia Marin                 ##
+## Copyright (C) 2022                                     ##
+## High Content Genomics and Bioinformatics IGPT Unit     ##
+## Lauro Sumoy Lab, IGTP, Spain                           ##
+############################################################
+"""
+Statistics generated by each tool, stored in a single table for each project.
+
+Logs are parsed once (single pass, no regular expressions for each line):
+
+- STAR: ``Log.final.out``
+- HISAT2: ``<sample>.summary`` (``--new-summary``)
+- salmon: ``aux_info/meta_info.json``
+- kallisto: ``run_info.json``
+- cutadapt: ``<sample>.cutadapt.log``
+- Trimmomatic and native trimming: ``<sample>_trim_stats.json`` or ``<sample>.log``
+- featureCounts: ``featureCount.out.summary``
+- FASTQC (and native QC backend): ``<file>_fastqc/fastqc_data.txt``
+
+Values are stored in a columnar table (one row for each sample, step, tool and
+metric) partitioned by sample: ``info/run_stats/<sample>.parquet`` (pyarrow is
+a requirement), or ``info/run_stats/<sample>.tsv`` if pyarrow is not installed. Statistics for a
+sample are updated as soon as each of its jobs finishes, without reading the
+rest of samples. Logs are parsed again only if they changed since they were
+stored, and reports query the table instead of parsing logs again.
+"""
+## useful imports
+import os
+import glob
+import json
+import pandas as pd
+from termcolor import colored
+
+## import my modules
+from RSP.scripts import index_registry
+from RSP.scripts import trimmomatic_call
+
+## columns of the table
+columns = ['sample', 'step', 'tool', 'metric', 'value', 'source', 'mtime']
+
+############################################################
+def metric_name(text):
+    """Metric name from a log description, e.g. 'Uniquely mapped reads %' -> uniquely_mapped_reads_pct"""
+    text = text.replace('%', ' pct ').lower()
+    name = "".join(c if c.isalnum() else '_' for c in text)
+    return ("_".join(part for part in name.split('_') if part))
+
+############################################################
+def to_number(text):
+    """First number in a text, e.g. '1,000 (90.00%)' -> 1000, '95.00%' -> 95.0. None if not a number."""
+    fields = text.strip().split()
+    if not fields:
+        return (None)
+    value = fields[0].replace(',', '').rstrip('%')
+    try:
+        return (int(value))
+    except ValueError:
+        try:
+            return (float(value))
+        except ValueError:
+            return (None)
+
+############################################################
+def parse_lines(lines, separator):
+    """Metrics for lines 'description<separator>value'. Lines without numeric values are skipped."""
+    stats = {}
+    for line in lines:
+        if separator not in line:
+            continue
+        (key, value) = line.split(separator, 1)
+        value = to_number(value)
+        if value is not None and metric_name(key):
+            stats[metric_name(key)] = value
+    return (stats)
+
+############################################################
+def parse_star(log_file):
+    """Metrics in STAR Log.final.out: 'description |	value'"""
+    with open(log_file) as log_hd:
+        return (parse_lines(log_hd, '|'))
+
+############################################################
+def parse_hisat2(summary_file):
+    """Metrics in HISAT2 summary (--new-summary): 'description: value (percentage)'"""
+    with open(summary_file) as summary_hd:
+        return (parse_lines(summary_hd, ':'))
+
+############################################################
+def parse_salmon(meta_file):
+    """Metrics in salmon aux_info/meta_info.json (numeric values) and compatible fragment ratio for the library type"""
+    with open(meta_file) as meta_hd:
+        meta = json.load(meta_hd)
+    stats = { key: value for key, value in meta.items() if key.startswith(('num_', 'percent_')) and isinstance(value, (int, float)) }
+
+    lib_file = os.path.join(os.path.dirname(os.path.dirname(meta_file)), 'lib_format_counts.json')
+    if os.path.isfile(lib_file):
+        with open(lib_file) as lib_hd:
+            lib = json.load(lib_hd)
+        if isinstance(lib.get('compatible_fragment_ratio'), (int, float)):
+            stats['compatible_fragment_ratio'] = lib['compatible_fragment_ratio']
+    return (stats)
+
+############################################################
+def parse_kallisto(run_info_file):
+    """Metrics in kallisto run_info.json (numeric values)"""
+    with open(run_info_file) as info_hd:
+        info = json.load(info_hd)
+    return ({ key: value for key, value in info.items() if key.startswith(('n_', 'p_')) and isinstance(value, (int, float)) })
+
+############################################################
+def parse_cutadapt(log_file):
+    """Metrics in cutadapt report summary: 'description: value', before adapter sections"""
+    lines = []
+    with open(log_file) as log_hd:
+        for line in log_hd:
+            if line.startswith('=== ') and 'Summary' not in line:
+                break
+            lines.append(line)
+    return (parse_lines(lines, ':'))
+
+############################################################
+def parse_trimming(log_file):
+    """Metrics for Trimmomatic or native trimming: compact JSON or log (summary line)"""
+    if log_file.endswith('.json'):
+        with open(log_file) as stats_hd:
+            return (json.load(stats_hd))
+    return (trimmomatic_call.summary_stats(log_file))
+
+############################################################
+def parse_featurecounts(summary_file):
+    """Metrics in featureCounts summary: 'Status	count' (one sample)"""
+    stats = {}
+    with open(summary_file) as summary_hd:
+        next(summary_hd, None)
+        for line in summary_hd:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) > 1:
+                stats[fields[0]] = sum(int(value) for value in fields[1:])
+    return (stats)
+
+############################################################
+def parse_fastqc(data_file):
+    """Metrics in FASTQC fastqc_data.txt: basic statistics and number of modules failed or with warnings"""
+    stats = {'modules_fail': 0, 'modules_warn': 0}
+    module = None
+    with open(data_file) as data_hd:
+        for line in data_hd:
+            if line.startswith('>>'):
+                fields = line[2:].rstrip('\n').split('\t')
+                module = fields[0]
+                if len(fields) > 1 and fields[1] in ('fail', 'warn'):
+                    stats['modules_' + fields[1]] += 1
+            elif module == 'Basic Statistics' and not line.startswith('#'):
+                (key, value) = (line.rstrip('\n').split('\t') + [''])[:2]
+                value = to_number(value)
+                if value is not None and not key.startswith('Sequence length'):
+                    stats[metric_name(key)] = value
+    return (stats)
+
+## tool: parser
+parsers = {
+    'STAR': parse_star,
+    'hisat2': parse_hisat2,
+    'salmon': parse_salmon,
+    'kallisto': parse_kallisto,
+    'cutadapt': parse_cutadapt,
+    'trimming': parse_trimming,
+    'featureCounts': parse_featurecounts,
+    'FastQC': parse_fastqc,
+}
+
+############################################################
+def detect_logs(folder, sample):
+    """Logs available in a folder (and subfolders named as software) for a sample
+
+    :returns: List of (tool, log file). Tool includes the subfolder if not named as the tool, e.g. featureCounts[star]
+    """
+    logs = []
+    for root in [folder] + [ os.path.join(folder, d) for d in sorted(os.listdir(folder)) if os.path.isdir(os.path.join(folder, d)) ]:
+        files = set(os.listdir(root))
+        first = len(logs)
+        if 'Log.final.out' in files:
+            logs.append(('STAR', os.path.join(root, 'Log.final.out')))
+        if sample + '.summary' in files:
+            logs.append(('hisat2', os.path.join(root, sample + '.summary')))
+        if 'aux_info' in files and os.path.isfile(os.path.join(root, 'aux_info', 'meta_info.json')):
+            logs.append(('salmon', os.path.join(root, 'aux_info', 'meta_info.json')))
+        if 'run_info.json' in files:
+            logs.append(('kallisto', os.path.join(root, 'run_info.json')))
+        if sample + '.cutadapt.log' in files:
+            logs.append(('cutadapt', os.path.join(root, sample + '.cutadapt.log')))
+        if sample + '_trim_stats.json' in files:
+            logs.append(('trimming', os.path.join(root, sample + '_trim_stats.json')))
+        elif sample + '.log' in files and (sample + '_trim_R1.fastq' in files or sample + '_trim.fastq' in files
+                                           or sample + '_trim_R1.fastq.gz' in files or sample + '_trim.fastq.gz' in files):
+            logs.append(('trimming', os.path.join(root, sample + '.log')))
+        if 'featureCount.out.summary' in files:
+            logs.append(('featureCounts', os.path.join(root, 'featureCount.out.summary')))
+        if 'fastqc_data.txt' in files:
+            logs.append(('FastQC', os.path.join(root, 'fastqc_data.txt')))
+
+        ## software subfolder, e.g. counts for star or hisat2: featureCounts[star]
+        ## or file for FASTQC: FastQC[sample_R1]
+        subfolder = os.path.basename(root)
+        if subfolder.endswith('_fastqc'):
+            subfolder = subfolder[:-len('_fastqc')]
+        if root != folder:
+            logs[first:] = [ (tool if subfolder.lower() == tool.lower() else "%s[%s]" %(tool, subfolder), log_file) for tool, log_file in logs[first:] ]
+    return (logs)
+
+############################################################
+def stats_folder(outdir):
+    """Folder containing the table for the project (a file for each sample)"""
+    folder = os.path.join(outdir, 'info', 'run_stats')
+    os.makedirs(folder, exist_ok=True)
+    return (folder)
+
+############################################################
+def table_format():
+    """Parquet if pyarrow is available, otherwise TSV"""
+    try:
+        import pyarrow
+        return ('parquet')
+    except ImportError:
+        return ('tsv')
+
+############################################################
+def stats_file(outdir, sample):
+    """Table for a sample of the project"""
+    return (os.path.join(stats_folder(outdir), sample + '.' + table_format()))
+
+############################################################
+def read_table(table_file):
+    """Returns the table stored or an empty table"""
+    if not os.path.isfile(table_file):
+        return (pd.DataFrame(columns=columns))
+    if table_file.endswith('.parquet'):
+        return (pd.read_parquet(table_file))
+    return (pd.read_csv(table_file, sep='\t'))
+
+############################################################
+def write_table(table, table_file):
+    """Writes the table (temporary file renamed once finished)"""
+    tmp_file = table_file + '.tmp'
+    if table_file.endswith('.parquet'):
+        table.to_parquet(tmp_file, index=False)
+    else:
+        table.to_csv(tmp_file, sep='\t', index=False)
+    os.replace(tmp_file, table_file)
+
+############################################################
+def ingest(outdir, entries, Debug=False):
+    """Adds statistics of logs for the samples given to the project table. Logs not modified are skipped.
+
+    Only tables for the samples given are read and written.
+
+    :param outdir: Project folder
+    :param entries: List of (sample, step, folder)
+    :param Debug: Show debugging messages
+
+    :returns: Number of logs updated
+    """
+    samples = {}
+    for sample, step, folder in entries:
+        samples.setdefault(sample, []).append((step, folder))
+
+    total = 0
+    with index_registry.file_lock(os.path.join(stats_folder(outdir), '.lock')):
+        for sample, sample_entries in samples.items():
+            table_file = stats_file(outdir, sample)
+            table = read_table(table_file)
+            stored = set(zip(table['source'], table['mtime'].astype('int64'))) if len(table) else set()
+
+            rows = []
+            updated = set()
+            for step, folder in sample_entries:
+                if not os.path.isdir(folder):
+                    continue
+                for tool, log_file in detect_logs(folder, sample):
+                    ## modification time in nanoseconds (integer): exact after reading the table
+                    mtime = os.stat(log_file).st_mtime_ns
+                    if (log_file, mtime) in stored:
+                        continue
+                    try:
+                        stats = parsers[tool.split('[')[0]](log_file)
+                    except (OSError, ValueError) as exc:
+                        print (colored("** ERROR: Statistics could not be retrieved from %s: %s" %(log_file, exc), 'red'))
+                        continue
+                    updated.add(log_file)
+                    rows.extend([ [sample, step, tool, metric, float(value), log_file, mtime] for metric, value in stats.items() ])
+
+            if updated:
+                table = table[~table['source'].isin(updated)]
+                table = pd.concat([table, pd.DataFrame(rows, columns=columns)], ignore_index=True)
+                write_table(table, table_file)
+                total += len(updated)
+
+    if Debug:
+        print (colored("**DEBUG: statistics updated for %s log(s) **" %total, 'yellow'))
+    return (total)
+
+############################################################
+def read_all(outdir):
+    """Table for all samples of the project"""
+    tables = [ read_table(f) for f in sorted(glob.glob(os.path.join(stats_folder(outdir), '*.' + table_format()))) ]
+    tables = [ t for t in tables if not t.empty ]
+    if not tables:
+        return (pd.DataFrame(columns=columns))
+    return (pd.concat(tables, ignore_index=True))
+
+############################################################
+def query(outdir, step=None, tool=None, metrics=None):
+    """Statistics for the project as a matrix: samples x tool:metric
+
+    :param outdir: Project folder
+    :param step: Step to retrieve (e.g. trim, map, count) or all
+    :param tool: Tool to retrieve (e.g. STAR, featureCounts) or all
+    :param metrics: List of metrics to retrieve or all
+
+    :returns: DataFrame
+    """
+    table = read_all(outdir)
+    if step:
+        table = table[table['step'] == step]
+    if tool:
+        table = table[table['tool'] == tool]
+    if metrics:
+        table = table[table['metric'].isin(metrics)]
+    if table.empty:
+        return (pd.DataFrame())
+
+    table = table.assign(column=table['tool'] + ':' + table['metric'])
+    return (table.pivot_table(index='sample', columns='column', values='value', aggfunc='last'))
+
+############################################################
+def update_report(outdir, entries, Debug=False):
+    """Ingests statistics for the samples given and writes report/run_stats.csv for the project
+
+    :returns: DataFrame (samples x tool:metric)
+    """
+    ingest(outdir, entries, Debug)
+    summary = query(outdir)
+    if not summary.empty:
+        report_dir = os.path.join(outdir, 'report')
+        os.makedirs(report_dir, exist_ok=True)
+        summary.to_csv(os.path.join(report_dir, 'run_stats.csv'))
+        print ("+ Statistics for %s samples available in: %s" %(len(summary), os.path.join(report_dir, 'run_stats.csv')))
+    return (summary)
@@ -2,128 +2,148 @@
 ############################################################
 ## Author: Jose F. Sanchez & Mireia Marin                 ##
 ## Copyright (C) 2022                                     ##
-## High Content Genomics and Bioinformatics IGPT Unit     ## 
+## High Content Genomics and Bioinformatics IGPT Unit     ##
 ## Lauro Sumoy Lab, IGTP, Spain                           ##
 ############################################################
+"""
+Alignment-free quantification of transcripts using salmon.
 
+The index is decoy-aware if the reference genome is provided: transcripts and
+genome are indexed together (gentrome) and genome sequences are flagged as
+decoys, so reads from unannotated loci are not assigned to transcripts. Indexes
+are built and shared through the index registry (see :mod:`RSP.scripts.index_registry`).
+
+Each sample is quantified with ``salmon quant`` with the library type detected
+automatically (``-l A``). Results (``quant.sf``) for all samples are merged into
+transcript and gene matrices (see :mod:`RSP.scripts.quant_matrix`).
+"""
+## useful imports
 import os
-import argparse
-import sys
-from subprocess import Popen, PIPE
+import json
+import shutil
+from termcolor import colored
 
 ## import my modules
-from HCGB import functions
+import HCGB.functions.system_call_functions as HCGB_sys
+
 from RSP.config import set_config
-from RSP.scripts import samtools
-
-
-### INDEXING FUNCTION ###
-
-def salmon_index(path_reference, reference_genome, index):
-
-    #check if the index exist in the path_reference (even inside folders in the path_reference)
-    
-    command = "find " + path_reference + " -name duplicate_clusters.tsv | wc -l" #the indexing function creates a folder that contains this file (duplicate_clusters.tsv)
-    
-    stdout = Popen(command, shell=True, stdout=PIPE).stdout 
-    output = stdout.read() #keeps the output in the terminal as a python variable
-    
-    reference_abs_path = os.path.join(path_reference, reference_genome) #path reference genome
-    index_abs_path = os.path.join(path_reference, index) #path index
-    
-    selection = "0".encode()
-   
-    if selection in output:
-        indexing = "salmon index -t "+ reference_abs_path + " -i "+ index_abs_path
-        print("Indexing the transcriptome")
-        print("Path to the index:", index_abs_path)
-        print(indexing)
-        
-        os.system(indexing)
-    
+from RSP.scripts import compression
+
+## quantification file generated for each sample
+quant_file_name = "quant.sf"
+
+####INDEXING FUNCTION########################################################################################################################
+def decoy_names(genome_fasta, decoys_file):
+    """Writes the name of each sequence of the genome (decoys) in the file given"""
+    with compression.open_file(genome_fasta) as fasta_hd, open(decoys_file, 'w') as decoys_hd:
+        for line in fasta_hd:
+            if line.startswith('>'):
+                decoys_hd.write(line[1:].split()[0] + '\n')
+    return (decoys_file)
+
+def gentrome(transcriptome_fasta, genome_fasta, gentrome_file):
+    """Concatenates transcripts and genome (in this order) into the file given.
+
+    If both files are gzip compressed, they are concatenated as they are (gzip members)
+    into a compressed gentrome. Otherwise, a plain gentrome is written and compressed
+    files are decompressed.
+
+    :returns: gentrome file generated (.gz extension added if compressed)
+    """
+    compressed = transcriptome_fasta.endswith('.gz') and genome_fasta.endswith('.gz')
+    if compressed:
+        gentrome_file = gentrome_file + '.gz'
+
+    with open(gentrome_file, 'wb') as out_hd:
+        for fasta in (transcriptome_fasta, genome_fasta):
+            if compressed:
+                with open(fasta, 'rb') as in_hd:
+                    shutil.copyfileobj(in_hd, out_hd, 16*1024*1024)
+            else:
+                with compression.open_file(fasta, 'rb') as in_hd:
+                    shutil.copyfileobj(in_hd, out_hd, 16*1024*1024)
+    return (gentrome_file)
+
+def salmon_index(index_folder, transcriptome_fasta, threads, extra_index, Debug, genome_fasta=None):
+    """Builds salmon index for the transcripts provided, using the genome as decoy if provided
+
+    :param index_folder: Folder to store index files
+    :param transcriptome_fasta: Transcript sequences in fasta format (cDNA)
+    :param threads: Number of threads
+    :param extra_index: Additional options to include in the index call, e.g. -k 25
+    :param Debug: Print debugging messages or not
+    :param genome_fasta: Reference genome in fasta format (decoys)
+
+    :returns: Code returned by system call: OK/FAIL
+    """
+    salmon_exe = set_config.get_exe('salmon')
+
+    indexing = salmon_exe + ' index -p ' + str(threads) + ' -i ' + index_folder
+    if genome_fasta:
+        print ("+ Generating decoy-aware index: genome sequences used as decoys")
+        decoys_file = decoy_names(genome_fasta, os.path.join(index_folder, 'decoys.txt'))
+        gentrome_file = gentrome(transcriptome_fasta, genome_fasta, os.path.join(index_folder, 'gentrome.fa'))
+        indexing = indexing + ' -t ' + gentrome_file + ' -d ' + decoys_file
     else:
-        print("Transcriptome is already indexed")
-        print("Path to the index:", index_abs_path)
-    
-def salmon_quant(path_reference, index, reads_list, output, threads):
-    
-    path_index = os.path.join(path_reference, index) #path to the genome index
-    
-    #loop to check number of reads
-         
-    for i in reads_list: #for every list inside reads_list
-        if len(i) == 3: #if there are three elements it's a pair-end analysis
-            print("Pair-end analysis")
-            read1 = i[1] #reads forward 
-            read2 = i[2] #read reverse
-            outputs_name = i[0] #variable that will go through the functions, sample name
-            folder_results = os.path.join(output, outputs_name) #path to results folder + sample
-            os.mkdir(folder_results)
-            
-            path_results = os.path.join(folder_results, outputs_name)          
-            print ("Sample name", outputs_name, "\nRead forward:", read1, "\nRead reverse:", read2)
-
-            quant = "salmon quant -i" + path_index + " -p "+ threads + " -l A -1 " + read1 + " -2 " + read2 + " -o " + path_results
-            
-            print(quant)
-            os.system(quant)
-            
-        else:
-            print("Single-end analysis")
-            single_read = i[1] #single end analysis
-            outputs_name = i[0] #variable that will go through the functions 
-            folder_results = os.path.join(output, outputs_name) #path to results folder + sample
-            os.mkdir(folder_results)
-            
-            path_results = os.path.join(folder_results, outputs_name)
-            print ("Sample name", outputs_name, "\nSingle read:", single_read)
-            
-            quant = "salmon quant -i" + path_index + " -p "+ threads + " -l A -r " + single_read + " -o " + path_results
-            
-            print(quant)
-            os.system(quamnt)
-           
-
-### MAIN FUNCTION ###  
-    
-def main():
-    
-    parser = argparse.ArgumentParser (description = 'Indexation and mapping using HISAT2') #all arguments are mandatory 
-    parser.add_argument('-p', '--path_reference', help = 'Directory where the reference genome is, it will be the index directory too ', required = "TRUE")
-    parser.add_argument('-g', '--reference_genome', help = 'Name of the file containing the reference genome', required = "TRUE")
-    parser.add_argument('-i', '--index', help= 'It will create a folder called as your argument', required = "TRUE")
-    parser.add_argument('-r', '--path_reads', help='Path to your txt with the format: $PATH/sample_name;$PATH/read1;$PATH/read or $PATH/sample_name;$PATH/read1. IT IS VERY IMPORTANT TO MANTAIN THE ORDER OF THE ELEMENTS AND THAT THEY ARE SEPARATED BY ;', required = "TRUE")
-    parser.add_argument('-o', '--output', help= 'Path where the outputs will be created', required = "TRUE")
-    parser.add_argument('-t', '--threads', help = 'Choose how many threads you want to use to execute HISAT2')
-
-        
-    args = parser.parse_args() #interprets the arguments 
-    
-    # python3 salmon.py -p /home/mireia/IGTP/salmon -g cds.fa.gz -i index -r /home/mireia/IGTP/reads/reads2 -o results
-    
-    ## inputs for other functions (can't be called as args.)
-    
-    path_reference = args.path_reference
-    reference_genome = args.reference_genome
-    index = args.index
-    path_reads = args.path_reads
-    output = args.output 
-    threads = args.threads
-
-  
-    lines = open(path_reads).readlines() #read the txt with the information of the reads 
-    reads_list = [] #empty list
-    for i in lines: #for every sample
-        reads_list.append(i.strip().split(';')) #split the different camps
-        
-    # lines.close() #close document
-        
-    print("Reads in main", reads_list)
-    
-    
-
-
-    
-if __name__ == '__main__':
-    main()
-    
+        gentrome_file = None
+        indexing = indexing + ' -t ' + transcriptome_fasta
+    if extra_index:
+        indexing = indexing + ' ' + extra_index
+
+    if (Debug):
+        print (colored("**DEBUG: salmon index call **", 'yellow'))
+        print (indexing)
+
+    ## system call & return
+    code = HCGB_sys.system_call(indexing, False, True)
+    if gentrome_file:
+        os.remove(gentrome_file)
+    return(code)
+
+####QUANTIFICATION FUNCTION##################################################################################################################
+def salmon_quant(sample_name, index_folder, reads_list, output, threads, extra_params, Debug):
+    """Quantifies transcripts for a sample using salmon. Library type is automatically detected.
+
+    :param sample_name: Sample name
+    :param index_folder: salmon index folder
+    :param reads_list: List of reads (one: single-end; two: paired-end)
+    :param output: Output folder
+    :param threads: Number of threads
+    :param extra_params: Additional parameters for salmon quant
+    :param Debug: Print debugging messages or not
+
+    :returns: Code: OK/FAIL
+    """
+    salmon_exe = set_config.get_exe('salmon')
+    path_results = os.path.join(output, sample_name)
+
+    quant = salmon_exe + ' quant -i ' + index_folder + ' -l A -p ' + str(threads)
+    if len(reads_list) == 2: #if there are two elements it's a pair-end analysis
+        quant = quant + ' -1 ' + reads_list[0] + ' -2 ' + reads_list[1]
+    else:
+        quant = quant + ' -r ' + reads_list[0]
+    quant = quant + ' -o ' + output
+    if extra_params:
+        quant = quant + ' ' + extra_params
+    quant = quant + ' > ' + path_results + '.log 2> ' + path_results + '.err'
+
+    if (Debug):
+        print (colored("**DEBUG: salmon quant call **", 'yellow'))
+        print (quant)
+
+    ## system call & return
+    code = HCGB_sys.system_call(quant, False, True)
+    if code != "OK" or not os.path.isfile(os.path.join(output, quant_file_name)):
+        print (colored("** ERROR: salmon failed for sample %s. See %s" %(sample_name, path_results + '.err'), 'red'))
+        return ("FAIL")
+
+    print ("+ salmon quantification for %s: library type %s" %(sample_name, library_type(output)))
+    return (code)
+
+def library_type(output):
+    """Library type detected by salmon, e.g. ISR (see lib_format_counts.json)"""
+    lib_file = os.path.join(output, 'lib_format_counts.json')
+    if not os.path.isfile(lib_file):
+        return ("unknown")
+    with open(lib_file) as lib_hd:
+        return (json.load(lib_hd).get('expected_format', 'unknown'))
@@ -8,6 +8,10 @@
 
 import os
 import sys
+import glob
+import shutil
+import tempfile
+import subprocess
 ## import my modules
 from HCGB import functions
 from RSP.config import set_config
@@ -15,6 +19,72 @@ import HCGB.functions.system_call_functions as HCGB_sys
 from builtins import str
 from termcolor import colored
 
+#### SORT COMMAND ###########################################
+def sort_cmd(samtools_path, input_file, sorted_bam, threads, memory, tmp_prefix):
+    """Returns samtools sort command: input_file could be SAM/BAM or '-' (stdin)
+
+    :param samtools_path: samtools executable
+    :param input_file: SAM or BAM file or '-' to read from standard input
+    :param sorted_bam: Sorted BAM file to generate
+    :param threads: Threads for sorting and compression (-@)
+    :param memory: Maximum memory per thread (-m), e.g. 768M
+    :param tmp_prefix: Prefix for temporary files (-T)
+    """
+    return ("%s sort -@ %s -m %s -T %s -o %s %s" %(samtools_path, str(threads), str(memory), tmp_prefix, sorted_bam, input_file))
+
+#### INDEX ##################################################
+def index_bam(sorted_bam, threads, index_type="bai", Debug=False):
+    """Generates index for sorted BAM file: bai or csi (for chromosomes larger than 512 Mbp)
+
+    :returns: Index file or False if failed
+    """
+    samtools_path = set_config.get_exe('samtools', Debug=Debug)
+    option = "-c" if index_type == "csi" else "-b"
+    code = HCGB_sys.system_call("%s index %s -@ %s %s" %(samtools_path, option, str(threads), sorted_bam), False, True)
+    if code != "OK":
+        print (colored("** ERROR: An error occurred when indexing bam file: " + sorted_bam, 'red'))
+        return (False)
+    return (sorted_bam + "." + index_type)
+
+#### STREAM TO SORTED BAM ###################################
+def stream_to_sorted_bam(command, sorted_bam, threads, memory, errLog, sortLog, Debug):
+    """Sends output (SAM) of the command given to samtools sort, without intermediate files.
+
+    :param command: Command line writing SAM to standard output
+    :param sorted_bam: Sorted BAM file to generate
+    :param threads: Threads for samtools sort
+    :param memory: Maximum memory per thread for samtools sort, e.g. 768M
+    :param errLog: File to store standard error of command
+    :param sortLog: File to store standard error of samtools sort
+    :param Debug: Show debugging messages
+
+    :returns: OK or FAIL
+    """
+    samtools_path = set_config.get_exe('samtools', Debug=Debug)
+    sort_call = sort_cmd(samtools_path, '-', sorted_bam + '.tmp', threads, memory, sorted_bam + '.tmp_sort')
+
+    if (Debug):
+        print (colored("**DEBUG: stream to sorted BAM **", 'yellow'))
+        print (command + " | " + sort_call)
+
+    ## both processes must succeed: exit codes are checked for each one
+    with open(errLog, 'w') as err_hd, open(sortLog, 'w') as sort_hd:
+        producer = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=err_hd)
+        sorter = subprocess.Popen(sort_call, shell=True, stdin=producer.stdout, stderr=sort_hd)
+        producer.stdout.close()
+        sorter.wait()
+        producer.wait()
+
+    if producer.returncode != 0 or sorter.returncode != 0:
+        print (colored("** ERROR: Command failed (code %s) or samtools sort failed (code %s). See: %s" %(
+            producer.returncode, sorter.returncode, errLog), 'red'))
+        for tmp_file in glob.glob(sorted_bam + '.tmp*'):
+            os.remove(tmp_file)
+        return ("FAIL")
+
+    os.replace(sorted_bam + '.tmp', sorted_bam)
+    return ("OK")
+
 #### SAM TO BAM FUNCTION ####################################
 def sam_to_bam(path_results, path_sam, threads, Debug):
     
@@ -53,7 +123,7 @@ def bam_to_sorted_bam(path_results, path_bam, threads, Debug):
     
     print("+ Converting BAM to Sorted BAM")
     sorted_bam_name = path_results +".sorted.bam" #safe sorted bam into results folder
-    bam_to_sorted_bam = samtools_path + " sort "+ path_bam + " --threads " + str(threads) + " -o " + sorted_bam_name #samtools bam to sorted bam command
+    bam_to_sorted_bam = sort_cmd(samtools_path, path_bam, sorted_bam_name, threads, "768M", sorted_bam_name + ".tmp") #samtools bam to sorted bam command
 
     ## system call & return
     code = HCGB_sys.system_call(bam_to_sorted_bam)
@@ -64,13 +134,53 @@ def bam_to_sorted_bam(path_results, path_bam, threads, Debug):
     return(sorted_bam_name)
 
 #### SAM TO SORTED_BAM FUNCTION ###############
-def sam_to_sorted_bam(path_results, path_sam, threads, Debug):
-    print()
+def sam_to_sorted_bam(path_results, path_sam, threads, Debug, memory="768M", tmp_dir=None, index_type=None, remove_input=False):
+    """Converts SAM (or BAM) into a sorted BAM file in a single samtools sort call.
+
+    Temporary files are written in a folder within tmp_dir (e.g. local disk) and removed when finished.
+
+    :param path_results: Prefix for results: <path_results>.sorted.bam
+    :param path_sam: SAM or BAM file to sort
+    :param threads: Threads for samtools sort (-@)
+    :param Debug: Print debugging messages or not
+    :param memory: Maximum memory per thread (-m), e.g. 768M or 2G
+    :param tmp_dir: Folder for temporary files. Default: folder of results
+    :param index_type: bai or csi to index the sorted BAM. Default: no index
+    :param remove_input: Remove SAM file once sorted
+
+    :returns: Sorted BAM file or False if failed
+    """
+    samtools_path = set_config.get_exe('samtools', Debug=Debug)
+    sorted_bam_name = path_results + ".sorted.bam"
 
-    tmp_bam = sam_to_bam(path_results, path_sam, threads, Debug)
-    sorted_bam = bam_to_sorted_bam(path_results, tmp_bam, threads, Debug)
+    ## temporary folder for sort chunks
+    if not tmp_dir:
+        tmp_dir = os.path.dirname(os.path.abspath(sorted_bam_name))
+    tmp_folder = tempfile.mkdtemp(prefix='.samtools_sort_', dir=tmp_dir)
 
-    return(sorted_bam)
+    ## write index in the same call (--write-index) if available: bai or csi
+    sort_call = sort_cmd(samtools_path, path_sam, sorted_bam_name, threads, memory, os.path.join(tmp_folder, "chunk"))
+    if index_type:
+        sort_call = sort_call.replace(" -o " + sorted_bam_name, " -o %s##idx##%s.%s --write-index" %(sorted_bam_name, sorted_bam_name, index_type))
+
+    if (Debug):
+        print (colored("**DEBUG: samtools sort call **", 'yellow'))
+        print (sort_call)
+
+    print("+ Converting SAM to sorted BAM")
+    code = HCGB_sys.system_call(sort_call, False, True)
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+
+    if code!="OK":
+        print("An error occurred when sorting sam file: " + path_sam)
+        if os.path.isfile(sorted_bam_name):
+            os.remove(sorted_bam_name)
+        return(False)
+
+    if remove_input:
+        os.remove(path_sam)
+
+    return(sorted_bam_name)
    
 
 def main():
@@ -14,6 +14,7 @@ import time
 import io
 import os
 import re
+import json
 import subprocess
 import sys
 from sys import argv
@@ -23,15 +24,21 @@ from termcolor import colored
 import HCGB
 import HCGB.functions.time_functions as HCGB_time
 import HCGB.functions.system_call_functions as HCGB_sys
+from RSP.scripts import compression
 
 ################################################
-def trimmo_call(java_path, sample_folder, sample_name, files, trimmomatic_jar, threads, trimmomatic_params, Debug):
+def trimmo_call(java_path, sample_folder, sample_name, files, trimmomatic_jar, threads, trimmomatic_params, Debug, compress=False):
 	##
 	## Function to call trimmomatic using java. Can take single-end and pair-end files
 	## sample_folder must exists before calling this function. 
 	## It can be call from main or a module.
 	## Returns code OK/FAIL according if succeeded or failed the system call
 	## 
+	## Lean mode (trimmomatic_params['lean']): no trimlog is written (one line per read) and
+	## orphan reads are discarded (/dev/null) or compressed by Trimmomatic (.gz)
+	## If compress, reads are written into named pipes and compressed while written (bgzip/pigz)
+	## Summary statistics are stored in <sample_name>_trim_stats.json
+	##
 
 	#######################################
 	## http://www.usadellab.org/cms/?page=trimmomatic
@@ -54,6 +61,11 @@ def trimmo_call(java_path, sample_folder, sample_name, files, trimmomatic_jar, t
 	## log files
 	log_file = sample_folder + '/' + sample_name + '_call.log'
 	trimmo_log = sample_folder + '/' + sample_name + '.log'
+
+	## lean mode: discard/compress
+	lean = trimmomatic_params.get('lean')
+	extension = '.fastq.gz' if compress else '.fastq'
+	trimlog = "" if lean else "-trimlog %s " %log_file
 	
 	## init
 	file_R1 = ""
@@ -63,6 +75,15 @@ def trimmo_call(java_path, sample_folder, sample_name, files, trimmomatic_jar, t
 	trim_R2 = ""
 	orphan_R2 = ""
 
+	## compress: plain reads written into named pipes read by the compressor (see compression.start_fifo)
+	start_time = time.time()
+	jobs = {}
+	def output(out_file):
+		if compress and out_file != os.devnull:
+			jobs[out_file] = compression.start_fifo(out_file, max(1, int(threads) // 2))
+			return (jobs[out_file]['fifo'])
+		return (out_file)
+
 	## conda installation includes a wrapper and no java jar call is required
 	if trimmomatic_jar.endswith('jar'):
 		cmd = "%s -jar %s"  %(java_path, trimmomatic_jar)
@@ -76,19 +97,25 @@ def trimmo_call(java_path, sample_folder, sample_name, files, trimmomatic_jar, t
 		file_R2 = files[1]
 
 		#print ('\t-', file_R2)
-		trim_R1 = sample_folder + '/' + sample_name + '_trim_R1.fastq'
-		orphan_R1 = sample_folder + '/' + sample_name + '_orphan_R1.fastq'
-		trim_R2 = sample_folder + '/' + sample_name + '_trim_R2.fastq'
-		orphan_R2 = sample_folder + '/' + sample_name + '_orphan_R2.fastq'
-
-		cmd = cmd + " PE -threads %s -trimlog %s %s %s %s %s %s %s " %(threads, log_file, 
-																	file_R1, file_R2, trim_R1, 
-																	orphan_R1, trim_R2, orphan_R2)
+		trim_R1 = sample_folder + '/' + sample_name + '_trim_R1' + extension
+		orphan_R1 = sample_folder + '/' + sample_name + '_orphan_R1' + extension
+		trim_R2 = sample_folder + '/' + sample_name + '_trim_R2' + extension
+		orphan_R2 = sample_folder + '/' + sample_name + '_orphan_R2' + extension
+		if lean == "discard":
+			orphan_R1 = os.devnull
+			orphan_R2 = os.devnull
+		elif lean == "compress" and not compress:
+			orphan_R1 += '.gz'
+			orphan_R2 += '.gz'
+
+		cmd = cmd + " PE -threads %s %s%s %s %s %s %s %s " %(threads, trimlog, 
+																	file_R1, file_R2, output(trim_R1), 
+																	output(orphan_R1), output(trim_R2), output(orphan_R2))
 	else: ## single end
 		file_R1 = files[0]
-		trim_R1 = sample_folder + '/' + sample_name + '_trim.fastq'
+		trim_R1 = sample_folder + '/' + sample_name + '_trim' + extension
 
-		cmd = cmd + " SE -threads %s -trimlog %s %s %s " %(threads, log_file, file_R1, trim_R1)
+		cmd = cmd + " SE -threads %s %s%s %s " %(threads, trimlog, file_R1, output(trim_R1))
 
 	## common parameters
 	cmd = cmd + "ILLUMINACLIP:%s:%s LEADING:%s TRAILING:%s SLIDINGWINDOW:%s MINLEN:%s 2> %s" %(trimmomatic_params['adapters'], 
@@ -100,8 +127,39 @@ def trimmo_call(java_path, sample_folder, sample_name, files, trimmomatic_jar, t
 																								trimmo_log)
 	## system call & return
 	code = HCGB_sys.system_call(cmd)
+	if jobs:
+		raw_sizes = [ compression.finish_fifo(job) for job in jobs.values() ]
+		if None in raw_sizes:
+			code = 'FAIL'
+		elif (code == 'OK'):
+			compression.record_streamed(list(jobs), raw_sizes, time.time() - start_time, list(jobs.values())[0]['compressor'])
+	if (code == 'OK'):
+		write_stats(trimmo_log, sample_folder + '/' + sample_name + '_trim_stats.json')
 	return(code)	
 
+################################################
+def summary_stats(trimmo_log):
+	##
+	## Parses the summary line of Trimmomatic log, e.g.
+	## Input Read Pairs: 1000 Both Surviving: 900 (90.00%) Forward Only Surviving: 50 (5.00%) ...
+	## Returns dictionary: {'input_read_pairs': 1000, 'both_surviving': 900, ...}
+	##
+	stats = {}
+	with open(trimmo_log) as log_hd:
+		for line in log_hd:
+			if line.startswith("Input Read"):
+				for key, value in re.findall(r"([A-Z][A-Za-z ]*?): (\d+)", line):
+					stats[key.strip().lower().replace(" ", "_")] = int(value)
+	return (stats)
+
+################################################
+def write_stats(trimmo_log, stats_file):
+	## Writes summary statistics in a compact JSON file
+	stats = summary_stats(trimmo_log)
+	with open(stats_file, 'w') as stats_hd:
+		json.dump(stats, stats_hd, separators=(',', ':'))
+	return (stats)
+
 
 ################################################
 def	help_options():